@@ -5,6 +5,9 @@ from pathlib import Path
 from loguru import logger
 
 from .src.face_rec import load
+from .src.face_rec.pipeline import RegistrationCheckpoint
+from .src.face_rec.store import AnnIndexManager
+from .src.inference import create_router_from_config
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Face Store Initializer")
@@ -13,6 +16,11 @@ if __name__ == "__main__":
         action="store_true",
         help="Rebuild the face store from dataset (default: False)",
     )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Continue an interrupted --rebuild-store from its checkpoint instead of starting over (default: False)",
+    )
     parser.add_argument(
         "--face-store-dir",
         type=str,
@@ -25,6 +33,33 @@ if __name__ == "__main__":
         required=False,
         help="One or more dataset directories containing face images",
     )
+    parser.add_argument(
+        "--bulk",
+        action="store_true",
+        help="Register faces in batches with single-commit writes, without the streaming pipeline (default: False)",
+    )
+    parser.add_argument(
+        "--in-memory-index",
+        action="store_true",
+        help="Search faces with a resident numpy index (default: False)",
+    )
+    parser.add_argument(
+        "--index-dtype",
+        choices=["float32", "float16", "int8"],
+        default="float32",
+        help="Storage type of the in-memory index, compressed types re-rank exactly (default: float32)",
+    )
+    parser.add_argument(
+        "--ann-report",
+        action="store_true",
+        help="Build the approximate vector index and report recall vs latency against exhaustive search",
+    )
+    parser.add_argument(
+        "--backend",
+        choices=["hailo", "cpu", "synthetic"],
+        default=None,
+        help="Run the models on this backend, synthetic needs no device (default: INFERENCE_BACKEND)",
+    )
     parser.add_argument(
         "--recognize",
         nargs="+",
@@ -33,12 +68,24 @@ if __name__ == "__main__":
     )
     args = parser.parse_args()
 
-    rebuild_store = args.rebuild_store
+    rebuild_store = args.rebuild_store or args.resume
     if rebuild_store:
         logger.warning(f"Rebuild Requested")
 
-    preserve_past = not rebuild_store
-    recogniser = load(args.face_store_dir, preserve_past=preserve_past)
+    # the store is kept when resuming, the checkpoint lists what it has
+    preserve_past = not rebuild_store or args.resume
+    checkpoint = RegistrationCheckpoint(f"{args.face_store_dir}/rebuild.checkpoint")
+    if rebuild_store and not args.resume:
+        checkpoint.clear()
+    router = create_router_from_config(backend=args.backend)
+    recogniser = load(
+        args.face_store_dir,
+        preserve_past=preserve_past,
+        in_memory_index=args.in_memory_index,
+        index_dtype=args.index_dtype,
+        detector=router.detector,
+        embedding_model=router.embedding_model,
+    )
 
     if rebuild_store and args.faces:
         for path in args.faces:
@@ -47,14 +94,38 @@ if __name__ == "__main__":
             for file in Path(path).rglob("*"):
                 if file.suffix.lower() in (".png", ".jpg", ".jpeg"):
                     all_faces.append((file.stem.split("_")[0], str(file)))
-            face_ids = recogniser.register_faces_no_batch(all_faces)
+            if args.bulk:
+                report = recogniser.register_faces_bulk(all_faces)
+                logger.warning(
+                    f"Found {len(all_faces)} images: registered {report.registered}, "
+                    f"duplicates {report.duplicates}, skipped {report.skipped}, "
+                    f"failed {report.failed} ({report.imagesPerSecond} images/s)"
+                )
+                continue
+            report = recogniser.register_faces_pipelined(
+                all_faces, checkpoint=checkpoint.path
+            )
             logger.warning(
-                f"Found {len(all_faces)} images and registered {len(face_ids)} faces"
+                f"Found {len(all_faces)} images: registered {report.registered}, "
+                f"duplicates {report.duplicates}, skipped {report.skipped}, "
+                f"failed {report.failed}, done earlier {report.resumed} "
+                f"({report.imagesPerSecond} images/s)"
             )
-            if len(face_ids) < len(all_faces):
+            for stage in report.stages:
+                logger.warning(
+                    f"  {stage.name:>8}: {stage.items} items, "
+                    f"{stage.itemsPerSecond} items/s, {stage.utilization:.0%} busy"
+                )
+            if report.skipped:
                 logger.warning(
                     "Some images were skipped as there is no face in main faces in a single image "
                 )
+    if args.ann_report:
+        index_manager = AnnIndexManager(recogniser.faceVectorStore, min_rows=0)
+        if index_manager.status().indexType is None:
+            index_manager.build()
+        report = index_manager.recall_report()
+        print(report.model_dump_json(indent=2))
     if args.recognize:
         for path in args.recognize:
             result = recogniser.recognize_faces(path)
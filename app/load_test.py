@@ -0,0 +1,189 @@
+import argparse
+import random
+import threading
+import time
+from collections import defaultdict
+from pathlib import Path
+
+import requests
+import socketio
+
+# Load test of the web tier: virtual clients connect to the web workers in
+# turn and loop over the work of the app: upload an image, recognize it over
+# the socket, download the detected faces and query the store. Run it
+# against one web worker and against N, all using the same inference
+# service, e.g.
+#
+#   python -m src.inference &
+#   INFERENCE_SERVICE_ADDRESS=ipc:///tmp/ai_sessions-inference.sock \
+#       gunicorn -w 1 -k gthread --threads 32 -b 0.0.0.0:5000 src:application &
+#   ... same for ports 5001 - 5003
+#   python load_test.py --images ~/photos --urls http://localhost:5000
+#   python load_test.py --images ~/photos --urls http://localhost:500{0,1,2,3}
+#
+# Every connected client holds a thread of its web worker, hence --threads
+# above the number of clients per worker. The clients use the websocket
+# transport only, which needs no sticky sessions, and talk to the workers
+# directly rather than through nginx.
+
+
+class Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def record(self, operation, seconds):
+        with self.lock:
+            self.latencies[operation].append(seconds)
+
+    def error(self, operation):
+        with self.lock:
+            self.errors[operation] += 1
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[int(fraction * (len(values) - 1))] if values else 0.0
+
+
+def timed(stats, operation, fn):
+    start = time.perf_counter()
+    try:
+        result = fn()
+    except Exception:
+        stats.error(operation)
+        raise
+    stats.record(operation, time.perf_counter() - start)
+    return result
+
+
+def virtual_client(url, images, stats, deadline, timeout, seed):
+    rng = random.Random(seed)
+    http = requests.Session()
+    sio = socketio.Client(reconnection=False)
+    results = {}
+    result_ready = threading.Condition()
+
+    @sio.on("result")
+    def on_result(result):
+        with result_ready:
+            results[result["identifier"]] = result
+            result_ready.notify_all()
+
+    try:
+        timed(stats, "connect", lambda: sio.connect(url, transports=["websocket"]))
+    except Exception:
+        return
+    sid = sio.get_sid()
+    try:
+        while time.time() < deadline:
+            image = rng.choice(images)
+            try:
+                with open(image, "rb") as f:
+                    response = timed(
+                        stats,
+                        "upload",
+                        lambda: http.post(
+                            f"{url}/sessions/{sid}/upload",
+                            files={"media": (image.name, f)},
+                            timeout=timeout,
+                        ),
+                    )
+                response.raise_for_status()
+                identifier = response.json()["file_identifier"]
+
+                def recognize():
+                    with result_ready:
+                        results.pop(identifier, None)
+                        sio.emit("recognize", identifier)
+                        if not result_ready.wait_for(
+                            lambda: identifier in results, timeout=timeout
+                        ):
+                            raise TimeoutError(identifier)
+                    result = results.pop(identifier)
+                    if result["status"] != "success":
+                        raise RuntimeError(result.get("error"))
+                    return result
+
+                result = timed(stats, "recognize", recognize)
+                for face in result["faces"]:
+                    timed(
+                        stats,
+                        "face",
+                        lambda: http.get(
+                            f"{url}/sessions/{sid}/face/{face['image']}",
+                            timeout=timeout,
+                        ).raise_for_status(),
+                    )
+                timed(
+                    stats,
+                    "store",
+                    lambda: http.get(
+                        f"{url}/store/persons", timeout=timeout
+                    ).raise_for_status(),
+                )
+            except Exception:
+                # counted by timed; back off a little so that a failing
+                # worker isn't hammered
+                time.sleep(0.1)
+    finally:
+        sio.disconnect()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Web tier load test")
+    parser.add_argument(
+        "--urls",
+        nargs="+",
+        default=["http://localhost:5000"],
+        help="Web workers, the clients are spread over them",
+    )
+    parser.add_argument("--images", required=True, help="Directory of photos to upload")
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=60, help="seconds")
+    parser.add_argument("--timeout", type=float, default=60, help="seconds")
+    args = parser.parse_args()
+
+    images = [
+        path
+        for path in Path(args.images).rglob("*")
+        if path.suffix.lower() in (".png", ".jpg", ".jpeg")
+    ]
+    stats = Stats()
+    deadline = time.time() + args.duration
+    start = time.perf_counter()
+    clients = [
+        threading.Thread(
+            target=virtual_client,
+            args=(
+                args.urls[index % len(args.urls)],
+                images,
+                stats,
+                deadline,
+                args.timeout,
+                index,
+            ),
+            daemon=True,
+        )
+        for index in range(args.clients)
+    ]
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+    elapsed = time.perf_counter() - start
+
+    print(
+        f"{len(args.urls)} web workers, {args.clients} clients, {elapsed:.1f}s, "
+        f"{len(images)} images"
+    )
+    for operation in ["connect", "upload", "recognize", "face", "store"]:
+        latencies = stats.latencies[operation]
+        print(
+            f"{operation:>10}: {len(latencies) / elapsed:7.1f}/s, "
+            f"p50 {percentile(latencies, 0.5) * 1000:7.1f} ms, "
+            f"p95 {percentile(latencies, 0.95) * 1000:7.1f} ms, "
+            f"p99 {percentile(latencies, 0.99) * 1000:7.1f} ms, "
+            f"errors {stats.errors[operation]}"
+        )
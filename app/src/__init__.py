@@ -13,18 +13,30 @@ else:
 
 async_mode = "threading"
 
+import time
+
+# start of the import, for the startup timings of /readyz
+_import_started = time.perf_counter()
+
 from flask import Flask
 from flask_socketio import SocketIO
 
 from .ai_session import register_ai_session_handler
 from .chat import register_chat_apis
 from .common.config import ConfigClass
+from .common.readiness import readiness
+from .common.upload_file import UploadRequest
 from .main import register_main
 
+readiness.imported(_import_started)
+
 
 def app_factory(debug=False):
+    started = time.perf_counter()
     app = Flask(__name__)
     app.debug = debug
+    # uploads can be streamed to where they are kept
+    app.request_class = UploadRequest
     app.config["SECRET_KEY"] = ConfigClass.APP_SECRET
 
     socket = SocketIO()
@@ -36,8 +48,17 @@ def app_factory(debug=False):
     register_main(app=app, socket=socket)
     register_chat_apis(app=app, socket=socket)
     register_ai_session_handler(app=app, socket=socket)
+    readiness.app_built(started)
 
     return app, socket
 
 
-application, socketio = app_factory(debug=True)
+def __getattr__(name):
+    # The app is built on first access (gunicorn's src:application, run.py)
+    # rather than at import, so that processes running a submodule, like
+    # the inference service, don't build the web app along with it
+    global application, socketio
+    if name in ("application", "socketio"):
+        application, socketio = app_factory(debug=True)
+        return globals()[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -9,7 +9,7 @@ from .resources import register_sessions_resources
 
 
 def register_ai_session_handler(*, app: Flask, socket: SocketIO):
-    model = AISessionManager()
+    model = AISessionManager(socket=socket)
     bp = Blueprint("aisession", __name__, url_prefix="/sessions")
 
     register_sessions_resources(bp=bp, model=model)
@@ -17,7 +17,9 @@ def register_ai_session_handler(*, app: Flask, socket: SocketIO):
     app.register_blueprint(bp)
 
     store_bp = Blueprint("face_store", __name__, url_prefix="/store")
-    register_face_rec_resources(bp=store_bp, store=model.recogniser)
+    register_face_rec_resources(
+        bp=store_bp, store=model.recogniser, maintenance=model.maintenance
+    )
     app.register_blueprint(store_bp)
 
     pass
@@ -23,9 +23,9 @@ def register_ai_session_events(*, socket: SocketIO, model: AISessionManager):
         model.update_activity(sid)
         logger.info(f"Recognize {msg}: received")
         if model.recognize(sid=sid, identifier=msg):
-            logger.info(f"Recognize {msg}: succeeded")
+            logger.info(f"Recognize {msg}: queued")
         else:
-            logger.info(f"Recognize {msg}: failed")
+            logger.info(f"Recognize {msg}: rejected, queue is full")
         logger.info(f"Memory: {getMemory()}")
 
     @socket.on("disconnect")
@@ -1,20 +1,34 @@
 import os
+import re
 import shutil
 import threading
 import time
 from pathlib import Path
+from typing import List
 
-from flask_socketio import emit
-from PIL import Image
+from flask_socketio import SocketIO, emit
 
-from ..common import ConfigClass, TempFile
+from ..common import ConfigClass, UploadFile
+from ..common.readiness import readiness
 from ..face_rec import FaceRecognizer, load
+from ..face_rec.proc import DecodedImage
+from ..face_rec.proc.backends import warm_up
+from ..inference import (
+    connect,
+    create_maintenance_from_config,
+    create_router_from_config,
+)
 from loguru import logger
 
+from .scheduler import FairScheduler, InferenceJob, SchedulerFull
+
 
 class SessionState:
-    def __init__(self, sid):
+    def __init__(self, sid, socket: SocketIO = None):
         self.sid = sid
+        # emits from the scheduler thread, outside any request context, need
+        # the server object
+        self.socket = socket
         self.last_active = time.time()
         self.session_path = Path(ConfigClass.UPLOAD_STORAGE_LOCATION) / "sessions" / sid
         if not os.path.exists(self.session_path):
@@ -55,22 +69,37 @@ class SessionState:
         return path
 
     def save_uploaded_image(self, uploaded_file):
-        temp_file = TempFile(uploaded_file)
-        metadata = temp_file.metadata()
-        md5 = metadata.get("md5")
+        """
+        Keeps the upload in the uploaded directory under its md5. Uploads
+        streamed there by the request (UploadRequest) are renamed, others
+        are copied there, hashed in the same pass. A duplicate is removed
+        right away rather than kept as a second copy.
+        """
+        upload = uploaded_file.stream
+        if not isinstance(upload, UploadFile):
+            upload = UploadFile(self.uploaded_images_path, self.max_upload_bytes)
+            try:
+                upload.copy_from(uploaded_file.stream)
+            except Exception:
+                upload.discard()
+                raise
+        md5 = upload.md5
         _, ext = uploaded_file.filename.split(".", 1)
         unique_name = md5 + "." + ext
         file_path = self.uploaded_images_path / unique_name
-        result = {"file_identifier": unique_name, **metadata}
+        result = {"file_identifier": unique_name, "md5": md5}
         if file_path.exists():
+            upload.discard()
             result["status"] = "duplicate"
         else:
-            shutil.move(temp_file.path, file_path)
+            upload.keep(file_path)
             result["status"] = "success"
-        if temp_file:
-            temp_file.remove()
         return result
 
+    @property
+    def max_upload_bytes(self) -> int:
+        return int(ConfigClass.UPLOAD_MAX_MB * 1024 * 1024)
+
     def get_face_identity(self, image_identity, index):
         identifier = f"{image_identity}_{index}.png"
         face_path = self.generated_faces_path / identifier
@@ -85,49 +114,153 @@ class SessionState:
         face_path = self.generated_faces_path / identity
         return face_path.with_suffix(".npy")
 
-    def get_image_dimensions(self, image_path):
-        try:
-            with Image.open(image_path) as img:
-                return img.size
-        except Exception as e:
-            return None
-
-    def recognize(self, recogniser: FaceRecognizer, identifier: str):
+    def prepare_recognition(self, identifier: str):
+        """
+        The upload of identifier, decoded (the one decode of the request),
+        and the callback naming its faces; the image is None if there is no
+        such upload. Raises ValueError if it can't be decoded.
+        """
         self.emit_progress(f"Acquired hardware")
         file_path = self.uploaded_images_path / identifier
 
         if not os.path.exists(file_path):
-            return False, f"file {identifier} doesn't exists"
-        size = self.get_image_dimensions(file_path)
+            return None, None
+        image = DecodedImage.open(
+            file_path, max_side=ConfigClass.IMAGE_DECODE_MAX_SIDE or None
+        )
 
         callback = lambda index: self.get_face_identity(identifier, index)
+        return image, callback
 
-        result = recogniser.recognize_faces(
-            str(file_path), on_get_face_identity=callback
-        )
-
+    def recognition_result(self, faces, image: DecodedImage):
         self.emit_progress(f"faces detected")
+        logger.info(f"{image.path}: {image.describe_timings()}")
+        return {"faces": faces, "dimension": image.size}
+
+    def recognize(self, recogniser: FaceRecognizer, identifier: str):
+        image, callback = self.prepare_recognition(identifier)
+        if image is None:
+            return False, f"file {identifier} doesn't exists"
+
+        result = recogniser.recognize_faces(image, on_get_face_identity=callback)
 
-        return {"faces": result, "dimension": size}, None
+        return self.recognition_result(result, image), None
 
     def emit_progress(self, msg: str):
-        emit("progress", msg, to=self.sid)
+        if self.socket:
+            self.socket.emit("progress", msg, to=self.sid)
+        else:
+            emit("progress", msg, to=self.sid)
 
     def emit_result(self, result: str):
-        emit("result", result, to=self.sid)
+        if self.socket:
+            self.socket.emit("result", result, to=self.sid)
+        else:
+            emit("result", result, to=self.sid)
 
 
 class AISessionManager:
     NO_ACTIVITY_TIMEOUT = 60 * 60  # seconds
 
-    def __init__(self):
-        self.recogniser = load(ConfigClass.UPLOAD_STORAGE_LOCATION, preserve_past=True)
-        self.is_hw_in_use = False
-        self.resource_lock = threading.Lock()
+    def __init__(self, socket: SocketIO = None):
+        self.socket = socket
+        # in this process through the backend router, or in the service
+        self.router = None
+        if ConfigClass.INFERENCE_SERVICE_ADDRESS:
+            detector, embedding_model = connect(
+                ConfigClass.INFERENCE_SERVICE_ADDRESS,
+                timeout=ConfigClass.INFERENCE_TIMEOUT,
+            )
+        else:
+            self.router = create_router_from_config()
+            detector = self.router.detector
+            embedding_model = self.router.embedding_model
+        # with the service, other web workers write to the same store
+        self.recogniser = load(
+            ConfigClass.UPLOAD_STORAGE_LOCATION,
+            preserve_past=True,
+            in_memory_index=ConfigClass.FACE_STORE_IN_MEMORY,
+            index_dtype=ConfigClass.FACE_STORE_INDEX_DTYPE,
+            detector=detector,
+            embedding_model=embedding_model,
+            shared=bool(ConfigClass.INFERENCE_SERVICE_ADDRESS),
+        )
+        # the store is maintained by one process, the service when there is
+        # one
+        self.maintenance = None
+        if self.router:
+            self.maintenance = create_maintenance_from_config(self.recogniser)
+            self.maintenance.start()
+        self.scheduler = FairScheduler(
+            max_queue_per_session=ConfigClass.SCHEDULER_MAX_QUEUE_PER_SESSION,
+            max_queued=ConfigClass.SCHEDULER_MAX_QUEUED,
+            run_batch=self._run_recognize_batch,
+            max_batch=ConfigClass.RECOGNITION_MAX_BATCH,
+            batch_window=ConfigClass.RECOGNITION_BATCH_WINDOW_MS / 1000,
+            # a second job at a time can spill to the fallback backend
+            workers=2 if self.router and self.router.fallback else 1,
+        )
+        if self.router:
+            self.router.backlog = lambda: self.scheduler.queued
         self._clients = {}
+        self._warm_up_error = None
+        self.warmed_up = threading.Event()
+        readiness.register("models", self._models_readiness)
+        readiness.register("store", self._store_readiness)
+        if ConfigClass.WARM_UP_ON_START:
+            threading.Thread(target=self.warm_up, name="warm-up", daemon=True).start()
+
+    def warm_up(self):
+        """
+        Runs dummy inferences until they succeed: through every backend of
+        the router, or through the inference service, which waits for its
+        own warm-up.
+        """
+        while True:
+            try:
+                if self.router:
+                    seconds = self.router.warm_up()
+                else:
+                    seconds = warm_up(
+                        self.recogniser.detector, self.recogniser.embedding_model
+                    )
+                break
+            except Exception as e:
+                self._warm_up_error = str(e) or type(e).__name__
+                logger.warning(
+                    f"warm-up failed, retrying in "
+                    f"{ConfigClass.WARM_UP_RETRY_SECONDS}s: {self._warm_up_error}"
+                )
+                time.sleep(ConfigClass.WARM_UP_RETRY_SECONDS)
+        self._warm_up_error = None
+        readiness.warmed_up(seconds)
+        self.warmed_up.set()
+        logger.info(f"models warmed up in {seconds:.2f}s")
+        # logs the time to ready
+        readiness.check()
+
+    def _models_readiness(self):
+        # without the warm-up, the models load on the first request
+        if self.warmed_up.is_set() or not ConfigClass.WARM_UP_ON_START:
+            return None
+        if self._warm_up_error:
+            return f"warm-up failed: {self._warm_up_error}"
+        return "warming up"
+
+    def _store_readiness(self):
+        with self.recogniser.db.engine.connect() as connection:
+            connection.exec_driver_sql("SELECT 1")
+        self.recogniser.vectordb.table_names()
+        return None
+
+    def backend_stats(self) -> dict:
+        """The router's decisions and per-backend latencies, where it runs."""
+        if self.router:
+            return self.router.stats().model_dump()
+        return self.recogniser.detector.client.stats().get("backends", {})
 
     def create_session(self, sid: int):
-        session = SessionState(sid)
+        session = SessionState(sid, socket=self.socket)
         self._clients[sid] = session
         return session
 
@@ -139,6 +272,7 @@ class AISessionManager:
             raise Exception(f"Session {sid} doesn't exists, reconnect")
 
     def remove_client(self, sid):
+        self.scheduler.cancel_session(sid)
         session = self._clients.get(sid, None)
         if session:
             session.wipeout()
@@ -155,49 +289,130 @@ class AISessionManager:
         session = self._clients.get(sid, None)
         if session:
             return session
-        else:
-            raise Exception(f"Session {sid} doesn't exists, reconnect")
+        # connected to another web worker: the session lives on disk, which
+        # is all that uploads and downloads need
+        session_path = Path(ConfigClass.UPLOAD_STORAGE_LOCATION) / "sessions" / sid
+        if re.fullmatch(r"[\w-]+", sid) and session_path.is_dir():
+            return SessionState(sid, socket=self.socket)
+        raise Exception(f"Session {sid} doesn't exists, reconnect")
 
     def recognize(self, sid, identifier) -> bool:
+        """
+        Queues the request on the scheduler; the result is emitted when it
+        has run. Returns False when it was rejected because the queues are
+        full.
+        """
         session: SessionState = self._clients.get(sid, None)
         if not session:
             logger.warning(f"Session {sid} doesn't exists, reconnect")
             raise Exception(f"Session {sid} doesn't exists, reconnect")
         session.emit_progress(f"Received Face Recognition request for {identifier}")
-        with self.resource_lock:
-            if self.is_hw_in_use:
-                session.emit_result(
-                    {
-                        "identifier": identifier,
-                        "status": "failed",
-                        "error": f"Resource is busy",
-                    }
+        try:
+            self.scheduler.submit(
+                InferenceJob(
+                    sid=sid,
+                    identifier=identifier,
+                    run=lambda job: self._run_recognize(session, job),
+                    on_position=lambda job, ahead: session.emit_progress(
+                        f"Queued: {ahead} requests ahead of {identifier}"
+                    ),
                 )
-                return False
-            self.is_hw_in_use = True
-            logger.info(f"{identifier} acquired the resource")
+            )
+        except SchedulerFull as e:
+            session.emit_result(
+                {
+                    "identifier": identifier,
+                    "status": "failed",
+                    "error": str(e),
+                    "retryAfter": e.retry_after,
+                }
+            )
+            return False
+        return True
 
+    def _run_recognize(self, session: SessionState, job: InferenceJob):
+        identifier = job.identifier
+        if job.cancelled.is_set():
+            return
+        logger.info(f"{identifier} acquired the resource")
         try:
             result, error = session.recognize(self.recogniser, identifier)
-            if result:
+            if job.cancelled.is_set():
+                logger.info(f"{identifier} client is gone, result dropped")
+            elif result:
                 logger.info(f"{identifier} dispatching result ")
                 session.emit_result(
                     {"identifier": identifier, "status": "success", **result}
                 )
-                return True
             else:
                 logger.info(f"{identifier} reporting error")
                 session.emit_result(
                     {"identifier": identifier, "status": "failed", "error": error}
                 )
-                return False
         except Exception as e:
             logger.info(f"{identifier} reporting exception {e}")
-            session.emit_result(
-                {"identifier": identifier, "status": "exception", "error": str(e)}
+            if not job.cancelled.is_set():
+                session.emit_result(
+                    {"identifier": identifier, "status": "exception", "error": str(e)}
+                )
+            raise
+        finally:
+            logger.info(f"{identifier} release the resource")
+
+    def _run_recognize_batch(self, jobs: List[InferenceJob]):
+        """
+        Runs the recognition requests of several sessions as one batch and
+        sends every result to its own session. If the batch fails, the jobs
+        are run one by one, so that one bad image fails only its request.
+        """
+        pending = []
+        for job in jobs:
+            if job.cancelled.is_set():
+                continue
+            session = self._clients.get(job.sid, None)
+            if not session:
+                continue
+            try:
+                image, callback = session.prepare_recognition(job.identifier)
+                error = None if image else f"file {job.identifier} doesn't exists"
+            except Exception as e:
+                # one unreadable upload fails only its own request
+                error = str(e) or type(e).__name__
+            if error:
+                session.emit_result(
+                    {"identifier": job.identifier, "status": "failed", "error": error}
+                )
+                continue
+            pending.append((job, session, image, callback))
+        if not pending:
+            return
+        identifiers = ", ".join(job.identifier for job, *_ in pending)
+        logger.info(f"{identifiers} acquired the resource as a batch")
+        try:
+            results = self.recogniser.recognize_faces_batch(
+                [(image, callback) for _, _, image, callback in pending]
             )
-            return False
+        except Exception as e:
+            logger.warning(f"batch of {len(pending)} failed ({e}), running one by one")
+            for job, session, *_ in pending:
+                try:
+                    self._run_recognize(session, job)
+                except Exception:
+                    # reported to its session by _run_recognize
+                    pass
+            return
         finally:
-            logger.info(f"{identifier} release lock")
-            with self.resource_lock:
-                self.is_hw_in_use = False
+            logger.info(f"{identifiers} release the resource")
+
+        for (job, session, image, _), faces in zip(pending, results):
+            if job.cancelled.is_set():
+                logger.info(f"{job.identifier} client is gone, result dropped")
+                continue
+            logger.info(f"{job.identifier} dispatching result ")
+            session.emit_result(
+                {
+                    "identifier": job.identifier,
+                    "status": "success",
+                    **session.recognition_result(faces, image),
+                }
+            )
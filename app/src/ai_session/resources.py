@@ -6,8 +6,9 @@ from flask_smorest import Blueprint
 from flask_smorest.fields import Upload
 from loguru import logger
 from marshmallow import Schema, fields
+from werkzeug.exceptions import RequestEntityTooLarge
 
-from ..common import custom_error_handler
+from ..common import UploadRequest, custom_error_handler
 from .model import AISessionManager, SessionState
 
 
@@ -22,15 +23,37 @@ class UploadResponseSchema(Schema):
 
 
 def register_sessions_resources(*, bp: Blueprint, model: AISessionManager):
+    @bp.route("/scheduler")
+    class SchedulerStatus(MethodView):
+        @custom_error_handler
+        @bp.response(200)
+        def get(self):
+            return model.scheduler.stats().model_dump()
+
+    @bp.route("/backends")
+    class BackendStatus(MethodView):
+        @custom_error_handler
+        @bp.response(200)
+        def get(self):
+            return model.backend_stats()
+
     @bp.route("/<string:session_id>/upload")
     class SessionUpload(MethodView):
         @custom_error_handler
         @bp.response(201, UploadResponseSchema)
         def post(self, session_id):
+            uploaded_file = None
+            # written once, into the session's directory, when the app uses
+            # UploadRequest
+            streamed = isinstance(request._get_current_object(), UploadRequest)
             try:
                 logger.info(f"session id: {session_id}, upload request")
                 session: SessionState = model.get_session(session_id)
                 if session:
+                    if streamed:
+                        request.stream_uploads_to(
+                            session.uploaded_images_path, session.max_upload_bytes
+                        )
                     files = UploadFileSchema().load(request.files)
                     uploaded_file = files.get("media")
                     logger.info(
@@ -39,10 +62,17 @@ def register_sessions_resources(*, bp: Blueprint, model: AISessionManager):
                     result = session.save_uploaded_image(uploaded_file)
                     logger.info(f"successfully uploaded {uploaded_file.filename} ")
                     return result
+            except RequestEntityTooLarge as e:
+                logger.warning(f"session id: {session_id}, upload rejected: {e}")
+                raise
             except Exception as e:
-                logger.exception(f" failed to upload {uploaded_file.filename} ")
+                name = uploaded_file.filename if uploaded_file else ""
+                logger.exception(f" failed to upload {name} ")
                 logger.exception(f"{e}")
                 raise
+            finally:
+                if streamed:
+                    request.discard_uploads()
 
         @custom_error_handler
         @bp.response(200)
@@ -0,0 +1,414 @@
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Callable, Dict, List, Optional
+
+from loguru import logger
+from pydantic import BaseModel
+
+
+class SchedulerFull(Exception):
+    """Raised by FairScheduler.submit when a queue limit is reached."""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class SchedulerStats(BaseModel):
+    queued: int = 0
+    running: List[str] = []
+    sessions: Dict[str, int] = {}
+    completed: int = 0
+    failed: int = 0
+    rejected: int = 0
+    cancelled: int = 0
+    batches: int = 0
+    meanBatchSize: float = 0.0
+    # over the last `history` jobs, in seconds
+    meanWait: float = 0.0
+    p95Wait: float = 0.0
+    maxWait: float = 0.0
+    meanRun: float = 0.0
+
+
+class InferenceJob:
+    def __init__(
+        self,
+        sid: str,
+        identifier: str,
+        run: Callable[["InferenceJob"], None],
+        on_position: Optional[Callable[["InferenceJob", int], None]] = None,
+    ):
+        self.sid = sid
+        self.identifier = identifier
+        self.run = run
+        self.on_position = on_position
+        self.enqueued_at = time.perf_counter()
+        self.started_at: Optional[float] = None
+        self.position: Optional[int] = None
+        self.cancelled = threading.Event()
+
+
+class FairScheduler:
+    """
+    Owns the accelerator: jobs run on its worker thread(s), one by default.
+
+    Every session has its own FIFO queue and the worker takes one job per
+    session in turn (round robin), so a client submitting many images can't
+    starve the others. Queues are bounded per session and overall; beyond
+    that submit raises SchedulerFull with a retry hint instead of queueing
+    without limit. Queued jobs are told their position (jobs ahead of them)
+    whenever it changes, and cancel_session drops a disconnected client's
+    jobs.
+
+    With run_batch and max_batch > 1, the worker takes up to max_batch jobs
+    (still round robin, so across sessions), waiting at most batch_window
+    seconds for more to arrive, and hands them to run_batch together.
+
+    With workers > 1, that many jobs (or batches) run at the same time, for
+    a backend router that can spill the overflow to a second device.
+    """
+
+    def __init__(
+        self,
+        max_queue_per_session: int = 8,
+        max_queued: int = 64,
+        history: int = 1000,
+        run_batch: Optional[Callable[[List[InferenceJob]], None]] = None,
+        max_batch: int = 1,
+        batch_window: float = 0.0,
+        workers: int = 1,
+    ):
+        self.max_queue_per_session = max_queue_per_session
+        self.max_queued = max_queued
+        self.run_batch = run_batch
+        self.max_batch = max_batch if run_batch else 1
+        self.batch_window = batch_window
+        self._queues: "OrderedDict[str, deque]" = OrderedDict()
+        self._queued = 0
+        self._running: List[InferenceJob] = []
+        self._cond = threading.Condition()
+        self._waits = deque(maxlen=history)
+        self._runs = deque(maxlen=history)
+        self._completed = 0
+        self._failed = 0
+        self._rejected = 0
+        self._cancelled = 0
+        self._batches = 0
+        self._batched_jobs = 0
+        self._stop = False
+        self._threads = [
+            threading.Thread(
+                target=self._loop, name=f"inference-scheduler-{index}", daemon=True
+            )
+            for index in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, job: InferenceJob) -> InferenceJob:
+        with self._cond:
+            session_queue = self._queues.get(job.sid)
+            depth = len(session_queue) if session_queue else 0
+            if depth >= self.max_queue_per_session or self._queued >= self.max_queued:
+                self._rejected += 1
+                limit = (
+                    f"{depth} requests of this session are already queued"
+                    if depth >= self.max_queue_per_session
+                    else f"{self._queued} requests are already queued"
+                )
+                raise SchedulerFull(
+                    f"Resource is busy: {limit}",
+                    retry_after=self._estimate_wait(depth + 1),
+                )
+            if session_queue is None:
+                session_queue = self._queues[job.sid] = deque()
+            session_queue.append(job)
+            self._queued += 1
+            self._cond.notify_all()
+            updates = self._positions()
+        self._notify(updates)
+        return job
+
+    def cancel_session(self, sid: str) -> int:
+        """Drops the queued jobs of sid and flags its running job."""
+        with self._cond:
+            session_queue = self._queues.pop(sid, None) or deque()
+            for job in session_queue:
+                job.cancelled.set()
+            self._queued -= len(session_queue)
+            self._cancelled += len(session_queue)
+            for job in self._running:
+                if job.sid == sid:
+                    job.cancelled.set()
+            updates = self._positions()
+        self._notify(updates)
+        if session_queue:
+            logger.info(f"scheduler: cancelled {len(session_queue)} jobs of {sid}")
+        return len(session_queue)
+
+    @property
+    def queued(self) -> int:
+        """Jobs waiting, not running yet."""
+        return self._queued
+
+    def stats(self) -> SchedulerStats:
+        with self._cond:
+            waits = sorted(self._waits)
+            return SchedulerStats(
+                queued=self._queued,
+                running=[job.identifier for job in self._running],
+                sessions={sid: len(jobs) for sid, jobs in self._queues.items()},
+                completed=self._completed,
+                failed=self._failed,
+                rejected=self._rejected,
+                cancelled=self._cancelled,
+                meanWait=round(sum(waits) / len(waits), 3) if waits else 0.0,
+                p95Wait=round(waits[int(0.95 * (len(waits) - 1))], 3) if waits else 0.0,
+                maxWait=round(waits[-1], 3) if waits else 0.0,
+                meanRun=(
+                    round(sum(self._runs) / len(self._runs), 3) if self._runs else 0.0
+                ),
+                batches=self._batches,
+                meanBatchSize=(
+                    round(self._batched_jobs / self._batches, 2)
+                    if self._batches
+                    else 0.0
+                ),
+            )
+
+    def stop(self):
+        with self._cond:
+            self._stop = True
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join()
+
+    def _estimate_wait(self, jobs: int) -> float:
+        # _runs holds the duration of each run, a batch counts once
+        mean_run = sum(self._runs) / len(self._runs) if self._runs else 1.0
+        batches = -(-max(jobs, 1) // self.max_batch)
+        return round(mean_run * batches, 1)
+
+    def _next(self) -> Optional[InferenceJob]:
+        # the first session in the rotation goes to the back once served
+        for sid in list(self._queues):
+            session_queue = self._queues[sid]
+            if not session_queue:
+                del self._queues[sid]
+                continue
+            job = session_queue.popleft()
+            self._queued -= 1
+            if session_queue:
+                self._queues.move_to_end(sid)
+            else:
+                del self._queues[sid]
+            return job
+        return None
+
+    def _positions(self) -> List[tuple]:
+        """
+        Jobs ahead of every queued job in round robin order (plus the running
+        one), for the jobs whose position changed.
+        """
+        depths = [len(jobs) for jobs in self._queues.values()]
+        running = len(self._running)
+        updates = []
+        for rank, jobs in enumerate(self._queues.values()):
+            for index, job in enumerate(jobs):
+                # sessions before this one in the rotation serve index + 1
+                # jobs before it, the ones after it serve index
+                ahead = running + sum(
+                    min(depth, index + (1 if other < rank else 0))
+                    for other, depth in enumerate(depths)
+                )
+                if job.position != ahead:
+                    job.position = ahead
+                    updates.append((job, ahead))
+        return updates
+
+    def _notify(self, updates):
+        for job, ahead in updates:
+            if job.on_position and not job.cancelled.is_set():
+                try:
+                    job.on_position(job, ahead)
+                except Exception as e:
+                    logger.warning(f"scheduler: position update failed: {e}")
+
+    def _take_batch(self) -> List[InferenceJob]:
+        batch = [self._next()]
+        deadline = time.perf_counter() + self.batch_window
+        while len(batch) < self.max_batch:
+            if self._queued:
+                batch.append(self._next())
+                continue
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0 or self._stop:
+                break
+            self._cond.wait(remaining)
+        return batch
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while not self._stop and not self._queued:
+                    self._cond.wait()
+                if self._stop:
+                    return
+                batch = self._take_batch()
+                started_at = time.perf_counter()
+                for job in batch:
+                    job.started_at = started_at
+                    self._waits.append(started_at - job.enqueued_at)
+                self._running.extend(batch)
+                updates = self._positions()
+            self._notify(updates)
+
+            failed = 0
+            if len(batch) > 1:
+                try:
+                    self.run_batch(batch)
+                except Exception as e:
+                    failed = len(batch)
+                    logger.exception(f"scheduler: batch of {len(batch)} failed: {e}")
+            else:
+                job = batch[0]
+                try:
+                    job.run(job)
+                except Exception as e:
+                    failed = 1
+                    logger.exception(f"scheduler: {job.identifier} failed: {e}")
+            with self._cond:
+                self._runs.append(time.perf_counter() - started_at)
+                self._running = [job for job in self._running if job not in batch]
+                self._batches += 1
+                self._batched_jobs += len(batch)
+                self._failed += failed
+                self._completed += len(batch) - failed
+
+
+if __name__ == "__main__":
+    # Recognition requests of several sessions through a FaceRecognizer
+    # (decode, recognize_faces / recognize_faces_batch, crops written) on
+    # the models of --backend, batching off vs on. Without --images, random
+    # frames are used, in which only the synthetic backend finds faces; its
+    # device cost is set by SYNTHETIC_CALL_MS and SYNTHETIC_IMAGE_MS:
+    #   python -m src.ai_session.scheduler [--backend synthetic] [--images DIR]
+    import argparse
+    import os
+    import random
+    import tempfile
+    from pathlib import Path
+
+    import cv2
+    import numpy as np
+
+    from ..common import ConfigClass
+    from ..face_rec import load
+    from ..face_rec.proc import DecodedImage
+    from ..inference import create_router_from_config
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--backend", default=ConfigClass.INFERENCE_BACKEND)
+    parser.add_argument("--images", default=None, help="directory of images")
+    parser.add_argument("--sessions", type=int, default=8)
+    parser.add_argument("--rate", type=float, default=60, help="requests/s, total")
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--max-batch", type=int, default=8)
+    parser.add_argument("--window-ms", type=float, default=5)
+    args = parser.parse_args()
+    logger.remove()
+
+    workdir = tempfile.mkdtemp(prefix="scheduler-benchmark-")
+    if args.images:
+        images = sorted(
+            str(path)
+            for path in Path(args.images).iterdir()
+            if path.suffix.lower() in (".jpg", ".jpeg", ".png")
+        )
+    else:
+        generator = np.random.default_rng(0)
+        images = []
+        for index in range(16):
+            images.append(os.path.join(workdir, f"frame{index}.png"))
+            cv2.imwrite(
+                images[-1], generator.integers(0, 256, (720, 1280, 3), np.uint8)
+            )
+    router = create_router_from_config(args.backend)
+    router.warm_up()
+    recogniser = load(
+        os.path.join(workdir, "store"),
+        preserve_past=False,
+        detector=router.detector,
+        embedding_model=router.embedding_model,
+    )
+    os.makedirs(os.path.join(workdir, "faces"))
+
+    def request(job):
+        """The decoded image and the identity callback of job's request."""
+        path = images[int(job.identifier[len("request") :]) % len(images)]
+        prefix = os.path.join(workdir, "faces", job.identifier)
+        return DecodedImage.open(path), lambda index: (
+            f"{prefix}_{index}.png",
+            f"{prefix}_{index}.npy",
+            f"{job.identifier}_{index}",
+        )
+
+    def simulate(max_batch: int, window: float):
+        done = {}
+
+        def run_batch(jobs):
+            recogniser.recognize_faces_batch([request(job) for job in jobs])
+            finished = time.perf_counter()
+            for job in jobs:
+                done[job.identifier] = finished - job.enqueued_at
+
+        def run(job):
+            recogniser.recognize_faces(*request(job))
+            done[job.identifier] = time.perf_counter() - job.enqueued_at
+
+        scheduler = FairScheduler(
+            max_queue_per_session=args.requests,
+            max_queued=args.requests,
+            run_batch=run_batch,
+            max_batch=max_batch,
+            batch_window=window,
+        )
+        rng = random.Random(0)
+        start = time.perf_counter()
+        for index in range(args.requests):
+            time.sleep(rng.expovariate(args.rate))
+            scheduler.submit(
+                InferenceJob(
+                    sid=f"session{rng.randrange(args.sessions)}",
+                    identifier=f"request{index}",
+                    run=run,
+                )
+            )
+        while len(done) < args.requests:
+            time.sleep(0.01)
+        elapsed = time.perf_counter() - start
+        stats = scheduler.stats()
+        scheduler.stop()
+        latencies = sorted(done.values())
+        return (
+            args.requests / elapsed,
+            latencies[len(latencies) // 2] * 1000,
+            latencies[int(0.99 * (len(latencies) - 1))] * 1000,
+            stats.meanBatchSize,
+        )
+
+    print(
+        f"{args.sessions} sessions, {args.rate} requests/s offered, "
+        f"{len(images)} images, {args.backend} backend"
+    )
+    for label, max_batch, window in [
+        ("batching off", 1, 0.0),
+        ("batching on", args.max_batch, args.window_ms / 1000),
+    ]:
+        throughput, p50, p99, batch_size = simulate(max_batch, window)
+        print(
+            f"{label:>13}: {throughput:6.1f} requests/s, p50 {p50:7.1f} ms, "
+            f"p99 {p99:7.1f} ms, mean batch {batch_size}"
+        )
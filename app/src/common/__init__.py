@@ -1,3 +1,4 @@
 from .config import ConfigClass
 from .error_handler import custom_error_handler
 from .temp_file import TempFile
+from .upload_file import UploadFile, UploadRequest
@@ -22,8 +22,89 @@ def get_required_env_variable(var_name):
     return value
 
 
+def get_bool_env_variable(var_name, default: bool = False) -> bool:
+    value = os.environ.get(var_name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def get_float_env_variable(var_name, default: float) -> float:
+    value = os.environ.get(var_name)
+    if value is None:
+        return default
+    return float(value)
+
+
 class ConfigClass(object):
     UPLOAD_STORAGE_LOCATION = get_required_env_variable("UPLOAD_STORAGE_LOCATION")
     APP_SECRET = get_required_env_variable("APP_SECRET")
     HOST_NAME = get_required_env_variable("HOST_NAME")
     APP_NAME = "ai." + get_unique_device_id(HOST_NAME)
+    # Keep a resident numpy copy of the face vectors for faster search; only
+    # for a single web worker (refused with INFERENCE_SERVICE_ADDRESS, the
+    # copy wouldn't see the faces registered through the other workers)
+    FACE_STORE_IN_MEMORY = get_bool_env_variable("FACE_STORE_IN_MEMORY")
+    # float32, float16 or int8 storage of the in-memory index
+    FACE_STORE_INDEX_DTYPE = os.environ.get("FACE_STORE_INDEX_DTYPE", "float32")
+    # Background compaction / version cleanup of the face vector table, run
+    # by the inference service when there is one
+    VECTOR_STORE_MAINTENANCE_INTERVAL = get_float_env_variable(
+        "VECTOR_STORE_MAINTENANCE_INTERVAL", 600
+    )
+    VECTOR_STORE_MAX_FRAGMENTS = int(
+        get_float_env_variable("VECTOR_STORE_MAX_FRAGMENTS", 32)
+    )
+    VECTOR_STORE_MAX_DELETED_RATIO = get_float_env_variable(
+        "VECTOR_STORE_MAX_DELETED_RATIO", 0.1
+    )
+    VECTOR_STORE_KEEP_VERSIONS_HOURS = get_float_env_variable(
+        "VECTOR_STORE_KEEP_VERSIONS_HOURS", 1
+    )
+    # Approximate vector index, built once the table passes this many rows
+    VECTOR_INDEX_MIN_ROWS = int(get_float_env_variable("VECTOR_INDEX_MIN_ROWS", 50000))
+    # Inference requests waiting for the accelerator, per session and overall
+    SCHEDULER_MAX_QUEUE_PER_SESSION = int(
+        get_float_env_variable("SCHEDULER_MAX_QUEUE_PER_SESSION", 8)
+    )
+    SCHEDULER_MAX_QUEUED = int(get_float_env_variable("SCHEDULER_MAX_QUEUED", 64))
+    # Recognition requests of different sessions run together, up to this
+    # many, waiting this long for the batch to fill
+    RECOGNITION_MAX_BATCH = int(get_float_env_variable("RECOGNITION_MAX_BATCH", 8))
+    RECOGNITION_BATCH_WINDOW_MS = get_float_env_variable(
+        "RECOGNITION_BATCH_WINDOW_MS", 5
+    )
+    # Address of the inference service (python -m src.inference), e.g.
+    # ipc:///tmp/ai_sessions-inference.sock; empty to run the models in this
+    # process, which then must be the only web worker
+    INFERENCE_SERVICE_ADDRESS = os.environ.get("INFERENCE_SERVICE_ADDRESS", "")
+    # Seconds a web worker waits for a reply; the service drops the requests
+    # and the reply files of workers that stopped waiting
+    INFERENCE_TIMEOUT = get_float_env_variable("INFERENCE_TIMEOUT", 30)
+    # Requests the inference service holds (running and waiting) before it
+    # answers the next ones "busy" right away
+    INFERENCE_MAX_PENDING = int(get_float_env_variable("INFERENCE_MAX_PENDING", 64))
+    # Backends running the models: hailo, cpu or synthetic. Calls spill to
+    # the fallback (if any) once INFERENCE_SPILL_QUEUE calls are in flight
+    # on or waiting for the primary
+    INFERENCE_BACKEND = os.environ.get("INFERENCE_BACKEND", "hailo")
+    INFERENCE_FALLBACK_BACKEND = os.environ.get("INFERENCE_FALLBACK_BACKEND", "")
+    INFERENCE_SPILL_QUEUE = int(get_float_env_variable("INFERENCE_SPILL_QUEUE", 2))
+    # ONNX files of the CPU backend's models (YuNet and ArcFace run by
+    # OpenCV); empty for the ones in src/face_rec/zoo/opencv
+    CPU_DETECTION_MODEL = os.environ.get("CPU_DETECTION_MODEL", "")
+    CPU_EMBEDDING_MODEL = os.environ.get("CPU_EMBEDDING_MODEL", "")
+    # Simulated cost of the synthetic backend
+    SYNTHETIC_CALL_MS = get_float_env_variable("SYNTHETIC_CALL_MS", 0)
+    SYNTHETIC_IMAGE_MS = get_float_env_variable("SYNTHETIC_IMAGE_MS", 0)
+    # Uploads are decoded once per recognition, photos at least twice this
+    # size on their longest side at a reduced resolution (never below it);
+    # 0 decodes at full resolution
+    IMAGE_DECODE_MAX_SIDE = int(get_float_env_variable("IMAGE_DECODE_MAX_SIDE", 1920))
+    # Largest accepted upload; longer requests are rejected before their
+    # body is read
+    UPLOAD_MAX_MB = get_float_env_variable("UPLOAD_MAX_MB", 100)
+    # Dummy inferences warm the models up in the background after startup,
+    # /readyz reports ready once they ran; retried this often while failing
+    WARM_UP_ON_START = get_bool_env_variable("WARM_UP_ON_START", True)
+    WARM_UP_RETRY_SECONDS = get_float_env_variable("WARM_UP_RETRY_SECONDS", 5)
@@ -4,7 +4,7 @@ from functools import wraps
 # from loguru import logger
 from flask import request
 from marshmallow import ValidationError
-from werkzeug.exceptions import InternalServerError, NotFound
+from werkzeug.exceptions import InternalServerError, NotFound, RequestEntityTooLarge
 
 
 def custom_error_handler(func):
@@ -24,6 +24,9 @@ def custom_error_handler(func):
             elif isinstance(err, NotFound):
                 response["error"] = {"error": str(err)}
                 response["code"] = 404
+            elif isinstance(err, RequestEntityTooLarge):
+                response["error"] = {"error": str(err)}
+                response["code"] = 413
             elif isinstance(err, InternalServerError):
                 response["error"] = {"error": str(err)}
                 response["code"] = 500
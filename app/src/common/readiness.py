@@ -0,0 +1,83 @@
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+from loguru import logger
+
+
+class Readiness:
+    """
+    Startup state of the process for /healthz and /readyz. Components
+    register named checks, a check returns None when its part is ready and a
+    short reason otherwise (raising counts as not ready). Also keeps the
+    startup timings: the import of src, the build of the app, the warm-up
+    and the time from the start of the import to the first ready report.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.import_seconds: Optional[float] = None
+        self.app_seconds: Optional[float] = None
+        self.warm_up_seconds: Optional[float] = None
+        self.time_to_ready: Optional[float] = None
+        self._checks: Dict[str, Callable[[], Optional[str]]] = {}
+        self._lock = threading.Lock()
+
+    def imported(self, started: float):
+        """The import of src, which began at perf_counter() started, is done."""
+        self.started = started
+        self.import_seconds = time.perf_counter() - started
+
+    def app_built(self, started: float):
+        self.app_seconds = time.perf_counter() - started
+
+    def warmed_up(self, seconds: float):
+        self.warm_up_seconds = seconds
+
+    def register(self, name: str, check: Callable[[], Optional[str]]):
+        with self._lock:
+            self._checks[name] = check
+
+    def uptime(self) -> float:
+        return time.perf_counter() - self.started
+
+    def check(self) -> Dict[str, str]:
+        """The reasons of the checks that aren't ready, by name."""
+        with self._lock:
+            checks = dict(self._checks)
+        waiting = {}
+        for name, check in checks.items():
+            try:
+                reason = check()
+            except Exception as e:
+                reason = str(e) or type(e).__name__
+            if reason:
+                waiting[name] = reason
+        if not checks:
+            waiting["app"] = "starting"
+        if not waiting and self.time_to_ready is None:
+            self.time_to_ready = self.uptime()
+            logger.info(
+                f"ready {self.time_to_ready:.2f}s after start: import "
+                f"{self._seconds(self.import_seconds)}, app "
+                f"{self._seconds(self.app_seconds)}, warm-up "
+                f"{self._seconds(self.warm_up_seconds)}"
+            )
+        return waiting
+
+    def metrics(self) -> dict:
+        return {
+            "uptimeSeconds": self.uptime(),
+            "importSeconds": self.import_seconds,
+            "appSeconds": self.app_seconds,
+            "warmUpSeconds": self.warm_up_seconds,
+            "timeToReadySeconds": self.time_to_ready,
+        }
+
+    @staticmethod
+    def _seconds(value: Optional[float]) -> str:
+        return "-" if value is None else f"{value:.2f}s"
+
+
+# the one of the process
+readiness = Readiness()
@@ -22,17 +22,18 @@ class TempFile:
         while os.path.exists(temp_path):
             temp_path = f"{base}_{counter}{ext}"
             counter += 1
-        file.save(temp_path)
+        # hashed while it is written, rather than read back for metadata()
+        hash_md5 = hashlib.md5()
+        with open(temp_path, "wb") as f:
+            for chunk in iter(lambda: file.stream.read(64 * 1024), b""):
+                hash_md5.update(chunk)
+                f.write(chunk)
         self.path = temp_path
+        self.md5 = hash_md5.hexdigest()
 
     def metadata(self):
         # TODO: use clmedia, currently has version conflict for numpy
-        hash_md5 = hashlib.md5()
-        with open(self.path, "rb") as f:
-            for chunk in iter(lambda: f.read(4096), b""):
-                hash_md5.update(chunk)
-            md5 = hash_md5.hexdigest()
-        metadata = {"md5": md5}
+        metadata = {"md5": self.md5}
         return metadata
 
     def remove(self) -> None:
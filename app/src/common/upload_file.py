@@ -0,0 +1,178 @@
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+from typing import List, Optional
+
+from flask import Request
+from werkzeug.exceptions import RequestEntityTooLarge
+
+# Room for the multipart framing and the other fields of an upload request
+_FORM_OVERHEAD = 64 * 1024
+
+
+class UploadFile(io.FileIO):
+    """
+    A file in the directory the upload is meant for, hashed while it is
+    written (one pass, nothing is read back) and limited to max_bytes.
+    Until keep() moves it to its final name, it is a hidden .part file;
+    discard() removes it.
+    """
+
+    def __init__(self, directory, max_bytes: Optional[int] = None):
+        fd, path = tempfile.mkstemp(prefix=".upload-", suffix=".part", dir=directory)
+        super().__init__(fd, "r+")
+        self.path = path
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.kept = False
+        self._md5 = hashlib.md5()
+
+    def write(self, data) -> int:
+        self.size += len(data)
+        if self.max_bytes and self.size > self.max_bytes:
+            self.discard()
+            raise RequestEntityTooLarge(
+                f"uploads are limited to {self.max_bytes} bytes"
+            )
+        self._md5.update(data)
+        view = memoryview(data)
+        while view:
+            view = view[super().write(view) :]
+        return len(data)
+
+    def copy_from(self, stream):
+        shutil.copyfileobj(stream, self, 64 * 1024)
+
+    @property
+    def md5(self) -> str:
+        return self._md5.hexdigest()
+
+    def keep(self, path):
+        """Moves the file to path, a rename as it is on the same volume."""
+        self.close()
+        os.replace(self.path, path)
+        self.kept = True
+
+    def discard(self):
+        self.close()
+        if not self.kept and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class UploadRequest(Request):
+    """
+    Flask's request, able to stream the file uploads of a request into
+    UploadFiles of one directory instead of spooling them to a temporary
+    file first. Off unless stream_uploads_to() is called before the form is
+    read.
+    """
+
+    upload_directory = None
+    max_upload_bytes = None
+
+    def stream_uploads_to(self, directory, max_bytes: Optional[int] = None):
+        """
+        Streams the uploads of this request into directory. With max_bytes,
+        a request announcing a longer body is rejected before any of it is
+        read, and an upload growing past it as soon as it does.
+        """
+        self.upload_directory = directory
+        self.max_upload_bytes = max_bytes
+        self.upload_files: List[UploadFile] = []
+        if max_bytes:
+            self.max_content_length = max_bytes + _FORM_OVERHEAD
+
+    def discard_uploads(self):
+        """Removes the uploads of this request that weren't kept."""
+        for upload in getattr(self, "upload_files", []):
+            upload.discard()
+
+    def _get_file_stream(
+        self, total_content_length, content_type, filename=None, content_length=None
+    ):
+        if self.upload_directory is None:
+            return super()._get_file_stream(
+                total_content_length, content_type, filename, content_length
+            )
+        upload = UploadFile(self.upload_directory, max_bytes=self.max_upload_bytes)
+        self.upload_files.append(upload)
+        return upload
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    from flask import Flask
+    from flask import request as current_request
+
+    # Upload of a large photo through the form parser, as it was (werkzeug
+    # spools it to a temporary file, TempFile copies it to /tmp and reads it
+    # back for the md5, shutil.move copies it to the data volume) and
+    # streamed into its directory. Run it with --directory on the volume of
+    # the uploads, e.g. the SD card:
+    #   python -m src.common.upload_file --directory /data/benchmark --sizes 10 30 50
+    parser = argparse.ArgumentParser(description="Upload benchmark")
+    parser.add_argument("--directory", required=True, help="where uploads are kept")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 30, 50], help="MB")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    os.makedirs(args.directory, exist_ok=True)
+
+    def save_before(uploaded_file):
+        temp_path = os.path.join(tempfile.gettempdir(), uploaded_file.filename)
+        uploaded_file.save(temp_path)
+        hash_md5 = hashlib.md5()
+        with open(temp_path, "rb") as f:
+            for chunk in iter(lambda: f.read(4096), b""):
+                hash_md5.update(chunk)
+        path = os.path.join(args.directory, hash_md5.hexdigest() + ".jpg")
+        shutil.move(temp_path, path)
+        return path
+
+    def save_streamed(uploaded_file):
+        upload = uploaded_file.stream
+        path = os.path.join(args.directory, upload.md5 + ".jpg")
+        upload.keep(path)
+        return path
+
+    app = Flask(__name__)
+    app.request_class = UploadRequest
+    saved = []
+
+    @app.post("/before")
+    def before():
+        saved.append(save_before(current_request.files["media"]))
+        return ""
+
+    @app.post("/streamed")
+    def streamed():
+        current_request.stream_uploads_to(args.directory)
+        saved.append(save_streamed(current_request.files["media"]))
+        return ""
+
+    client = app.test_client()
+    for size in args.sizes:
+        data = os.urandom(size * 1024 * 1024)
+        for name in ["before", "streamed"]:
+            seconds = []
+            for _ in range(args.repeat):
+                # the page cache would hide the cost of the writes
+                os.sync()
+                start = time.perf_counter()
+                client.post(
+                    f"/{name}",
+                    data={"media": (io.BytesIO(data), "photo.jpg")},
+                    content_type="multipart/form-data",
+                )
+                os.sync()
+                seconds.append(time.perf_counter() - start)
+                for path in saved:
+                    os.remove(path)
+                saved.clear()
+            print(
+                f"{size:4d}MB {name:>9}: {min(seconds) * 1000:8.1f}ms "
+                f"({size / min(seconds):.0f}MB/s)"
+            )
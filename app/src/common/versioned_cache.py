@@ -0,0 +1,43 @@
+import threading
+from collections import OrderedDict
+from typing import Callable, Hashable
+
+
+class VersionedCache:
+    """
+    LRU cache of rendered responses that are valid for one version of their
+    source. Whenever the version differs from the one the entries were built
+    for, all of them are dropped, so nothing is ever served across a write.
+    """
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._version = None
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, version: int, compute: Callable[[], str]) -> str:
+        with self._lock:
+            if version != self._version:
+                self._entries.clear()
+                self._version = version
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+        # computed outside the lock, a concurrent miss only does the work twice
+        value = compute()
+        with self._lock:
+            self.misses += 1
+            if version == self._version:
+                self._entries[key] = value
+                if len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._version = None
@@ -1,4 +1,5 @@
 import os
+from datetime import timedelta
 from pathlib import Path
 from types import SimpleNamespace
 
@@ -11,7 +12,7 @@ from sqlalchemy.orm import declarative_base, sessionmaker
 
 from .face_rec import FaceRecognizer
 from .resources import register_face_rec_resources
-from .proc.face_detection import detector, embedding_model
+from .proc import face_detection
 
 
 def create_db(path, preserve_past: bool = True):
@@ -40,10 +41,14 @@ def create_db(path, preserve_past: bool = True):
     return db
 
 
-def create_vector_db(path, preserve_past: bool = True):
+def create_vector_db(path, preserve_past: bool = True, shared: bool = False):
     directory = os.path.dirname(path)
     os.makedirs(directory, exist_ok=True)
-    db = lancedb.connect(path)
+    # a shared store checks for the commits of the other processes on
+    # every read, otherwise a table stays on the version it opened
+    db = lancedb.connect(
+        path, read_consistency_interval=timedelta(0) if shared else None
+    )
     if not preserve_past:
         for table_name in FaceRecognizer.vector_tables():
             if table_name in db.table_names():
@@ -62,9 +67,34 @@ def setup_face_dir(face_dir: str, preserve_past: bool = True):
     return face_dir
 
 
-def load(store_dir, preserve_past: bool = True):
+def load(
+    store_dir,
+    preserve_past: bool = True,
+    in_memory_index: bool = False,
+    index_dtype: str = "float32",
+    detector=None,
+    embedding_model=None,
+    shared: bool = False,
+):
+    """
+    Opens (or creates) the face store in store_dir. detector and
+    embedding_model default to the local models on the accelerator, pass the
+    remote ones of src.inference to go through the inference service.
+
+    shared: other processes (web workers, the inference service) open the
+    same store. Their vector writes are then seen on the next read, and the
+    in-memory index, which only knows the writes of its process, is refused.
+    """
+    if shared and in_memory_index:
+        raise ValueError(
+            "the in-memory index can't follow the writes of other processes, "
+            "it needs a store opened by one process (FACE_STORE_IN_MEMORY "
+            "without INFERENCE_SERVICE_ADDRESS)"
+        )
     db = create_db(f"{store_dir}/store.db", preserve_past=preserve_past)
-    vectordb = create_vector_db(f"{store_dir}/vector.db", preserve_past=preserve_past)
+    vectordb = create_vector_db(
+        f"{store_dir}/vector.db", preserve_past=preserve_past, shared=shared
+    )
     Base = declarative_base()
     face_dir = setup_face_dir(
         face_dir=f"{store_dir}/images", preserve_past=preserve_past
@@ -76,9 +106,12 @@ def load(store_dir, preserve_past: bool = True):
         vectordb=vectordb,
         face_dir=face_dir,
         is_interactive=False,
-        detector=detector,
-        embedding_model=embedding_model,
+        detector=detector or face_detection.detector,
+        embedding_model=embedding_model or face_detection.embedding_model,
+        in_memory_index=in_memory_index,
+        index_dtype=index_dtype,
     )
     Base.metadata.create_all(db.engine)
+    recogniser.migrate_vector_store()
     recogniser.StoreVersion.track_table()
     return recogniser
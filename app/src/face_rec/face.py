@@ -1,7 +1,7 @@
 import base64
 from dataclasses import dataclass, field
 from enum import StrEnum, auto
-from typing import List, Optional, Tuple
+from typing import List, Optional, Tuple, Union
 
 from pydantic import BaseModel, field_serializer
 from sqlalchemy import Enum
@@ -35,7 +35,7 @@ class Face(BaseModel):
     # Serialize status as plain string (short name only)
     @field_serializer("status")
     def serialize_status(self, v: RecognitionStatus, _info):
-        return v.name
+        return RecognitionStatus(v).name
 
 
 class DetectedFace(Face):
@@ -52,6 +52,10 @@ class RecognizedPerson(BaseModel):
     confidence: float
 
 
+class IdentifiedFace(DetectedFace):
+    persons: List[RecognizedPerson] = []
+
+
 class RegisteredPerson(BaseModel):
     id: int
     isHidden: int
@@ -63,4 +67,55 @@ class RegisteredPerson(BaseModel):
 class RegisteredFace(BaseModel):
     id: str
     personId: int
-    personName: str
+    personName: Optional[str]
+
+
+class StoreChanges(BaseModel):
+    version: int
+    since: int
+    # the log can't answer, the client has to fetch the whole store again
+    resyncRequired: bool = False
+    persons: List[RegisteredPerson] = []
+    deletedPersons: List[int] = []
+    faces: List[RegisteredFace] = []
+    deletedFaces: List[str] = []
+
+
+class BulkRegistrationStatus(StrEnum):
+    REGISTERED = auto()
+    DUPLICATE = auto()
+    SKIPPED = auto()
+    FAILED = auto()
+
+
+class BulkRegistrationItem(BaseModel):
+    identity: Optional[Union[int, str]]
+    path: str
+    status: BulkRegistrationStatus
+    personId: Optional[int] = None
+    faceId: Optional[str] = None
+    message: Optional[str] = None
+
+
+class PipelineStageReport(BaseModel):
+    name: str
+    workers: int = 1
+    items: int = 0
+    # time spent working, summed over the workers (waits on queues excluded)
+    busySeconds: float = 0.0
+    # busySeconds / (wall time * workers), the bottleneck stage is near 1
+    utilization: float = 0.0
+    itemsPerSecond: float = 0.0
+
+
+class BulkRegistrationReport(BaseModel):
+    items: List[BulkRegistrationItem] = []
+    registered: int = 0
+    duplicates: int = 0
+    skipped: int = 0
+    failed: int = 0
+    # items skipped as already done by a previous (checkpointed) run
+    resumed: int = 0
+    seconds: float = 0.0
+    imagesPerSecond: float = 0.0
+    stages: List[PipelineStageReport] = []
@@ -1,8 +1,9 @@
 import os
 import re
 import shutil
+import time
 from pathlib import Path
-from typing import Callable, List, Optional, Tuple, Union
+from typing import Callable, Iterator, List, Optional, Tuple, Union
 
 import cv2
 import numpy as np
@@ -11,21 +12,36 @@ from PIL import Image
 from werkzeug.datastructures import FileStorage
 
 from .face import (
+    BulkRegistrationItem,
+    BulkRegistrationReport,
+    BulkRegistrationStatus,
     DetectedFace,
     Face,
+    IdentifiedFace,
+    RecognitionStatus,
     RecognizedPerson,
     RegisteredFace,
     RegisteredPerson,
+    StoreChanges,
+)
+from .pipeline import RegistrationPipeline
+from .proc import (
+    DecodedImage,
+    DetectionModel,
+    EmbeddingModel,
+    align_and_crop,
+    align_and_crop_batch,
 )
-from .proc import DetectionModel, EmbeddingModel, align_and_crop
 from .store import FaceVectorStore, faces_db, person_db, store_version_db
-from .store.face_vector_store import FaceIdWithConfidence
+from .store.face_vector_store import FaceIdWithConfidence, PersonWithConfidence
+from .store.vector_index import normalize_rows
 
 
 class FaceRecognizer:
-    face_table_name = "face"
+    face_table_name = "faces"
     face_vector_table = "face"
     person_table_name = "person"
+    change_table_name = "store_changes"
 
     def __init__(
         self,
@@ -37,6 +53,8 @@ class FaceRecognizer:
         is_interactive: bool = False,
         detector: DetectionModel,
         embedding_model: EmbeddingModel,
+        in_memory_index: bool = False,
+        index_dtype: str = "float32",
     ):
         self.db = db  # to debug
         self.dbModel = dbModel  # to debug
@@ -51,18 +69,26 @@ class FaceRecognizer:
         )
 
         self.faceVectorStore = FaceVectorStore(
-            vectordb, table_name=self.face_vector_table
+            vectordb,
+            table_name=self.face_vector_table,
+            in_memory=in_memory_index,
+            index_dtype=index_dtype,
         )
         self.detector = detector
         self.embedding_model = embedding_model
 
+    @property
+    def embedder(self) -> str:
+        """Name of the embedding model, recorded with the vectors it makes."""
+        return getattr(self.embedding_model, "name", "")
+
     @classmethod
     def vector_tables(cls):
         return [cls.face_vector_table]
 
     @classmethod
     def tables(cls):
-        return [cls.face_table_name, cls.person_table_name]
+        return [cls.face_table_name, cls.person_table_name, cls.change_table_name]
 
     def _save_file(
         self, id: int, img: Union[np.ndarray, Image.Image, FileStorage], ext="png"
@@ -158,7 +184,12 @@ class FaceRecognizer:
         name: Optional[str],
         face: Union[np.ndarray, Image.Image, FileStorage],
         vector: Union[np.ndarray, FileStorage],
+        embedder: str = "",
     ) -> RegisteredPerson:
+        """
+        embedder names the model that produced vector, empty when unknown
+        (a vector uploaded by a client).
+        """
         file_name = None
         try:
             if name:
@@ -251,7 +282,14 @@ class FaceRecognizer:
             if not registeredFace:
                 raise Exception("Failed to register face")
             logger.info(self.format_message(f"Saving the vector into vector store"))
-            self.faceVectorStore.add(id=registeredFace.id, vector=vector)
+            self.faceVectorStore.add(
+                id=registeredFace.id,
+                vector=vector,
+                person_id=person.id,
+                is_hidden=bool(person.is_hidden),
+                is_deleted=bool(person.is_deleted),
+                embedder=embedder,
+            )
             logger.info(
                 self.format_message(
                     f"face is successfull registerred! {registeredFace}"
@@ -286,6 +324,7 @@ class FaceRecognizer:
         vector: Union[np.ndarray, FileStorage],
         threshold: float = 0.3,
         count: int = 2,
+        include_hidden: bool = True,
     ) -> List[RecognizedPerson]:
         if isinstance(face, FileStorage):
             logger.info(self.format_message(f"search requested for {face}"))
@@ -324,14 +363,18 @@ class FaceRecognizer:
                     f"Searching vector database for exact match. (> 0.99)"
                 )
             )
-            results: list[FaceIdWithConfidence] = self.faceVectorStore.vector_search(
-                vector=vector, count=count, threshold=threshold
+            # ranked per person by the store, no dedup by face needed
+            results: list[PersonWithConfidence] = self.faceVectorStore.search_persons(
+                vector=vector,
+                count=count,
+                threshold=threshold,
+                include_hidden=include_hidden,
             )
 
             if results:
                 logger.info(
                     self.format_message(
-                        f"found {len(results)} faces matching for the preference (count={count}, threshold={threshold} )"
+                        f"found {len(results)} persons matching for the preference (count={count}, threshold={threshold} )"
                     )
                 )
 
@@ -339,30 +382,13 @@ class FaceRecognizer:
                     logger.info(result)
 
             persons = []
-            if results and len(results) > 1:
-                personMap = {}
+            if results:
                 for result in results:
-                    logger.info(f"process face.id={result.id} ")
-                    id = result.id
-                    registeredFace = self.RegisteredFace.get_face(id=id)
-
-                    if registeredFace:
-                        if not registeredFace.person.id in personMap.keys():
-                            personMap[registeredFace.person.id] = result.confidence
-                            persons.append(
-                                RecognizedPerson(
-                                    id=registeredFace.person.id,
-                                    name=registeredFace.person.name,
-                                    confidence=result.confidence,
-                                )
-                            )
-                        else:
-                            logger.info(
-                                "ignoring duplicate entry for person id = {registeredFace.person.id}"
-                            )
-                    else:
-                        logger.info(f"id={result.id} not registerred")
-                print(personMap)
+                    persons.append(
+                        RecognizedPerson(
+                            id=result.person_id, confidence=result.confidence
+                        )
+                    )
             else:
                 # if not found, register without name, this will help to group unknown people
                 logger.info("face not found, registerring")
@@ -384,6 +410,53 @@ class FaceRecognizer:
             logger.error(self.format_message(f"Exception while searching face {e}"))
             raise
 
+    def search_faces(
+        self,
+        *,
+        faces: List[Union[np.ndarray, Image.Image]],
+        vectors: np.ndarray,
+        threshold: float = 0.3,
+        count: int = 2,
+        register_unknown: bool = True,
+        include_hidden: bool = True,
+    ) -> List[List[RecognizedPerson]]:
+        """
+        Batched search_face: all vectors ([N, 512]) are scored against the
+        store in one search. Faces without any match are registered as
+        unnamed persons when register_unknown is set, as search_face does.
+        """
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, 512)
+        if len(faces) != len(vectors):
+            raise ValueError(
+                f"found {len(faces)} faces but {len(vectors)} vectors, expected one vector per face"
+            )
+        logger.info(self.format_message(f"search requested for {len(vectors)} faces"))
+
+        all_results: list[list[PersonWithConfidence]] = (
+            self.faceVectorStore.search_persons_many(
+                vectors=vectors,
+                count=count,
+                threshold=threshold,
+                include_hidden=include_hidden,
+            )
+        )
+
+        all_persons = []
+        for face, vector, results in zip(faces, vectors, all_results):
+            persons = [
+                RecognizedPerson(id=result.person_id, confidence=result.confidence)
+                for result in results
+            ]
+
+            if not persons and register_unknown:
+                # if not found, register without name, this will help to group unknown people
+                person = self.register_face(name=None, face=face, vector=vector)
+                logger.info(f"registerred person {person.id}")
+                persons.append(RecognizedPerson(id=person.id, confidence=1.0))
+            all_persons.append(persons)
+
+        return all_persons
+
     def detect_and_register_face(
         self, path: str, person_id: int = None, person_name: str = None
     ) -> Optional[RegisteredPerson]:
@@ -397,9 +470,9 @@ class FaceRecognizer:
             )
         )
 
-        detected_faces = self.detector.scan(path=path)
+        detected_faces = self.detector.detect(path=path)
 
-        num_faces = len(detected_faces.results)
+        num_faces = len(detected_faces)
         if num_faces > 1:
             logger.warning(
                 f"Skipped {detected_faces.info} as it contains more than one face ({num_faces} faces detected)."
@@ -409,11 +482,8 @@ class FaceRecognizer:
             logger.warning(f"Skipped {detected_faces.info} as no faces were detected.")
             return None
 
-        result = detected_faces.results[0]
-
         aligned_img, _ = align_and_crop(
-            detected_faces.image,
-            [landmark["landmark"] for landmark in result["landmarks"]],
+            detected_faces.image, detected_faces.landmarks[0]
         )
 
         face_embedding = self.embedding_model.extract_face_embedding(aligned_img)
@@ -422,6 +492,7 @@ class FaceRecognizer:
             name=person_id if person_id else person_name,
             face=aligned_img,
             vector=face_embedding,
+            embedder=self.embedder,
         )
 
         if self.is_interactive:
@@ -457,12 +528,11 @@ class FaceRecognizer:
         identities = [t[0] for t in faces]
         image_files = [t[1] for t in faces]
 
-        detected_faces_batch = self.detector.batch_scan(path=image_files)
+        detected_faces_batch = self.detector.detect_batch(path=image_files)
 
-        embedding = []
-        saved_faces = []
+        aligned = []  # (identity, aligned image)
         for identity, detected_faces in zip(identities, detected_faces_batch):
-            num_faces = len(detected_faces.results)
+            num_faces = len(detected_faces)
             if num_faces > 1:
                 logger.warning(
                     f"Skipped {detected_faces.info} as it contains more than one face ({num_faces} faces detected)."
@@ -474,19 +544,21 @@ class FaceRecognizer:
                 )
                 continue
 
-            result = detected_faces.results[0]
-
             aligned_img, _ = align_and_crop(
-                detected_faces.image,
-                [landmark["landmark"] for landmark in result["landmarks"]],
+                detected_faces.image, detected_faces.landmarks[0]
             )
-            face_embedding = self.embedding_model.extract_face_embedding(aligned_img)
-            result = detected_faces.results[0]
-            embedding.append((identity, aligned_img, face_embedding))
+            aligned.append((identity, aligned_img))
+
+        face_embeddings = self.embedding_model.extract_face_embeddings(
+            [aligned_img for _, aligned_img in aligned]
+        )
+        saved_faces = []
+        for (identity, aligned_img), face_embedding in zip(aligned, face_embeddings):
             registeredFace = self.register_face(
                 name=identity,
                 face=aligned_img,
                 vector=face_embedding,
+                embedder=self.embedder,
             )
 
             if registeredFace:
@@ -494,15 +566,243 @@ class FaceRecognizer:
 
         return saved_faces
 
+    def register_faces_bulk(
+        self,
+        faces: List[Tuple[Union[int, str], str]],
+        batch_size: int = 256,
+        duplicate_threshold: float = 0.99,
+    ) -> BulkRegistrationReport:
+        """
+        Bulk variant of register_faces for importing large archives.
+
+        Images are processed in chunks of batch_size. In each chunk, faces that
+        duplicate an earlier face of the chunk or a face already in the store
+        are dropped using one batched search, persons and faces are inserted
+        in a single SQLite transaction and all vectors are appended with a
+        single Lance write. Returns the outcome of every item and the overall
+        throughput.
+        """
+        start = time.perf_counter()
+        report = BulkRegistrationReport()
+        for offset in range(0, len(faces), batch_size):
+            chunk = faces[offset : offset + batch_size]
+            report.items.extend(
+                self._register_chunk(chunk, duplicate_threshold=duplicate_threshold)
+            )
+            logger.info(
+                self.format_message(
+                    f"bulk registration: {offset + len(chunk)}/{len(faces)} images processed"
+                )
+            )
+
+        for item in report.items:
+            if item.status == BulkRegistrationStatus.REGISTERED:
+                report.registered += 1
+            elif item.status == BulkRegistrationStatus.DUPLICATE:
+                report.duplicates += 1
+            elif item.status == BulkRegistrationStatus.SKIPPED:
+                report.skipped += 1
+            else:
+                report.failed += 1
+        elapsed = time.perf_counter() - start
+        report.seconds = round(elapsed, 3)
+        report.imagesPerSecond = round(len(faces) / elapsed, 2) if elapsed > 0 else 0.0
+        logger.info(
+            self.format_message(
+                f"bulk registration done: registered={report.registered}, "
+                f"duplicates={report.duplicates}, skipped={report.skipped}, "
+                f"failed={report.failed} in {report.seconds}s "
+                f"({report.imagesPerSecond} images/s)"
+            )
+        )
+        return report
+
+    def register_faces_pipelined(
+        self,
+        faces: List[Tuple[Union[int, str], str]],
+        batch_size: int = 256,
+        duplicate_threshold: float = 0.99,
+        checkpoint: Optional[str] = None,
+        decode_workers: int = 2,
+        align_workers: int = 2,
+        max_side: Optional[int] = None,
+    ) -> BulkRegistrationReport:
+        """
+        Streaming variant of register_faces_bulk (see RegistrationPipeline):
+        decoding, detection, alignment, embedding and persistence overlap and
+        memory stays bounded. With a checkpoint file, an interrupted run can
+        be repeated and skips the images already done. With max_side, large
+        photos are decoded at a reduced resolution (see DecodedImage).
+        """
+        return RegistrationPipeline(
+            self,
+            batch_size=batch_size,
+            duplicate_threshold=duplicate_threshold,
+            checkpoint=checkpoint,
+            decode_workers=decode_workers,
+            align_workers=align_workers,
+            max_side=max_side,
+        ).run(faces)
+
+    def _register_chunk(
+        self, chunk: List[Tuple[Union[int, str], str]], duplicate_threshold: float
+    ) -> List[BulkRegistrationItem]:
+        items = [
+            BulkRegistrationItem(
+                identity=identity, path=path, status=BulkRegistrationStatus.SKIPPED
+            )
+            for identity, path in chunk
+        ]
+        detected_faces_batch = self.detector.detect_batch(path=[t[1] for t in chunk])
+
+        candidates = []  # (item index, aligned image)
+        for index, detected_faces in enumerate(detected_faces_batch):
+            num_faces = len(detected_faces)
+            if num_faces != 1:
+                items[index].message = (
+                    f"contains more than one face ({num_faces} faces detected)"
+                    if num_faces > 1
+                    else "no faces were detected"
+                )
+                continue
+            aligned_img, _ = align_and_crop(
+                detected_faces.image, detected_faces.landmarks[0]
+            )
+            candidates.append((index, aligned_img))
+        if not candidates:
+            return items
+
+        vectors = np.stack(
+            self.embedding_model.extract_face_embeddings(
+                [candidate[1] for candidate in candidates]
+            )
+        )
+        self._register_embedded(items, candidates, vectors, duplicate_threshold)
+        return items
+
+    def _register_embedded(
+        self,
+        items: List[BulkRegistrationItem],
+        candidates: List[Tuple[int, np.ndarray]],
+        vectors: np.ndarray,
+        duplicate_threshold: float,
+    ):
+        """
+        Persists one chunk of embedded faces, updating their items in place.
+        candidates are (index in items, aligned image), vectors the matching
+        embeddings. Duplicates are dropped, the rest is written in a single
+        transaction.
+        """
+        # Duplicates within the chunk: only the first occurrence is kept
+        normalized = normalize_rows(vectors)
+        similarity = np.round(normalized @ normalized.T, 2)
+        # Duplicates against the store: one batched search for the chunk
+        found = self.faceVectorStore.search_many(
+            vectors=vectors, count=1, threshold=duplicate_threshold
+        )
+
+        accepted = []
+        for position, (index, _) in enumerate(candidates):
+            item = items[index]
+            earlier = np.nonzero(similarity[position, :position] > duplicate_threshold)[
+                0
+            ]
+            if len(earlier) > 0:
+                item.status = BulkRegistrationStatus.DUPLICATE
+                item.message = f"same face as {items[candidates[earlier[0]][0]].path}"
+            elif (
+                found[position] and found[position][0].confidence > duplicate_threshold
+            ):
+                registeredFace = self.RegisteredFace.get_face(id=found[position][0].id)
+                item.status = BulkRegistrationStatus.DUPLICATE
+                item.faceId = found[position][0].id
+                item.personId = registeredFace.person_id if registeredFace else None
+                item.message = "face is already registered"
+            else:
+                accepted.append(position)
+        if not accepted:
+            return
+
+        session = self.db.session
+        persons = {}  # normalized name -> person, for names repeated in the chunk
+        saved_files = []
+        registered = []  # (position, registered face)
+        try:
+            for position in accepted:
+                index, aligned_img = candidates[position]
+                item = items[index]
+                person = self._find_or_create_person(item.identity, persons)
+                if not person:
+                    item.status = BulkRegistrationStatus.FAILED
+                    item.message = f"person {item.identity} not found"
+                    continue
+                file_name = self._save_file(id=person.id, img=aligned_img)
+                saved_files.append(file_name)
+                registeredFace = self.RegisteredFace.create(
+                    person_id=person.id, path=file_name, commit=False
+                )
+                registered.append((position, registeredFace, person))
+
+            face_ids = [registeredFace.id for _, registeredFace, _ in registered]
+            self.faceVectorStore.add_many(
+                ids=face_ids,
+                vectors=vectors[[position for position, _, _ in registered]],
+                person_ids=[person.id for _, _, person in registered],
+                hidden=[bool(person.is_hidden) for _, _, person in registered],
+                deleted=[bool(person.is_deleted) for _, _, person in registered],
+                embedder=self.embedder,
+            )
+            try:
+                session.commit()
+            except Exception:
+                self.faceVectorStore.remove_many(face_ids)
+                raise
+        except Exception as e:
+            session.rollback()
+            for file_name in saved_files:
+                self.remove_file(file_name=file_name)
+            logger.error(self.format_message(f"Exception while registerring faces {e}"))
+            for position in accepted:
+                item = items[candidates[position][0]]
+                if item.status != BulkRegistrationStatus.FAILED:
+                    item.status = BulkRegistrationStatus.FAILED
+                    item.message = str(e)
+            return
+
+        for position, registeredFace, _ in registered:
+            item = items[candidates[position][0]]
+            item.status = BulkRegistrationStatus.REGISTERED
+            item.personId = registeredFace.person_id
+            item.faceId = registeredFace.id
+
+    def _find_or_create_person(self, identity: Union[int, str, None], persons: dict):
+        """
+        Resolves identity (person id or name) without committing, new persons
+        are only flushed.
+        """
+        if isinstance(identity, int):
+            return self.RegisteredPerson.find_by_id(id=identity)
+        if not identity:
+            return self.RegisteredPerson.create(name=None, commit=False)
+        name = self.normalize_text(identity)
+        person = persons.get(name) or self.RegisteredPerson.find_by_name(name=name)
+        if not person:
+            person = self.RegisteredPerson.create(name=name, commit=False)
+        persons[name] = person
+        return person
+
     def forget_face(self, face_id: str) -> bool:
         """
         DELETE /faces/{id}
         """
-        registeredFace = self.RegisteredFace.get_face(id=id)
-
+        registeredFace = self.RegisteredFace.get_face(id=face_id)
+        if not registeredFace:
+            return False
+        person_id = registeredFace.person_id
         registeredFace.delete()
-        person = self.RegisteredPerson.get_person(registeredFace.person_id)
-        if person.faces < 1:
+        self.faceVectorStore.remove(id=face_id)
+        person = self.RegisteredPerson.find_by_id(id=person_id)
+        if person and len(person.faces) < 1:
             person.delete()
         return True
 
@@ -510,39 +810,59 @@ class FaceRecognizer:
         """
         DELETE /persons/{id}
         """
-        person = self.RegisteredPerson.get_person(id=person_id)
+        person = self.RegisteredPerson.find_by_id(id=person_id)
+        if not person:
+            return False
         person.delete()
+        self.faceVectorStore.remove_person(person_id=person_id)
         return True
 
-    def get_all_persons(self) -> List[RegisteredPerson]:
+    def get_all_persons(
+        self, after_id: Optional[int] = None, limit: Optional[int] = None
+    ) -> List[RegisteredPerson]:
         """
         GET /persons
-        """
-        persons = []
-        all = self.RegisteredPerson.find_all()
 
-        for item in all:
-            if len(item.faces) > 0:
-                logger.info(self.format_message(f"adding {item.name} "))
-                logger.info(self.format_message(f"{item.to_json()}"))
-                persons.append(
-                    RegisteredPerson(
-                        id=item.id,
-                        name=item.name,
-                        keyFaceId=item.key_face_id,
-                        isHidden=1 if item.is_hidden else 0,
-                        faces=[face_.id for face_ in item.faces],
-                    )
-                )
-            else:
-                logger.info(
-                    self.format_message(
-                        f"skipping {item.name} as no face is associated"
-                    )
-                )
-                logger.info(self.format_message(f"{item.to_json()}"))
+        Persons with at least one face, ordered by id. The next page starts
+        after the id of the last person of the previous one.
+        """
+        rows = self.RegisteredPerson.find_page_with_faces(
+            after_id=after_id, limit=limit
+        )
+        persons = [
+            RegisteredPerson(
+                id=id,
+                name=name,
+                keyFaceId=key_face_id,
+                isHidden=1 if is_hidden else 0,
+                faces=face_ids.split(","),
+            )
+            for id, name, key_face_id, is_hidden, face_ids in rows
+        ]
+        logger.info(self.format_message(f"{len(persons)} persons found"))
         return persons
 
+    def iter_all_persons(
+        self,
+        after_id: Optional[int] = None,
+        limit: Optional[int] = None,
+        page_size: int = 500,
+    ) -> Iterator[RegisteredPerson]:
+        """
+        Same as get_all_persons, fetched page by page so that only one page
+        is in memory at a time.
+        """
+        remaining = limit
+        while remaining is None or remaining > 0:
+            size = page_size if remaining is None else min(page_size, remaining)
+            page = self.get_all_persons(after_id=after_id, limit=size)
+            yield from page
+            if len(page) < size:
+                return
+            after_id = page[-1].id
+            if remaining is not None:
+                remaining -= len(page)
+
     def get_person_by_id(self, id: int) -> Optional[RegisteredPerson]:
         """
         GET /person/{id}
@@ -585,15 +905,77 @@ class FaceRecognizer:
         logger.info(self.format_message(f"file path is {path}"))
         return path
 
-    def get_person_by_face(self, id: int) -> RegisteredPerson:
+    def get_person_by_face(self, id: str) -> Optional[RegisteredPerson]:
         """
         GET /face/{id}/person
-        - returns the image
         """
         registeredFace = self.RegisteredFace.get_face(id=id)
+        if not registeredFace:
+            return None
         item = registeredFace.person
 
-        return RegisteredPerson(id=item.id, name=item.name, keyFaceId=item.key_face_id)
+        return RegisteredPerson(
+            id=item.id,
+            name=item.name,
+            keyFaceId=item.key_face_id,
+            isHidden=1 if item.is_hidden else 0,
+            faces=[face_.id for face_ in item.faces],
+        )
+
+    def get_store_changes(self, since: int, max_changes: int = 5000) -> StoreChanges:
+        """
+        GET /store/changes?since={version}
+
+        Persons and faces written after version `since`, split into current
+        records and deleted ids.
+        """
+        version, changes = self.StoreVersion.changes_since(
+            since, max_changes=max_changes
+        )
+        result = StoreChanges(version=version, since=since)
+        if changes is None:
+            logger.info(self.format_message(f"changes since {since}: resync required"))
+            result.resyncRequired = True
+            return result
+
+        # one query per chunk of ids, whatever isn't found was deleted
+        person_ids = [int(id) for id in changes.get(self.person_table_name, [])]
+        rows = self.RegisteredPerson.find_many_with_faces(person_ids)
+        for id, name, key_face_id, is_hidden, face_ids in rows:
+            result.persons.append(
+                RegisteredPerson(
+                    id=id,
+                    name=name,
+                    keyFaceId=key_face_id,
+                    isHidden=1 if is_hidden else 0,
+                    faces=face_ids.split(",") if face_ids else [],
+                )
+            )
+        found = {person.id for person in result.persons}
+        result.deletedPersons = [id for id in person_ids if id not in found]
+
+        face_ids = list(changes.get(self.face_table_name, []))
+        rows = self.RegisteredFace.find_many_with_person(face_ids)
+        for id, person_id, person_name in rows:
+            result.faces.append(
+                RegisteredFace(id=id, personId=person_id, personName=person_name)
+            )
+        found = {face.id for face in result.faces}
+        result.deletedFaces = [id for id in face_ids if id not in found]
+        logger.info(
+            self.format_message(
+                f"changes since {since}: {len(result.persons)} persons, "
+                f"{len(result.deletedPersons)} deleted persons, {len(result.faces)} "
+                f"faces, {len(result.deletedFaces)} deleted faces"
+            )
+        )
+        return result
+
+    def get_store_version(self) -> int:
+        """
+        Version of the face/person tables, bumped by every write to them.
+        """
+        return self.StoreVersion.get_version()
 
     def update_person(
         self,
@@ -605,59 +987,271 @@ class FaceRecognizer:
         """
         PUT	/persons/{person_id}
         """
-        current = self.RegisteredPerson.get_person(id=id)
+        current = self.RegisteredPerson.find_by_id(id=id)
         item = current.update(
             name=new_name, is_hidden=is_hidden, key_face_id=key_face_id
         )
-        return RegisteredPerson(id=item.id, name=item.name, keyFaceId=item.key_face_id)
+        if is_hidden is not None:
+            self.faceVectorStore.update_person(
+                person_id=item.id, is_hidden=bool(item.is_hidden)
+            )
+        return RegisteredPerson(
+            id=item.id,
+            name=item.name,
+            keyFaceId=item.key_face_id,
+            isHidden=1 if item.is_hidden else 0,
+            faces=[face_.id for face_ in item.faces],
+        )
 
     def update_face(
         self, face_id: int, new_person_id: int = None, new_person_name: str = None
     ) -> RegisteredFace:
         """
         PUT /faces/{id}/reassign
-        """
-        if not new_person_id:
-            if new_person_name:
-                person = self.RegisteredPerson.create(name=new_person_name)
-                new_person_id = person.id
-            else:
-                raise Exception("Name this")
 
-        current = self.RegisteredFace.get_face(id=id)
-        f = current.update(person_id=new_person_id)
+        Returns None, and writes nothing, when the face or the person
+        new_person_id doesn't exist.
+        """
+        current = self.RegisteredFace.get_face(id=face_id)
+        if current is None:
+            return None
+        if new_person_id:
+            person = self.RegisteredPerson.find_by_id(id=new_person_id)
+            if person is None:
+                return None
+        elif new_person_name:
+            person = self.RegisteredPerson.create(name=new_person_name)
+        else:
+            raise Exception("Name this")
+
+        f = current.update(person_id=person.id)
+        self.faceVectorStore.reassign(
+            ids=[f.id],
+            person_id=person.id,
+            is_hidden=bool(person.is_hidden),
+            is_deleted=bool(person.is_deleted),
+        )
         return RegisteredFace(id=f.id, personId=person.id, personName=person.name)
 
+    def migrate_vector_store(self):
+        """
+        Backfills person_id and the person flags into a vector table created
+        before they were denormalized. Needs the SQLite tables to exist.
+        """
+        if not self.faceVectorStore.needs_backfill:
+            return
+        logger.warning(self.format_message("backfilling person ids into vector store"))
+        RegisteredFaceInDB = self.RegisteredFace
+        RegisteredPersonInDB = self.RegisteredPerson
+        rows = (
+            self.db.session.query(
+                RegisteredFaceInDB.id,
+                RegisteredFaceInDB.person_id,
+                RegisteredPersonInDB.is_hidden,
+                RegisteredPersonInDB.is_deleted,
+            )
+            .join(
+                RegisteredPersonInDB,
+                RegisteredFaceInDB.person_id == RegisteredPersonInDB.id,
+            )
+            .all()
+        )
+        identities = {
+            face_id: (person_id, is_hidden, is_deleted)
+            for face_id, person_id, is_hidden, is_deleted in rows
+        }
+        self.faceVectorStore.backfill(lambda ids: identities)
+
     def recognize_faces(
-        self, path: str, on_get_face_identity: Callable[[int], Tuple[str, str, str]]
+        self,
+        path: Union[str, DecodedImage],
+        on_get_face_identity: Callable[[int], Tuple[str, str, str]],
     ) -> List[Face]:
+        """
+        Detects, aligns and embeds the faces of the image at path, or of an
+        image decoded already, which the model then gets as an array; its
+        boxes and landmarks are in the coordinates of the original.
+        """
         aligned_faces, _ = self.detect_and_align_faces(
             path=path, on_get_face_identity=on_get_face_identity
         )
         faces_only = [entry.model_dump() for entry in aligned_faces]
         return faces_only
 
+    def recognize_faces_batch(
+        self,
+        requests: List[
+            Tuple[Union[str, DecodedImage], Callable[[int], Tuple[str, str, str]]]
+        ],
+    ) -> List[List[Face]]:
+        """
+        recognize_faces for several images (path or decoded image,
+        on_get_face_identity) at once: one batched detection over the images
+        and one batched embedding over all of their faces. Results are in
+        request order.
+        """
+        return [
+            [entry.model_dump() for entry in aligned_faces]
+            for aligned_faces, _, _ in self._detect_align_and_embed_many(requests)
+        ]
+
+    def identify_faces(
+        self,
+        path: str,
+        on_get_face_identity: Callable[[int], Tuple[str, str, str]],
+        threshold: float = 0.3,
+        count: int = 2,
+    ) -> List[Face]:
+        """
+        recognize_faces followed by one batched store search for all faces
+        found in the image.
+        """
+        identified_faces = self.detect_and_identify_faces(
+            path=path,
+            on_get_face_identity=on_get_face_identity,
+            threshold=threshold,
+            count=count,
+        )
+        return [entry.model_dump() for entry in identified_faces]
+
+    def detect_and_identify_faces(
+        self,
+        path: str,
+        on_get_face_identity: Callable[[int], Tuple[str, str, str]],
+        threshold: float = 0.3,
+        count: int = 2,
+    ) -> List[IdentifiedFace]:
+        aligned_faces, crops, vectors = self._detect_align_and_embed(
+            path=path, on_get_face_identity=on_get_face_identity
+        )
+        if not aligned_faces:
+            return []
+
+        all_persons = self.search_faces(
+            faces=crops, vectors=np.stack(vectors), threshold=threshold, count=count
+        )
+        return [
+            IdentifiedFace(
+                bbox=face_.bbox,
+                landmarks=face_.landmarks,
+                image=face_.image,
+                status=(
+                    RecognitionStatus.FOUND if persons else RecognitionStatus.NOT_FOUND
+                ),
+                persons=persons,
+            )
+            for face_, persons in zip(aligned_faces, all_persons)
+        ]
+
     def detect_and_align_faces(
         self, path: str, on_get_face_identity: Callable[[int], Tuple[str, str]]
     ) -> List[Tuple[np.array, list, DetectedFace]]:
+        aligned_faces, _, _ = self._detect_align_and_embed(
+            path=path, on_get_face_identity=on_get_face_identity
+        )
+        return aligned_faces, None
+
+    def _detect_align_and_embed(
+        self, path: str, on_get_face_identity: Callable[[int], Tuple[str, str]]
+    ) -> Tuple[List[DetectedFace], List[np.ndarray], List[np.ndarray]]:
+        return self._detect_align_and_embed_many([(path, on_get_face_identity)])[0]
 
-        detected_faces = self.detector.scan(path=path)
+    def _detect_align_and_embed_many(
+        self,
+        requests: List[
+            Tuple[Union[str, DecodedImage], Callable[[int], Tuple[str, str]]]
+        ],
+    ) -> List[Tuple[List[DetectedFace], List[np.ndarray], List[np.ndarray]]]:
+        images = [
+            frame if isinstance(frame, DecodedImage) else None for frame, _ in requests
+        ]
+        frames = [
+            image.pixels if image is not None else frame
+            for image, (frame, _) in zip(images, requests)
+        ]
+
+        def record(stage: str, start: float):
+            # the stages run over the batch, every image gets their time
+            seconds = time.perf_counter() - start
+            for image in images:
+                if image is not None:
+                    image.timings[stage] = image.timings.get(stage, 0.0) + seconds
+
+        start = time.perf_counter()
+        if len(frames) == 1:
+            detected_faces_batch = [self.detector.detect(path=frames[0])]
+        else:
+            detected_faces_batch = self.detector.detect_batch(path=frames)
+        record("detect", start)
+        start = time.perf_counter()
+        aligned_crops_batch = [
+            align_and_crop_batch(detected_faces.image, detected_faces.landmarks)[0]
+            for detected_faces in detected_faces_batch
+        ]
+        record("align", start)
+        start = time.perf_counter()
+        face_embeddings = self.embedding_model.extract_face_embeddings(
+            [crop for aligned_crops in aligned_crops_batch for crop in aligned_crops]
+        )
+        record("embed", start)
+
+        start = time.perf_counter()
+        results = []
+        offset = 0
+        for (_, on_get_face_identity), image, detected_faces, aligned_crops in zip(
+            requests, images, detected_faces_batch, aligned_crops_batch
+        ):
+            vectors = face_embeddings[offset : offset + len(aligned_crops)]
+            offset += len(aligned_crops)
+            results.append(
+                self._save_detected_faces(
+                    detected_faces,
+                    aligned_crops,
+                    vectors,
+                    on_get_face_identity,
+                    image=image,
+                )
+            )
+        record("save", start)
+        return results
 
+    def _save_detected_faces(
+        self,
+        detected_faces,
+        aligned_crops: List[np.ndarray],
+        face_embeddings: List[np.ndarray],
+        on_get_face_identity: Callable[[int], Tuple[str, str]],
+        image: Optional[DecodedImage] = None,
+    ) -> Tuple[List[DetectedFace], List[np.ndarray], List[np.ndarray]]:
+        boxes, all_landmarks = detected_faces.boxes, detected_faces.landmarks
+        if image is not None:
+            # detected on a reduced decode, reported for the original
+            boxes = image.to_original(boxes)
+            all_landmarks = image.to_original(all_landmarks)
         aligned_faces = []
-        for index_, face_ in enumerate(detected_faces.results):
-            x1, y1, x2, y2 = map(int, face_["bbox"])
+        crops = []
+        vectors = []
+        for index_, (bbox, landmarks, aligned_face, vector) in enumerate(
+            zip(
+                boxes.astype(int).tolist(),
+                all_landmarks,
+                aligned_crops,
+                face_embeddings,
+            )
+        ):
+            x1, y1, x2, y2 = bbox
             # cropped_face = detected_faces.image[y1:y2, x1:x2]
-            landmarks = [landmark["landmark"] for landmark in face_["landmarks"]]
-            aligned_face, _ = align_and_crop(detected_faces.image, landmarks)
             image_path, vector_path, identifier = on_get_face_identity(index_)
             cv2.imwrite(str(image_path), aligned_face)
-
-            vector = self.embedding_model.extract_face_embedding(aligned_face)
             np.save(vector_path, vector)
+            crops.append(aligned_face)
+            vectors.append(vector)
 
             aligned_faces.append(
                 DetectedFace(
-                    bbox=(x1, y1, x2, y2), landmarks=landmarks, image=identifier
+                    bbox=(x1, y1, x2, y2),
+                    landmarks=landmarks.tolist(),
+                    image=identifier,
                 )
             )
             logger.info(
@@ -665,7 +1259,7 @@ class FaceRecognizer:
                     f"face {index_} is saved with identity {identifier}"
                 )
             )
-        return aligned_faces, None
+        return aligned_faces, crops, vectors
 
     def format_message(self, msg: str):
         msg = msg[0].upper() + msg[1:] if msg else msg
@@ -0,0 +1,409 @@
+import json
+import os
+import queue
+import threading
+import time
+from collections import deque
+from typing import Callable, Iterable, Iterator, List, Optional, Set, Tuple, Union
+
+import numpy as np
+from loguru import logger
+
+from .face import (
+    BulkRegistrationItem,
+    BulkRegistrationReport,
+    BulkRegistrationStatus,
+    PipelineStageReport,
+)
+from .proc import DecodedImage, align_and_crop
+
+# End of stream marker passed through the queues
+_DONE = object()
+
+
+class _Work:
+    """One image travelling through the pipeline."""
+
+    __slots__ = ("item", "image", "landmarks", "crop", "vector")
+
+    def __init__(self, item: BulkRegistrationItem):
+        self.item = item
+        self.image = None
+        self.landmarks = None
+        self.crop = None
+        self.vector = None
+
+
+class _Stage:
+    """
+    Threads between two bounded queues. Map stages run `process` on each work
+    item on `workers` threads; stream stages run `process` once over the
+    iterator of work items (for the models' pipelined predict_batch).
+    Returning None from a map stage drops the item.
+    """
+
+    def __init__(self, name: str, inbox: queue.Queue, outbox: queue.Queue, workers=1):
+        self.name = name
+        self.inbox = inbox
+        self.outbox = outbox
+        self.workers = workers
+        self.items = 0
+        self.busy = 0.0
+        self.error: Optional[Exception] = None
+        self._lock = threading.Lock()
+        self._running = workers
+        self._threads: List[threading.Thread] = []
+
+    def _inputs(self, waits: List[float]) -> Iterator[_Work]:
+        while True:
+            start = time.perf_counter()
+            work = self.inbox.get()
+            waits[0] += time.perf_counter() - start
+            if work is _DONE:
+                # leave it for the other workers of this stage
+                self.inbox.put(_DONE)
+                return
+            yield work
+
+    def _emit(self, work: _Work, waits: List[float]):
+        start = time.perf_counter()
+        self.outbox.put(work)
+        waits[0] += time.perf_counter() - start
+        with self._lock:
+            self.items += 1
+
+    def _worker(self, body: Callable[[List[float]], None]):
+        waits = [0.0]
+        start = time.perf_counter()
+        try:
+            body(waits)
+        finally:
+            with self._lock:
+                self.busy += time.perf_counter() - start - waits[0]
+                self._running -= 1
+                last = self._running == 0
+            if last:
+                self.outbox.put(_DONE)
+
+    def start_map(self, process: Callable[[_Work], Optional[_Work]]):
+        def body(waits):
+            for work in self._inputs(waits):
+                try:
+                    work = process(work)
+                except Exception as e:
+                    _fail(work, e)
+                    work = None
+                if work is not None:
+                    self._emit(work, waits)
+
+        self._start(body)
+
+    def start_stream(self, process: Callable[[Iterator[_Work]], Iterator[_Work]]):
+        def body(waits):
+            try:
+                for work in process(self._inputs(waits)):
+                    self._emit(work, waits)
+            except Exception as e:
+                logger.error(f"pipeline stage {self.name} failed: {e}")
+                self.error = e
+                # drain, so that the upstream stages don't block forever
+                for work in self._inputs(waits):
+                    _fail(work, e)
+
+        self._start(body)
+
+    def _start(self, body):
+        self._threads = [
+            threading.Thread(
+                target=self._worker,
+                args=(body,),
+                name=f"pipeline-{self.name}-{index}",
+                daemon=True,
+            )
+            for index in range(self.workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def report(self, seconds: float) -> PipelineStageReport:
+        return PipelineStageReport(
+            name=self.name,
+            workers=self.workers,
+            items=self.items,
+            busySeconds=round(self.busy, 3),
+            utilization=(
+                round(self.busy / (seconds * self.workers), 3) if seconds > 0 else 0.0
+            ),
+            itemsPerSecond=round(self.items / seconds, 2) if seconds > 0 else 0.0,
+        )
+
+
+def _fail(work: _Work, error: Exception):
+    work.item.status = BulkRegistrationStatus.FAILED
+    work.item.message = str(error)
+    work.image = work.crop = None
+
+
+def _paired(
+    inputs: Iterator[_Work],
+    payload: Callable[[_Work], object],
+    model_stream: Callable[[Iterable], Iterator],
+) -> Iterator[Tuple[_Work, object]]:
+    """
+    Feeds payload(work) of every input to a pipelined model stream and pairs
+    each output with its work item. The model yields in input order but reads
+    ahead, so the items in flight wait in a FIFO.
+    """
+    in_flight = deque()
+
+    def frames():
+        for work in inputs:
+            in_flight.append(work)
+            yield payload(work)
+
+    for output in model_stream(frames()):
+        yield in_flight.popleft(), output
+
+
+class RegistrationCheckpoint:
+    """
+    Paths already handled by a bulk registration, one JSON line per item.
+    Failed items are not recorded, so a resumed run retries them.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def load(self) -> Set[str]:
+        done = set()
+        if not os.path.exists(self.path):
+            return done
+        with open(self.path, "r") as f:
+            for line in f:
+                try:
+                    done.add(json.loads(line)["path"])
+                except (ValueError, KeyError):
+                    # a line cut short by an interrupted run
+                    continue
+        return done
+
+    def append(self, items: List[BulkRegistrationItem]):
+        lines = [
+            json.dumps({"path": item.path, "status": item.status})
+            for item in items
+            if item.status != BulkRegistrationStatus.FAILED
+        ]
+        if not lines:
+            return
+        with open(self.path, "a") as f:
+            f.write("\n".join(lines) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class RegistrationPipeline:
+    """
+    Streaming bulk registration. Images flow through bounded queues:
+
+        decode (CPU threads) -> detect (accelerator) -> align (CPU threads)
+        -> embed (accelerator) -> persist (batches)
+
+    Detection and embedding each keep the model's predict_batch pipeline
+    full and run concurrently, so both models are busy at the same time.
+    Only about queue_size images per stage are in memory, whatever the
+    number of inputs. Persistence goes through the same duplicate filtering
+    and single-transaction writes as FaceRecognizer.register_faces_bulk, in
+    chunks of batch_size. With a checkpoint, every persisted chunk is
+    recorded and a later run skips those paths.
+    """
+
+    def __init__(
+        self,
+        recognizer,
+        batch_size: int = 256,
+        decode_workers: int = 2,
+        align_workers: int = 2,
+        queue_size: int = 32,
+        duplicate_threshold: float = 0.99,
+        checkpoint: Optional[str] = None,
+        max_side: Optional[int] = None,
+    ):
+        self.recognizer = recognizer
+        self.max_side = max_side
+        self.batch_size = batch_size
+        self.decode_workers = decode_workers
+        self.align_workers = align_workers
+        self.queue_size = queue_size
+        self.duplicate_threshold = duplicate_threshold
+        self.checkpoint = RegistrationCheckpoint(checkpoint) if checkpoint else None
+
+    def run(self, faces: List[Tuple[Union[int, str], str]]) -> BulkRegistrationReport:
+        start = time.perf_counter()
+        report = BulkRegistrationReport()
+        done = self.checkpoint.load() if self.checkpoint else set()
+        pending = []
+        for identity, path in faces:
+            if path in done:
+                report.resumed += 1
+                continue
+            pending.append(
+                BulkRegistrationItem(
+                    identity=identity, path=path, status=BulkRegistrationStatus.SKIPPED
+                )
+            )
+        if report.resumed:
+            logger.info(
+                f"pipeline: resuming, {report.resumed} images done by a previous run"
+            )
+
+        # items that left the pipeline before the persist stage
+        finished: List[BulkRegistrationItem] = []
+        finished_lock = threading.Lock()
+
+        def finish(work: _Work, message: str):
+            work.item.message = message
+            with finished_lock:
+                finished.append(work.item)
+
+        def decode(work: _Work) -> Optional[_Work]:
+            try:
+                work.image = DecodedImage.open(work.item.path, self.max_side).pixels
+            except (OSError, ValueError):
+                finish(work, "could not be read")
+                return None
+            return work
+
+        def detect(inputs: Iterator[_Work]) -> Iterator[_Work]:
+            for work, detected_faces in _paired(
+                inputs, lambda work: work.image, self.recognizer.detector.detect_stream
+            ):
+                num_faces = len(detected_faces)
+                if num_faces != 1:
+                    work.image = None
+                    finish(
+                        work,
+                        (
+                            f"contains more than one face ({num_faces} faces detected)"
+                            if num_faces > 1
+                            else "no faces were detected"
+                        ),
+                    )
+                    continue
+                work.landmarks = detected_faces.landmarks[0]
+                yield work
+
+        def align(work: _Work) -> _Work:
+            work.crop, _ = align_and_crop(work.image, work.landmarks)
+            work.image = None
+            return work
+
+        def embed(inputs: Iterator[_Work]) -> Iterator[_Work]:
+            for work, vector in _paired(
+                inputs,
+                lambda work: work.crop,
+                self.recognizer.embedding_model.embed_stream,
+            ):
+                work.vector = vector
+                yield work
+
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in range(5)]
+        stages = [
+            _Stage("decode", queues[0], queues[1], workers=self.decode_workers),
+            _Stage("detect", queues[1], queues[2]),
+            _Stage("align", queues[2], queues[3], workers=self.align_workers),
+            _Stage("embed", queues[3], queues[4]),
+        ]
+        stages[0].start_map(decode)
+        stages[1].start_stream(detect)
+        stages[2].start_map(align)
+        stages[3].start_stream(embed)
+
+        def feed():
+            for item in pending:
+                queues[0].put(_Work(item))
+            queues[0].put(_DONE)
+
+        threading.Thread(target=feed, name="pipeline-feed", daemon=True).start()
+
+        persist = PipelineStageReport(name="persist")
+        batch: List[_Work] = []
+
+        def flush():
+            persist_start = time.perf_counter()
+            if batch:
+                self.recognizer._register_embedded(
+                    [work.item for work in batch],
+                    [(index, work.crop) for index, work in enumerate(batch)],
+                    np.stack([work.vector for work in batch]),
+                    self.duplicate_threshold,
+                )
+            with finished_lock:
+                settled = [work.item for work in batch] + finished
+                finished.clear()
+            if self.checkpoint:
+                self.checkpoint.append(settled)
+            for item in settled:
+                self._count(report, item)
+            report.items.extend(settled)
+            persist.items += len(batch)
+            persist.busySeconds += time.perf_counter() - persist_start
+            batch.clear()
+            logger.info(
+                f"pipeline: {len(report.items)}/{len(pending)} images processed"
+            )
+
+        while True:
+            work = queues[4].get()
+            if work is _DONE:
+                break
+            batch.append(work)
+            if len(batch) >= self.batch_size:
+                flush()
+        flush()
+
+        # items failed by a stage error never reach persist
+        settled = set(id(item) for item in report.items)
+        for item in pending:
+            if id(item) not in settled:
+                if item.status != BulkRegistrationStatus.FAILED:
+                    item.status = BulkRegistrationStatus.FAILED
+                    item.message = item.message or "lost in the pipeline"
+                self._count(report, item)
+                report.items.append(item)
+
+        elapsed = time.perf_counter() - start
+        report.seconds = round(elapsed, 3)
+        report.imagesPerSecond = (
+            round(len(pending) / elapsed, 2) if elapsed > 0 else 0.0
+        )
+        report.stages = [stage.report(elapsed) for stage in stages]
+        if elapsed > 0:
+            persist.utilization = round(persist.busySeconds / elapsed, 3)
+            persist.itemsPerSecond = round(persist.items / elapsed, 2)
+        persist.busySeconds = round(persist.busySeconds, 3)
+        report.stages.append(persist)
+        logger.info(
+            f"pipeline done: registered={report.registered}, "
+            f"duplicates={report.duplicates}, skipped={report.skipped}, "
+            f"failed={report.failed}, resumed={report.resumed} in "
+            f"{report.seconds}s ({report.imagesPerSecond} images/s); "
+            + ", ".join(
+                f"{stage.name} {stage.utilization:.0%} busy" for stage in report.stages
+            )
+        )
+        return report
+
+    @staticmethod
+    def _count(report: BulkRegistrationReport, item: BulkRegistrationItem):
+        if item.status == BulkRegistrationStatus.REGISTERED:
+            report.registered += 1
+        elif item.status == BulkRegistrationStatus.DUPLICATE:
+            report.duplicates += 1
+        elif item.status == BulkRegistrationStatus.SKIPPED:
+            report.skipped += 1
+        else:
+            report.failed += 1
@@ -1,3 +1,4 @@
-from .align_and_crop import align_and_crop
-from .face_detection import DetectionModel, EmbeddingModel
+from .align_and_crop import align_and_crop, align_and_crop_batch
+from .decoded_image import DecodedImage
+from .face_detection import DetectionModel, EmbeddingModel, FaceDetections
 from .profiler import timed
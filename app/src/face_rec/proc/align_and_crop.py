@@ -1,37 +1,31 @@
+from concurrent.futures import Executor
+from functools import lru_cache
+from typing import List, Optional, Tuple
+
 import cv2
 import numpy as np
 
 from .profiler import timed
 
+# Define the reference keypoints used in ArcFace model, based on a typical facial landmark set.
+_ARCFACE_REF_KPS = np.array(
+    [
+        [38.2946, 51.6963],  # Left eye
+        [73.5318, 51.5014],  # Right eye
+        [56.0252, 71.7366],  # Nose
+        [41.5493, 92.3655],  # Left mouth corner
+        [70.7299, 92.2041],  # Right mouth corner
+    ],
+    dtype=np.float32,
+)
 
-@timed
-def align_and_crop(img, landmarks, image_size=112):
-    """
-    Align and crop the face from the image based on the given landmarks.
-
-    Args:
-        img (np.ndarray): The full image (not the cropped bounding box). This image will be transformed.
-        landmarks (List[np.ndarray]): List of 5 keypoints (landmarks) as (x, y) coordinates. These keypoints typically include the eyes, nose, and mouth.
-        image_size (int, optional): The size to which the image should be resized. Defaults to 112. It is typically either 112 or 128 for face recognition models.
 
-    Returns:
-        Tuple[np.ndarray, np.ndarray]: The aligned face image and the transformation matrix.
+@lru_cache(maxsize=None)
+def reference_keypoints(image_size: int = 112) -> np.ndarray:
+    """
+    The ArcFace reference keypoints scaled (and shifted) for image_size, which
+    must be a multiple of 112 or 128. Cached, the returned array is read-only.
     """
-    # Define the reference keypoints used in ArcFace model, based on a typical facial landmark set.
-    _arcface_ref_kps = np.array(
-        [
-            [38.2946, 51.6963],  # Left eye
-            [73.5318, 51.5014],  # Right eye
-            [56.0252, 71.7366],  # Nose
-            [41.5493, 92.3655],  # Left mouth corner
-            [70.7299, 92.2041],  # Right mouth corner
-        ],
-        dtype=np.float32,
-    )
-
-    # Ensure the input landmarks have exactly 5 points (as expected for face alignment)
-    assert len(landmarks) == 5
-
     # Validate that image_size is divisible by either 112 or 128 (common image sizes for face recognition models)
     assert image_size % 112 == 0 or image_size % 128 == 0
 
@@ -44,16 +38,186 @@ def align_and_crop(img, landmarks, image_size=112):
         diff_x = 8.0 * ratio  # Horizontal shift for 128 scaling
 
     # Apply the scaling and shifting to the reference keypoints
-    dst = _arcface_ref_kps * ratio
+    dst = _ARCFACE_REF_KPS * ratio
     dst[:, 0] += diff_x  # Apply the horizontal shift
+    dst.flags.writeable = False
+    return dst
+
+
+def similarity_transforms(landmarks, dst) -> np.ndarray:
+    """
+    Least-squares similarity transforms (rotation, uniform scale and
+    translation) mapping each face's landmarks onto dst, in closed form
+    (Umeyama) for all faces at once.
+
+    Args:
+        landmarks (np.ndarray): [N, K, 2] keypoints per face.
+        dst (np.ndarray): [K, 2] target keypoints.
 
-    # Estimate the similarity transformation matrix to align the landmarks with the reference keypoints
-    M, inliers = cv2.estimateAffinePartial2D(
-        np.array(landmarks), dst, ransacReprojThreshold=1000
+    Returns:
+        np.ndarray: [N, 2, 3] affine matrices, as cv2.warpAffine takes them.
+    """
+    # Points as complex numbers: the rotation-scale part is a multiplication
+    # by c = a + ib, and minimizing sum |y - c x|^2 over centered points
+    # gives c = sum(conj(x) y) / sum |x|^2
+    src = np.asarray(landmarks, dtype=np.float64).reshape(-1, len(dst), 2)
+    src = src.view(np.complex128)[..., 0]
+    dst = np.asarray(dst, dtype=np.float64).view(np.complex128)[:, 0]
+    src_mean = src.mean(axis=1, keepdims=True)
+    dst_mean = dst.mean()
+    x = src - src_mean
+    c = (x.conj() @ (dst - dst_mean)) / np.maximum(
+        (x.real**2 + x.imag**2).sum(axis=1), np.finfo(np.float64).tiny
     )
-    assert np.all(inliers == True)
+    t = dst_mean - c * src_mean[:, 0]
+
+    M = np.empty((len(src), 2, 3), dtype=np.float64)
+    M[:, 0, 0] = M[:, 1, 1] = c.real
+    M[:, 0, 1] = -c.imag
+    M[:, 1, 0] = c.imag
+    M[:, 0, 2] = t.real
+    M[:, 1, 2] = t.imag
+    return M
+
+
+@timed
+def align_and_crop_batch(
+    img,
+    landmarks,
+    image_size: int = 112,
+    executor: Optional[Executor] = None,
+) -> Tuple[List[np.ndarray], np.ndarray]:
+    """
+    Align and crop every face of one image.
+
+    Args:
+        img (np.ndarray): The full image the landmarks refer to.
+        landmarks (np.ndarray): [N, 5, 2] keypoints, 5 (x, y) per face.
+        image_size (int, optional): Size of the square crops, 112 or 128 based. Defaults to 112.
+        executor (Executor, optional): Runs the warps concurrently (OpenCV
+            releases the GIL), e.g. a ThreadPoolExecutor; sequential if None.
+
+    Returns:
+        Tuple[List[np.ndarray], np.ndarray]: The aligned faces and their [N, 2, 3] transformation matrices.
+    """
+    transforms = similarity_transforms(landmarks, reference_keypoints(image_size))
+
+    def warp(M):
+        return cv2.warpAffine(img, M, (image_size, image_size), borderValue=0.0)
+
+    if executor is None or len(transforms) < 2:
+        return [warp(M) for M in transforms], transforms
+    return list(executor.map(warp, transforms)), transforms
+
+
+@timed
+def align_and_crop(img, landmarks, image_size=112):
+    """
+    Align and crop the face from the image based on the given landmarks.
+
+    Args:
+        img (np.ndarray): The full image (not the cropped bounding box). This image will be transformed.
+        landmarks (List[np.ndarray]): List of 5 keypoints (landmarks) as (x, y) coordinates. These keypoints typically include the eyes, nose, and mouth.
+        image_size (int, optional): The size to which the image should be resized. Defaults to 112. It is typically either 112 or 128 for face recognition models.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: The aligned face image and the transformation matrix.
+    """
+    # Ensure the input landmarks have exactly 5 points (as expected for face alignment)
+    assert len(landmarks) == 5
+
+    M = similarity_transforms(
+        np.asarray(landmarks)[None], reference_keypoints(image_size)
+    )[0]
 
     # Apply the affine transformation to the input image to align the face
     aligned_img = cv2.warpAffine(img, M, (image_size, image_size), borderValue=0.0)
 
     return aligned_img, M
+
+
+if __name__ == "__main__":
+    # RANSAC estimation (the previous implementation) vs the closed form,
+    # per image with 1, 10 and 50 faces:
+    #   python -m src.face_rec.proc.align_and_crop
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+
+    from loguru import logger
+
+    logger.remove()  # @timed logs every call
+    rng = np.random.default_rng(0)
+    img = rng.integers(0, 256, size=(736, 1280, 3), dtype=np.uint8)
+
+    def ransac_align(landmarks):
+        crops, transforms = [], []
+        for points in landmarks:
+            dst = _ARCFACE_REF_KPS.copy()
+            M, _ = cv2.estimateAffinePartial2D(
+                np.array(points), dst, ransacReprojThreshold=1000
+            )
+            crops.append(cv2.warpAffine(img, M, (112, 112), borderValue=0.0))
+            transforms.append(M)
+        return crops, np.array(transforms)
+
+    def random_faces(count):
+        # reference keypoints rotated, scaled and moved to random places,
+        # with a pixel of landmark noise
+        angle = rng.uniform(-0.5, 0.5, count)
+        scale = rng.uniform(0.5, 3.0, count)
+        rotation = (
+            np.stack(
+                [
+                    np.stack([np.cos(angle), -np.sin(angle)], axis=-1),
+                    np.stack([np.sin(angle), np.cos(angle)], axis=-1),
+                ],
+                axis=1,
+            )
+            * scale[:, None, None]
+        )
+        offset = rng.uniform([100, 100], [1100, 600], size=(count, 1, 2))
+        points = np.einsum("nij,kj->nki", rotation, _ARCFACE_REF_KPS - 56) + offset
+        return (points + rng.normal(0, 1, points.shape)).astype(np.float32)
+
+    def per_image(fn, landmarks, repeat=20):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            result = fn(landmarks)
+        return (time.perf_counter() - start) / repeat * 1000, result
+
+    def ransac_fit(landmarks):
+        dst = _ARCFACE_REF_KPS.copy()
+        return [
+            cv2.estimateAffinePartial2D(
+                np.array(points), dst, ransacReprojThreshold=1000
+            )[0]
+            for points in landmarks
+        ]
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        for count in [1, 10, 50]:
+            landmarks = random_faces(count)
+            fit_ms, _ = per_image(ransac_fit, landmarks)
+            closed_fit_ms, _ = per_image(
+                lambda points: similarity_transforms(points, reference_keypoints()),
+                landmarks,
+            )
+            ransac_ms, (ransac_crops, ransac_M) = per_image(ransac_align, landmarks)
+            batch_ms, (crops, M) = per_image(
+                lambda points: align_and_crop_batch(img, points), landmarks
+            )
+            pool_ms, _ = per_image(
+                lambda points: align_and_crop_batch(img, points, executor=pool),
+                landmarks,
+            )
+            pixels = max(
+                np.abs(a.astype(int) - b.astype(int)).max()
+                for a, b in zip(ransac_crops, crops)
+            )
+            print(
+                f"{count:>3} faces | fit: ransac {fit_ms:7.3f} ms, "
+                f"closed form {closed_fit_ms:7.3f} ms | fit + warp: ransac "
+                f"{ransac_ms:7.3f} ms, closed form {batch_ms:7.3f} ms, "
+                f"with pool {pool_ms:7.3f} ms | max |dM| "
+                f"{np.abs(ransac_M - M).max():.2e}, max pixel diff {pixels}"
+            )
@@ -0,0 +1,234 @@
+import os
+import threading
+import time
+import zlib
+from typing import Iterable, Iterator, List, Optional
+
+import cv2
+import numpy as np
+
+from .align_and_crop import _ARCFACE_REF_KPS
+from .face_detection import FaceDetections
+
+# Dummy inputs of a warm-up: a blank frame at the resolution of the
+# detector's input and a blank crop of the embedding model's
+_WARM_UP_FRAME = (736, 1280, 3)
+_WARM_UP_CROP = (112, 112, 3)
+
+
+def warm_up(detector, embedding_model) -> float:
+    """
+    Runs one dummy inference through each model, so that loading them and
+    the cold start of the device aren't paid by the first request. Returns
+    the seconds it took.
+    """
+    start = time.perf_counter()
+    detector.detect(np.zeros(_WARM_UP_FRAME, dtype=np.uint8))
+    embedding_model.extract_face_embeddings([np.zeros(_WARM_UP_CROP, dtype=np.uint8)])
+    return time.perf_counter() - start
+
+
+class ModelBackend:
+    """
+    A detector and an embedding model that run on one device, with the
+    interfaces of DetectionModel and EmbeddingModel. The models are created
+    on first use.
+    """
+
+    name = ""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._models = None
+
+    @property
+    def detector(self):
+        return self._get_models()[0]
+
+    @property
+    def embedding_model(self):
+        return self._get_models()[1]
+
+    def _get_models(self):
+        with self._lock:
+            if self._models is None:
+                self._models = self._create()
+        return self._models
+
+    def _create(self):
+        raise NotImplementedError
+
+    def warm_up(self) -> float:
+        return warm_up(self.detector, self.embedding_model)
+
+
+class HailoBackend(ModelBackend):
+    """The DeGirum models on the Hailo-8 accelerator (the shared instances)."""
+
+    name = "hailo"
+
+    def _create(self):
+        from . import face_detection
+
+        return face_detection.detector, face_detection.embedding_model
+
+
+class CpuBackend(ModelBackend):
+    """
+    ONNX models on the CPU through OpenCV (see opencv_models): YuNet for
+    detection and an ArcFace MobileFaceNet for the embeddings. The zoo has
+    no CPU build of the accelerator's models, so the model files are placed
+    in the zoo's opencv directory (or given by path); a missing file fails
+    at startup, not on the first call spilled to the CPU.
+    """
+
+    name = "cpu"
+
+    def __init__(
+        self,
+        detection_model: str = "",
+        embedding_model: str = "",
+    ):
+        from .opencv_models import DEFAULT_DETECTION_MODEL, DEFAULT_EMBEDDING_MODEL
+
+        super().__init__()
+        self.detection_model_path = detection_model or DEFAULT_DETECTION_MODEL
+        self.embedding_model_path = embedding_model or DEFAULT_EMBEDDING_MODEL
+        missing = [
+            path
+            for path in (self.detection_model_path, self.embedding_model_path)
+            if not os.path.isfile(path)
+        ]
+        if missing:
+            raise ValueError(
+                f"the cpu backend's models are missing: {', '.join(missing)}"
+            )
+
+    def _create(self):
+        from .opencv_models import OpenCvDetectionModel, OpenCvEmbeddingModel
+
+        return (
+            OpenCvDetectionModel(self.detection_model_path),
+            OpenCvEmbeddingModel(self.embedding_model_path),
+        )
+
+
+class SyntheticBackend(ModelBackend):
+    """
+    Deterministic stand-in for tests and benchmarks, no device needed. The
+    faces and vectors are derived from the pixels, so the same image always
+    gives the same result. Every call takes call_ms plus image_ms per image
+    and, like an accelerator, the backend runs one call at a time.
+    """
+
+    name = "synthetic"
+
+    def __init__(
+        self,
+        call_ms: float = 0.0,
+        image_ms: float = 0.0,
+        faces: Optional[int] = 1,
+        dimension: int = 512,
+        name: str = "synthetic",
+    ):
+        super().__init__()
+        self.name = name
+        self.call_ms = call_ms
+        self.image_ms = image_ms
+        self.faces = faces
+        self.dimension = dimension
+        self._device = threading.Lock()
+
+    def _create(self):
+        return SyntheticDetectionModel(self), SyntheticEmbeddingModel(self)
+
+    def run(self, images: int):
+        """Occupies the device for the cost of a call over images."""
+        cost = (self.call_ms + self.image_ms * images) / 1000
+        with self._device:
+            if cost > 0:
+                time.sleep(cost)
+
+
+def _pixel_seed(image: np.ndarray) -> int:
+    # a sparse sample keeps this cheap for full size photos
+    step = max(1, min(image.shape[:2]) // 64)
+    return zlib.crc32(np.ascontiguousarray(image[::step, ::step]).tobytes())
+
+
+class SyntheticDetectionModel:
+    def __init__(self, backend: SyntheticBackend):
+        self.backend = backend
+
+    def _detect_one(self, frame) -> FaceDetections:
+        image = cv2.imread(str(frame)) if not isinstance(frame, np.ndarray) else frame
+        if image is None:
+            raise ValueError(f"could not read {frame}")
+        rng = np.random.default_rng(_pixel_seed(image))
+        count = (
+            self.backend.faces if self.backend.faces is not None else rng.integers(0, 4)
+        )
+        height, width = image.shape[:2]
+        size = rng.uniform(0.1, 0.4, count) * min(width, height)
+        x1 = rng.uniform(0, 1, count) * (width - size)
+        y1 = rng.uniform(0, 1, count) * (height - size)
+        boxes = np.stack([x1, y1, x1 + size, y1 + size], axis=-1).astype(np.float32)
+        # the reference keypoints of a 112 pixel crop, scaled into the box
+        landmarks = (
+            _ARCFACE_REF_KPS[None] / 112 * size[:, None, None]
+            + np.stack([x1, y1], axis=-1)[:, None]
+        ).astype(np.float32)
+        return FaceDetections(
+            boxes=boxes.reshape(-1, 4),
+            scores=rng.uniform(0.5, 1.0, count).astype(np.float32),
+            landmarks=landmarks.reshape(-1, 5, 2),
+            image=image,
+        )
+
+    def detect(self, path) -> FaceDetections:
+        return self.detect_batch([path])[0]
+
+    def detect_batch(self, path: List) -> List[FaceDetections]:
+        self.backend.run(len(path))
+        return [self._detect_one(frame) for frame in path]
+
+    def detect_stream(self, frames: Iterable) -> Iterator[FaceDetections]:
+        for frame in frames:
+            yield self.detect(frame)
+
+
+class SyntheticEmbeddingModel:
+    def __init__(self, backend: SyntheticBackend):
+        self.backend = backend
+        self.name = backend.name
+
+    def _embed_one(self, image: np.ndarray) -> np.ndarray:
+        rng = np.random.default_rng(_pixel_seed(image))
+        return rng.standard_normal(self.backend.dimension).astype(np.float32)
+
+    def extract_face_embedding(self, image) -> np.ndarray:
+        return self.extract_face_embeddings([image])[0]
+
+    def extract_face_embeddings(self, images: List[np.ndarray]) -> List[np.ndarray]:
+        if not len(images):
+            return []
+        self.backend.run(len(images))
+        return [self._embed_one(image) for image in images]
+
+    def embed_stream(self, images: Iterable[np.ndarray]) -> Iterator[np.ndarray]:
+        for image in images:
+            yield self.extract_face_embedding(image)
+
+
+def create_backend(name: str, **options) -> ModelBackend:
+    """
+    A backend by name: hailo, cpu (options detection_model, embedding_model)
+    or synthetic (options call_ms, image_ms, faces).
+    """
+    if name == "hailo":
+        return HailoBackend()
+    if name == "cpu":
+        return CpuBackend(**options)
+    if name == "synthetic":
+        return SyntheticBackend(**options)
+    raise ValueError(f"unknown inference backend {name}")
@@ -0,0 +1,216 @@
+import hashlib
+import io
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional, Tuple
+
+import cv2
+import numpy as np
+from PIL import Image, ImageOps
+
+_EXIF_ORIENTATION = 0x0112
+# EXIF orientations that swap width and height
+_TRANSPOSED = (5, 6, 7, 8)
+# cv2's reduced decodes; JPEG decodes them at a fraction of the full cost
+# (DCT scaling), other formats decode in full and are resized
+_REDUCED = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
+
+def _reduction(longest: int, max_side: Optional[int]) -> int:
+    """The largest factor that keeps the longest side at max_side or more."""
+    if not max_side:
+        return 1
+    for factor in (8, 4, 2):
+        if longest // factor >= max_side:
+            return factor
+    return 1
+
+
+def _decode_with_pil(data: bytes) -> np.ndarray:
+    # formats cv2 can't read; upright BGR like cv2.imdecode
+    with Image.open(io.BytesIO(data)) as image:
+        rgb = ImageOps.exif_transpose(image).convert("RGB")
+    return np.ascontiguousarray(np.asarray(rgb)[:, :, ::-1])
+
+
+class DecodedImage:
+    """
+    An image decoded once for every stage of a request. pixels is the BGR
+    array, upright (the EXIF orientation applied, as cv2.imread does) and,
+    for large photos, reduced by scale; size is the (width, height) of the
+    upright original, orientation its EXIF orientation and md5 the hash of
+    the encoded bytes. Detection runs on pixels, to_original maps its
+    coordinates back to the original. timings has the seconds spent per
+    stage of the request: read and decode here, the consumers add theirs.
+    """
+
+    def __init__(
+        self,
+        pixels: np.ndarray,
+        size: Tuple[int, int],
+        orientation: int = 1,
+        md5: Optional[str] = None,
+        scale: float = 1.0,
+        path: Optional[str] = None,
+        timings: Optional[Dict[str, float]] = None,
+    ):
+        self.pixels = pixels
+        self.size = size
+        self.orientation = orientation
+        self.md5 = md5
+        self.scale = scale
+        self.path = path
+        self.timings = timings if timings is not None else {}
+
+    @classmethod
+    def open(cls, path, max_side: Optional[int] = None) -> "DecodedImage":
+        """Reads the file once and decodes it, see from_bytes."""
+        start = time.perf_counter()
+        with open(path, "rb") as f:
+            data = f.read()
+        timings = {"read": time.perf_counter() - start}
+        return cls.from_bytes(data, max_side=max_side, path=str(path), timings=timings)
+
+    @classmethod
+    def from_bytes(
+        cls,
+        data: bytes,
+        max_side: Optional[int] = None,
+        path: Optional[str] = None,
+        timings: Optional[Dict[str, float]] = None,
+    ) -> "DecodedImage":
+        """
+        Decodes the encoded image in data. With max_side, photos whose
+        longest side is at least twice that are decoded at 1/2, 1/4 or 1/8
+        of their resolution, never below max_side. Raises ValueError if the
+        data isn't an image.
+        """
+        timings = timings if timings is not None else {}
+        start = time.perf_counter()
+        md5 = hashlib.md5(data).hexdigest()
+        timings["hash"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        size, orientation = None, 1
+        try:
+            # only the header is parsed
+            with Image.open(io.BytesIO(data)) as header:
+                width, height = header.size
+                orientation = header.getexif().get(_EXIF_ORIENTATION, 1)
+            size = (height, width) if orientation in _TRANSPOSED else (width, height)
+        except Exception:
+            pass
+        factor = _reduction(max(size), max_side) if size else 1
+        pixels = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), _REDUCED[factor])
+        if pixels is None:
+            try:
+                pixels = _decode_with_pil(data)
+            except Exception:
+                raise ValueError(f"could not decode {path or 'the image'}")
+        if size is None:
+            size = (pixels.shape[1], pixels.shape[0])
+        timings["decode"] = time.perf_counter() - start
+        return cls(
+            pixels,
+            size=size,
+            orientation=orientation,
+            md5=md5,
+            scale=size[0] / pixels.shape[1],
+            path=path,
+            timings=timings,
+        )
+
+    @property
+    def decoded_size(self) -> Tuple[int, int]:
+        return self.pixels.shape[1], self.pixels.shape[0]
+
+    def to_original(self, coordinates: np.ndarray) -> np.ndarray:
+        """Coordinates in pixels (boxes, landmarks) in the original's."""
+        if self.scale == 1.0:
+            return coordinates
+        return coordinates * np.float32(self.scale)
+
+    @contextmanager
+    def stage(self, name: str):
+        """Adds the time spent in the block to timings[name]."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = (
+                self.timings.get(name, 0.0) + time.perf_counter() - start
+            )
+
+    def describe_timings(self) -> str:
+        return ", ".join(
+            f"{name} {seconds * 1000:.1f}ms" for name, seconds in self.timings.items()
+        )
+
+
+if __name__ == "__main__":
+    import argparse
+    import os
+    import tempfile
+
+    # Cost of getting one upload to the model, as it was (PIL for the size,
+    # the model decoding the file, the md5 read from disk once more) and
+    # with one read and one decode, in full and reduced:
+    #   python -m src.face_rec.proc.decoded_image [--width 4032 --height 3024]
+    parser = argparse.ArgumentParser(description="Decode benchmark")
+    parser.add_argument("--width", type=int, default=4032)
+    parser.add_argument("--height", type=int, default=3024)
+    parser.add_argument("--max-side", type=int, default=1920)
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    # smooth content with some noise compresses like a photo
+    small = rng.integers(0, 255, (args.height // 32, args.width // 32, 3), np.uint8)
+    photo = cv2.resize(small, (args.width, args.height), interpolation=cv2.INTER_CUBIC)
+    photo = cv2.add(photo, rng.integers(0, 16, photo.shape, np.uint8))
+    path = os.path.join(tempfile.gettempdir(), "decoded_image_benchmark.jpg")
+    cv2.imwrite(path, photo, [cv2.IMWRITE_JPEG_QUALITY, 90])
+
+    def before():
+        timings = {}
+        start = time.perf_counter()
+        with Image.open(path) as image:
+            image.size
+        timings["size"] = time.perf_counter() - start
+        start = time.perf_counter()
+        cv2.imread(path)
+        timings["decode"] = time.perf_counter() - start
+        start = time.perf_counter()
+        hash_md5 = hashlib.md5()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(4096), b""):
+                hash_md5.update(chunk)
+        timings["hash"] = time.perf_counter() - start
+        return timings
+
+    def run(name, fn):
+        totals = {}
+        for _ in range(args.repeat):
+            for stage, seconds in fn().items():
+                totals[stage] = totals.get(stage, 0.0) + seconds
+        stages = ", ".join(
+            f"{stage} {seconds / args.repeat * 1000:.1f}ms"
+            for stage, seconds in totals.items()
+        )
+        total = sum(totals.values()) / args.repeat * 1000
+        print(f"{name:>22}: {total:7.1f}ms ({stages})")
+
+    print(f"{args.width}x{args.height} JPEG, {os.path.getsize(path) / 1e6:.1f}MB")
+    run("before", before)
+    run("decoded once", lambda: DecodedImage.open(path).timings)
+    reduced = DecodedImage.open(path, max_side=args.max_side)
+    run(
+        f"reduced to {reduced.decoded_size[0]}x{reduced.decoded_size[1]}",
+        lambda: DecodedImage.open(path, max_side=args.max_side).timings,
+    )
+    os.remove(path)
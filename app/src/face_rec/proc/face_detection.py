@@ -1,4 +1,5 @@
-from typing import List
+import threading
+from typing import Iterable, Iterator, List
 
 import degirum as dg
 import numpy as np
@@ -7,25 +8,67 @@ from .profiler import timed
 
 
 class HostedModel:
-    def __init__(self):
+    def __init__(self, device_type: str = "HAILORT/HAILO8"):
         self.inference_host_address = "@local"
         self.zoo_url = "./src/face_rec/zoo"
         self.token = ""
-        self.device_type = "HAILORT/HAILO8"
+        self.device_type = device_type
 
 
-class DetectionModel(HostedModel):
-    def __init__(self):
-        self.face_det_model_name = (
-            "retinaface_mobilenet--736x1280_quant_hailort_hailo8_1"
+class FaceDetections:
+    """
+    Faces found in one image as arrays, in original image coordinates:
+    boxes [N, 4] (x1, y1, x2, y2), scores [N] and landmarks [N, 5, 2], along
+    with the decoded image and the info of the inference result.
+    """
+
+    def __init__(self, boxes, scores, landmarks, image=None, info=None):
+        self.boxes = boxes
+        self.scores = scores
+        self.landmarks = landmarks
+        self.image = image
+        self.info = info
+
+    def __len__(self):
+        return len(self.scores)
+
+    @classmethod
+    def from_result(cls, result) -> "FaceDetections":
+        detections = result.results
+        return cls(
+            boxes=np.array(
+                [detection["bbox"] for detection in detections], dtype=np.float32
+            ).reshape(-1, 4),
+            scores=np.array(
+                [detection["score"] for detection in detections], dtype=np.float32
+            ),
+            landmarks=np.array(
+                [
+                    [landmark["landmark"] for landmark in detection["landmarks"]]
+                    for detection in detections
+                ],
+                dtype=np.float32,
+            ).reshape(-1, 5, 2),
+            image=result.image,
+            info=result.info,
         )
-        super().__init__()
+
+
+class DetectionModel(HostedModel):
+    def __init__(
+        self,
+        model_name: str = "retinaface_mobilenet--736x1280_quant_hailort_hailo8_1",
+        device_type: str = "HAILORT/HAILO8",
+    ):
+        self.face_det_model_name = model_name
+        super().__init__(device_type)
 
         self.model = dg.load_model(
             model_name=self.face_det_model_name,
             inference_host_address=self.inference_host_address,
             zoo_url=self.zoo_url,
             token=self.token,
+            device_type=self.device_type,
             overlay_color=(0, 255, 0),  # Green color for bounding boxes
         )
         pass
@@ -40,27 +83,77 @@ class DetectionModel(HostedModel):
         detected_faces_batch = self.model.predict_batch(path)
         return list(detected_faces_batch)
 
+    @timed
+    def detect(self, path: str) -> FaceDetections:
+        return FaceDetections.from_result(self.model(path))
+
+    @timed
+    def detect_batch(self, path: List[str]) -> List[FaceDetections]:
+        return list(self.detect_stream(path))
+
+    def detect_stream(self, frames: Iterable) -> Iterator[FaceDetections]:
+        """
+        Lazily detects faces in paths or decoded images, in input order. The
+        input is consumed as the model pipeline asks for frames, so nothing
+        has to be materialized up front.
+        """
+        for detected_faces in self.model.predict_batch(frames):
+            yield FaceDetections.from_result(detected_faces)
+
 
 class EmbeddingModel(HostedModel):
-    def __init__(self):
-        self.face_rec_model_name = (
-            "arcface_mobilefacenet--112x112_quant_hailort_hailo8_1"
-        )
-        super().__init__()
+    def __init__(
+        self,
+        model_name: str = "arcface_mobilefacenet--112x112_quant_hailort_hailo8_1",
+        device_type: str = "HAILORT/HAILO8",
+    ):
+        self.face_rec_model_name = model_name
+        # recorded with the vectors, see FaceRecognitionSchema.embedder
+        self.name = f"hailo:{model_name}"
+        super().__init__(device_type)
         # Load the face recognition model
         self.model = dg.load_model(
             model_name=self.face_rec_model_name,
             inference_host_address=self.inference_host_address,
             zoo_url=self.zoo_url,
             token=self.token,
+            device_type=self.device_type,
         )
 
     @timed
     def extract_face_embedding(self, image):
         face_embedding = self.model(image).results[0]["data"][0]
-        face_vector = np.array(face_embedding, dtype=np.float32)
+        # no copy when the postprocessor hands over a float32 ndarray
+        face_vector = np.asarray(face_embedding, dtype=np.float32)
         return face_vector
 
+    @timed
+    def extract_face_embeddings(self, images: List[np.ndarray]) -> List[np.ndarray]:
+        """
+        Embeds all crops through one batched (pipelined) inference instead of
+        a round trip per crop. The vectors are in the order of the images.
+        """
+        if not len(images):
+            return []
+        return list(self.embed_stream(images))
+
+    def embed_stream(self, images: Iterable[np.ndarray]) -> Iterator[np.ndarray]:
+        """Lazy variant of extract_face_embeddings."""
+        for result in self.model.predict_batch(images):
+            yield np.asarray(result.results[0]["data"][0], dtype=np.float32)
+
+
+# The models hold the accelerator, so the shared instances are created on
+# first use (`from .face_detection import detector`) rather than at import:
+# processes that go through the inference service never open the device.
+_shared_models = {"detector": DetectionModel, "embedding_model": EmbeddingModel}
+_shared_models_lock = threading.Lock()
+
 
-detector = DetectionModel()
-embedding_model = EmbeddingModel()
+def __getattr__(name):
+    if name not in _shared_models:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    with _shared_models_lock:
+        if name not in globals():
+            globals()[name] = _shared_models[name]()
+    return globals()[name]
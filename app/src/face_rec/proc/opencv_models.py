@@ -0,0 +1,135 @@
+import os
+from typing import Iterable, Iterator, List, Tuple
+
+import cv2
+import numpy as np
+
+from .face_detection import FaceDetections
+from .profiler import timed
+
+# Where the CPU backend looks for its models unless told otherwise
+OPENCV_ZOO = "./src/face_rec/zoo/opencv"
+DEFAULT_DETECTION_MODEL = f"{OPENCV_ZOO}/face_detection_yunet_2023mar.onnx"
+DEFAULT_EMBEDDING_MODEL = f"{OPENCV_ZOO}/w600k_mbf.onnx"
+
+
+def _read(frame) -> np.ndarray:
+    image = cv2.imread(str(frame)) if not isinstance(frame, np.ndarray) else frame
+    if image is None:
+        raise ValueError(f"could not read {frame}")
+    return image
+
+
+class OpenCvDetectionModel:
+    """
+    DetectionModel's interface on the CPU: the YuNet face detector of the
+    OpenCV model zoo (ONNX) through cv2.FaceDetectorYN. Like RetinaFace it
+    returns a box, a score and five landmarks per face (the eyes, the nose
+    and the mouth corners, image left first, the order align_and_crop
+    expects). Images are detected at max_side on their longest side at
+    most, the coordinates are scaled back to the image.
+    """
+
+    def __init__(
+        self,
+        model_path: str = DEFAULT_DETECTION_MODEL,
+        score_threshold: float = 0.6,
+        nms_threshold: float = 0.3,
+        max_side: int = 1280,
+    ):
+        self.model_path = model_path
+        self.max_side = max_side
+        self.model = cv2.FaceDetectorYN.create(
+            model_path, "", (320, 320), score_threshold, nms_threshold
+        )
+
+    def _detect_one(self, frame) -> FaceDetections:
+        image = _read(frame)
+        height, width = image.shape[:2]
+        scale = min(1.0, self.max_side / max(height, width))
+        pixels = image
+        if scale < 1.0:
+            pixels = cv2.resize(
+                image,
+                (round(width * scale), round(height * scale)),
+                interpolation=cv2.INTER_AREA,
+            )
+        self.model.setInputSize((pixels.shape[1], pixels.shape[0]))
+        _, faces = self.model.detect(pixels)
+        # [N, 15]: x, y, w, h, 5 landmarks (x, y), score
+        if faces is None:
+            faces = np.zeros((0, 15), np.float32)
+        coordinates = faces[:, :14] / np.float32(scale)
+        boxes = coordinates[:, :4].copy()
+        boxes[:, 2:] += boxes[:, :2]
+        return FaceDetections(
+            boxes=boxes,
+            scores=faces[:, 14].copy(),
+            landmarks=coordinates[:, 4:].reshape(-1, 5, 2),
+            image=image,
+        )
+
+    @timed
+    def detect(self, path) -> FaceDetections:
+        return self._detect_one(path)
+
+    @timed
+    def detect_batch(self, path: List) -> List[FaceDetections]:
+        return [self._detect_one(frame) for frame in path]
+
+    def detect_stream(self, frames: Iterable) -> Iterator[FaceDetections]:
+        for frame in frames:
+            yield self._detect_one(frame)
+
+
+class OpenCvEmbeddingModel:
+    """
+    EmbeddingModel's interface on the CPU: an ArcFace ONNX model through
+    cv2.dnn, by default MobileFaceNet (InsightFace's w600k_mbf), the family
+    of the accelerator's model. The aligned 112x112 BGR crops go in as
+    RGB, (x - 127.5) / 127.5, batch_size at a time.
+    """
+
+    def __init__(
+        self,
+        model_path: str = DEFAULT_EMBEDDING_MODEL,
+        input_size: Tuple[int, int] = (112, 112),
+        batch_size: int = 32,
+    ):
+        self.model_path = model_path
+        # recorded with the vectors, see FaceRecognitionSchema.embedder
+        self.name = f"cpu:{os.path.basename(model_path)}"
+        self.input_size = input_size
+        self.batch_size = batch_size
+        self.model = cv2.dnn.readNetFromONNX(model_path)
+
+    def _embed(self, images: List[np.ndarray]) -> np.ndarray:
+        blob = cv2.dnn.blobFromImages(
+            images,
+            scalefactor=1 / 127.5,
+            size=self.input_size,
+            mean=(127.5, 127.5, 127.5),
+            swapRB=True,
+        )
+        self.model.setInput(blob)
+        return self.model.forward().reshape(len(images), -1).astype(np.float32)
+
+    @timed
+    def extract_face_embedding(self, image) -> np.ndarray:
+        return self._embed([image])[0]
+
+    @timed
+    def extract_face_embeddings(self, images: List[np.ndarray]) -> List[np.ndarray]:
+        if not len(images):
+            return []
+        return list(self.embed_stream(images))
+
+    def embed_stream(self, images: Iterable[np.ndarray]) -> Iterator[np.ndarray]:
+        batch = []
+        for image in images:
+            batch.append(image)
+            if len(batch) >= self.batch_size:
+                yield from self._embed(batch)
+                batch = []
+        if batch:
+            yield from self._embed(batch)
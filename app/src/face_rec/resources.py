@@ -1,16 +1,20 @@
 from pathlib import Path
 
-from flask import send_file
+from flask import Response, request, send_file, stream_with_context
 from flask.views import MethodView
 from flask_smorest import Blueprint
 from flask_smorest.fields import Upload
 from loguru import logger
 from marshmallow import Schema
 from marshmallow import fields as ma_fields
+from marshmallow import validate
+from werkzeug.exceptions import NotFound
 
 from ..common.error_handler import custom_error_handler
 from ..common.temp_file import TempFile
+from ..common.versioned_cache import VersionedCache
 from .face_rec import FaceRecognizer
+from .store import VectorStoreMaintenance
 
 
 class FaceUploadSchema(Schema):
@@ -30,7 +34,45 @@ class UpdatedPersonSchema(Schema):
     isHidden = ma_fields.Bool(load_default=None)
 
 
-def register_face_rec_resources(*, bp: Blueprint, store: FaceRecognizer):
+class PersonsQuerySchema(Schema):
+    after_id = ma_fields.Int(load_default=None)
+    limit = ma_fields.Int(load_default=None, validate=validate.Range(min=1))
+
+
+class StoreChangesQuerySchema(Schema):
+    since = ma_fields.Int(required=True, validate=validate.Range(min=0))
+
+
+def register_face_rec_resources(
+    *,
+    bp: Blueprint,
+    store: FaceRecognizer,
+    maintenance: VectorStoreMaintenance = None,
+):
+    # Rendered store reads, valid until the next write bumps the store version
+    response_cache = VersionedCache()
+
+    def versioned_response(key, render, cached: bool = True):
+        """
+        JSON response tagged with the store version. Answers If-None-Match
+        with 304 and serves repeated reads from response_cache. With
+        cached=False render is a generator and the body is streamed.
+        """
+        version = store.get_store_version()
+        etag = f"store-{version}"
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        elif cached:
+            body = response_cache.get(key, version, render)
+            response = Response(body, mimetype="application/json")
+        else:
+            response = Response(
+                stream_with_context(render()), mimetype="application/json"
+            )
+        response.set_etag(etag)
+        response.headers["Cache-Control"] = "no-cache"
+        return response
+
     @bp.route("/register_face/of/<string:name>")
     class FaceRegisterPerson(MethodView):
         @custom_error_handler
@@ -52,13 +94,13 @@ def register_face_rec_resources(*, bp: Blueprint, store: FaceRecognizer):
             persons = store.search_face(vector=args["vector"], face=args["face"])
             return [person.model_dump() for person in persons]
 
-    @bp.route("/<string:face_id>/reassign_to/<string:name>")
+    @bp.route("/<string:face_id>/reassign_to/<string:new_person_name>")
     class FaceReassignNew(MethodView):
         @custom_error_handler
         def put(self, face_id, new_person_name):
             face = store.update_face(face_id=face_id, new_person_name=new_person_name)
             if not face:
-                raise FileNotFoundError
+                raise NotFound(f"face {face_id} not found")
             return face.model_dump()
 
     @bp.route("/face/<id>")
@@ -81,29 +123,56 @@ def register_face_rec_resources(*, bp: Blueprint, store: FaceRecognizer):
     class FacePerson(MethodView):
         @custom_error_handler
         def get(self, id):
-            person = store.get_person_by_face(id=id)
-            return person.model_dump()
+            def render():
+                person = store.get_person_by_face(id=id)
+                if not person:
+                    raise FileNotFoundError
+                return person.model_dump_json()
+
+            return versioned_response(("face_person", id), render)
 
     @bp.route("/persons")
     class Persons(MethodView):
         @custom_error_handler
-        def get(self):
-            try:
-                logger.info("Persons: query received")
-                persons = store.get_all_persons()
-                logger.info(f"Persons: {len(persons)} items found")
-                logger.info(persons)
-                if len(persons) > 0:
-                    result = [person.model_dump() for person in persons]
-                    logger.info(f"Persons: returning {result}")
-                    return result
-                else:
-                    result = []
-                    logger.warning("Persons: Returns Empty")
-                    return result
-            except Exception as e:
-                logger.error(f"Exception. {e}")
-                raise
+        @bp.arguments(PersonsQuerySchema, location="query")
+        def get(self, args):
+            """
+            Streams the persons as a JSON array, ?after_id=&limit= for a page.
+            Pages are cached per store version, the full list is only
+            streamed so that its size never has to be held in memory.
+            """
+            logger.info(f"Persons: query received {args}")
+            after_id, limit = args["after_id"], args["limit"]
+
+            def generate():
+                count = 0
+                yield "["
+                for person in store.iter_all_persons(after_id=after_id, limit=limit):
+                    yield ("," if count else "") + person.model_dump_json()
+                    count += 1
+                yield "]"
+                logger.info(f"Persons: {count} items returned")
+
+            if limit is not None:
+                return versioned_response(
+                    ("persons", after_id, limit), lambda: "".join(generate())
+                )
+            return versioned_response(("persons",), generate, cached=False)
+
+    @bp.route("/changes")
+    class StoreChanges(MethodView):
+        @custom_error_handler
+        @bp.arguments(StoreChangesQuerySchema, location="query")
+        def get(self, args):
+            """
+            Persons and faces changed since the version the client has.
+            """
+            since = args["since"]
+
+            def render():
+                return store.get_store_changes(since=since).model_dump_json()
+
+            return versioned_response(("changes", since), render)
 
     @bp.route("/person/<int:id>")
     class Person(MethodView):
@@ -111,24 +180,52 @@ def register_face_rec_resources(*, bp: Blueprint, store: FaceRecognizer):
         def get(self, id):
             try:
                 logger.info(f"Person {id}: query received")
-                person = store.get_person_by_id(id=id)
-                if person:
-                    result = person.model_dump()
-                    logger.info(f"Person {id}: returning {result}")
-                    return result
-                else:
-                    logger.warning(f"Person {id}: not found")
-                    raise FileNotFoundError  ## Recheck error
+
+                def render():
+                    person = store.get_person_by_id(id=id)
+                    if not person:
+                        logger.warning(f"Person {id}: not found")
+                        raise FileNotFoundError  ## Recheck error
+                    return person.model_dump_json()
+
+                return versioned_response(("person", id), render)
             except Exception as e:
                 logger.error(f"Exception. {e}")
                 raise
 
         @bp.arguments(UpdatedPersonSchema, location="form")
         def put(self, args, id):
-            person = store.update_person(**args)
+            person = store.update_person(
+                id=id,
+                new_name=args["name"],
+                is_hidden=args["isHidden"],
+                key_face_id=args["keyFaceId"],
+            )
             return person.model_dump()
 
         def delete(self, person_id):
             if store.forget_person(person_id=person_id):
                 return {"status": f"face with id {person_id} deleted"}
             raise FileNotFoundError  ## Recheck error
+
+    if maintenance:
+
+        @bp.route("/maintenance")
+        class Maintenance(MethodView):
+            @custom_error_handler
+            def get(self):
+                last_run = maintenance.last_run
+                index_manager = maintenance.index_manager
+                return {
+                    "health": maintenance.inspect().model_dump(),
+                    "lastRun": last_run.model_dump() if last_run else None,
+                    "index": (
+                        index_manager.status().model_dump() if index_manager else None
+                    ),
+                    "lastIndexUpdate": maintenance.last_index_update,
+                }
+
+            @custom_error_handler
+            def post(self):
+                stats = maintenance.run_once(force=True)
+                return {"lastRun": stats.model_dump() if stats else None}
@@ -1,4 +1,7 @@
+from .ann_index import AnnIndexManager
 from .face_vector_store import FaceRecognitionSchema, FaceVectorStore
+from .maintenance import VectorStoreMaintenance
 from .registered_faces import faces_db
 from .registered_person import person_db
+from .vector_index import InMemoryVectorIndex
 from .versioning import store_version_db
@@ -0,0 +1,214 @@
+import math
+import threading
+import time
+from typing import List, Optional, Sequence
+
+import numpy as np
+from loguru import logger
+from pydantic import BaseModel
+
+from .face_vector_store import FaceVectorStore
+
+
+class AnnIndexStatus(BaseModel):
+    indexType: Optional[str] = None
+    indexedRows: int = 0
+    unindexedRows: int = 0
+    rowsAtTraining: int = 0
+    lastBuildSeconds: Optional[float] = None
+    nprobes: Optional[int] = None
+    refineFactor: Optional[int] = None
+
+
+class RecallPoint(BaseModel):
+    nprobes: Optional[int]
+    refineFactor: Optional[int]
+    recall: float
+    meanLatencyMs: float
+    p95LatencyMs: float
+
+
+class RecallReport(BaseModel):
+    queries: int
+    count: int
+    exactMeanLatencyMs: float
+    exactP95LatencyMs: float
+    points: List[RecallPoint]
+
+
+class AnnIndexManager:
+    """
+    Builds and maintains an approximate index on the `vector` column.
+
+    Below `min_rows` the table is small enough for an exhaustive scan and no
+    index is created. Once it passes that size, an index is trained; it is
+    retrained from scratch when the table has grown by `retrain_growth`
+    since the last training, and rows appended in between are folded into
+    the existing index. `maybe_update` is meant to be called periodically
+    from a background thread (see VectorStoreMaintenance).
+    """
+
+    def __init__(
+        self,
+        store: FaceVectorStore,
+        min_rows: int = 50_000,
+        index_type: str = "IVF_PQ",
+        retrain_growth: float = 0.5,
+        max_unindexed_rows: int = 5_000,
+        num_sub_vectors: int = 64,
+    ):
+        self.store = store
+        self.min_rows = min_rows
+        self.index_type = index_type
+        self.retrain_growth = retrain_growth
+        self.max_unindexed_rows = max_unindexed_rows
+        self.num_sub_vectors = num_sub_vectors
+
+        self.rows_at_training = 0
+        self.last_build_seconds: Optional[float] = None
+        self._build_lock = threading.Lock()
+
+    def _index(self):
+        for index in self.store.tbl.list_indices():
+            if "vector" in index.columns:
+                return index
+        return None
+
+    def status(self) -> AnnIndexStatus:
+        status = AnnIndexStatus(
+            rowsAtTraining=self.rows_at_training,
+            lastBuildSeconds=self.last_build_seconds,
+            nprobes=self.store.nprobes,
+            refineFactor=self.store.refine_factor,
+        )
+        index = self._index()
+        if index is not None:
+            stats = self.store.tbl.index_stats(index.name)
+            status.indexType = stats.index_type
+            status.indexedRows = stats.num_indexed_rows
+            status.unindexedRows = stats.num_unindexed_rows
+        return status
+
+    def maybe_update(self) -> Optional[str]:
+        """
+        Creates, retrains or incrementally updates the index when needed.
+        Returns a description of what was done, None if nothing was needed.
+        """
+        if not self._build_lock.acquire(blocking=False):
+            return None
+        try:
+            rows = self.store.tbl.count_rows()
+            if rows < self.min_rows:
+                return None
+            index = self._index()
+            if index is None:
+                return self.build(rows)
+            if not self.rows_at_training:
+                # index trained by an earlier process
+                self.rows_at_training = (
+                    self.store.tbl.index_stats(index.name).num_indexed_rows
+                )
+            if rows >= self.rows_at_training * (1 + self.retrain_growth):
+                return self.build(rows)
+            unindexed = self.store.tbl.index_stats(index.name).num_unindexed_rows
+            if unindexed > self.max_unindexed_rows:
+                with self.store.write_lock:
+                    self.store.tbl.to_lance().optimize.optimize_indices()
+                    self.store.tbl.checkout_latest()
+                return f"{unindexed} rows added to the vector index"
+            return None
+        finally:
+            self._build_lock.release()
+
+    def build(self, rows: Optional[int] = None) -> str:
+        """
+        Trains the index from scratch. Like the other commits to the table it
+        holds the store's write lock, so writes wait for the training.
+        """
+        rows = rows if rows is not None else self.store.tbl.count_rows()
+        num_partitions = max(1, min(int(math.sqrt(rows)), rows // 256))
+        start = time.perf_counter()
+        with self.store.write_lock:
+            self.store.tbl.create_index(
+                metric="cosine",
+                vector_column_name="vector",
+                index_type=self.index_type,
+                num_partitions=num_partitions,
+                num_sub_vectors=self.num_sub_vectors,
+                replace=True,
+            )
+            self.store.tbl.checkout_latest()
+        self.last_build_seconds = round(time.perf_counter() - start, 3)
+        self.rows_at_training = rows
+        msg = (
+            f"{self.index_type} index trained on {rows} rows with "
+            f"{num_partitions} partitions in {self.last_build_seconds}s"
+        )
+        logger.info(msg)
+        return msg
+
+    def sample_queries(self, size: int) -> np.ndarray:
+        arrow = self.store.tbl.to_lance().sample(size, columns=["vector"])
+        column = arrow.column("vector").combine_chunks()
+        return column.flatten().to_numpy().reshape(-1, self.store.dim)
+
+    def recall_report(
+        self,
+        queries: Optional[np.ndarray] = None,
+        sample_size: int = 100,
+        count: int = 10,
+        nprobes: Sequence[int] = (5, 10, 20, 50),
+        refine_factors: Sequence[Optional[int]] = (None, 5, 10),
+    ) -> RecallReport:
+        """
+        Measures recall@count and latency of the approximate search for each
+        (nprobes, refine_factor) pair against the exhaustive result.
+        """
+        if queries is None:
+            queries = self.sample_queries(sample_size)
+        queries = np.asarray(queries, dtype=np.float32).reshape(-1, self.store.dim)
+
+        def run(vector, exact, probes=None, refine=None):
+            query = self.store.tbl.search(vector, vector_column_name="vector")
+            query = query.metric("cosine").limit(count)
+            if exact:
+                query = query.bypass_vector_index()
+            else:
+                query = query.nprobes(probes)
+                if refine:
+                    query = query.refine_factor(refine)
+            start = time.perf_counter()
+            ids = [row["id"] for row in query.to_list()]
+            return ids, (time.perf_counter() - start) * 1000
+
+        exact_ids, exact_latency = [], []
+        for vector in queries:
+            ids, latency = run(vector, exact=True)
+            exact_ids.append(set(ids))
+            exact_latency.append(latency)
+
+        points = []
+        for probes in nprobes:
+            for refine in refine_factors:
+                hits, total, latencies = 0, 0, []
+                for vector, expected in zip(queries, exact_ids):
+                    ids, latency = run(vector, False, probes, refine)
+                    hits += len(expected.intersection(ids))
+                    total += len(expected)
+                    latencies.append(latency)
+                points.append(
+                    RecallPoint(
+                        nprobes=probes,
+                        refineFactor=refine,
+                        recall=round(hits / total, 4) if total else 1.0,
+                        meanLatencyMs=round(float(np.mean(latencies)), 3),
+                        p95LatencyMs=round(float(np.percentile(latencies, 95)), 3),
+                    )
+                )
+        return RecallReport(
+            queries=len(queries),
+            count=count,
+            exactMeanLatencyMs=round(float(np.mean(exact_latency)), 3),
+            exactP95LatencyMs=round(float(np.percentile(exact_latency, 95)), 3),
+            points=points,
+        )
@@ -1,49 +1,325 @@
+import os
+import threading
 import uuid
-from typing import List
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
 
 import lancedb
 import numpy as np
+import pyarrow as pa
 from lancedb.pydantic import LanceModel, Vector
 from loguru import logger
 from pydantic import BaseModel
 
+from .vector_index import NO_PERSON, InMemoryVectorIndex, normalize_rows
+
 
 class FaceIdWithConfidence(BaseModel):
     id: str
     confidence: float
+    person_id: Optional[int] = None
+
+
+class PersonWithConfidence(BaseModel):
+    person_id: int
+    confidence: float
+    face_id: str  # best matching face of the person
+    face_confidence: float
 
 
 class FaceRecognitionSchema(LanceModel):
     id: str  # Unique identifier for each entry
     vector: Vector(512)  # type: ignore # Face embeddings, fixed size of 512
+    # Denormalized from the person table so that search needs no SQLite lookup
+    person_id: int = NO_PERSON
+    is_hidden: bool = False
+    is_deleted: bool = False
+    # The embedding model that produced the vector (its `name`, e.g.
+    # "hailo:arcface_mobilefacenet--112x112_quant_hailort_hailo8_1"), empty
+    # for vectors uploaded by clients and written before it was recorded
+    embedder: str = ""
+
+
+# Schema before person_id and the person flags were denormalized
+LEGACY_SCHEMA_FIELDS = ["id", "vector"]
+# Schema before the embedder was recorded, migrated in place
+NO_EMBEDDER_SCHEMA_FIELDS = ["id", "vector", "person_id", "is_hidden", "is_deleted"]
 
 
 class FaceVectorStore:
-    def __init__(self, db, table_name: str):
+    def __init__(
+        self,
+        db,
+        table_name: str,
+        in_memory: bool = False,
+        index_dtype: str = "float32",
+    ):
+        self.db = db
+        self.table_name = table_name
+        self.dim = (
+            FaceRecognitionSchema.to_arrow_schema().field("vector").type.list_size
+        )
+        # Set when the table still has the legacy schema, see backfill()
+        self.needs_backfill = False
         # Initialize the table
         if table_name not in db.table_names():
             tbl = db.create_table(
                 table_name,
                 schema=FaceRecognitionSchema,
                 data=[
-                    {"id": "rand_0", "vector": np.random.rand(512).astype(np.float32)}
+                    FaceRecognitionSchema(
+                        id="rand_0",
+                        vector=np.random.rand(self.dim).astype(np.float32),
+                    ).model_dump()
                 ],
             )
 
         else:
             tbl = db.open_table(table_name)
             schema_fields = [field.name for field in tbl.schema]
-            if schema_fields != list(FaceRecognitionSchema.model_fields.keys()):
+            if schema_fields == LEGACY_SCHEMA_FIELDS:
+                logger.warning(
+                    f"Table {table_name} has no person columns, backfill required."
+                )
+                self.needs_backfill = True
+            elif schema_fields == NO_EMBEDDER_SCHEMA_FIELDS:
+                logger.warning(f"Table {table_name} has no embedder column, adding it.")
+                tbl.add_columns({"embedder": "''"})
+            elif schema_fields != list(FaceRecognitionSchema.model_fields.keys()):
                 raise RuntimeError(f"Table {table_name} has a different schema.")
         self.tbl = tbl
+        # Serializes writers (add/remove and table maintenance). Searches never
+        # take it, Lance readers work on their own snapshot of the table.
+        self.write_lock = threading.Lock()
+        # Approximate search tuning, None keeps the lancedb defaults
+        self.nprobes: Optional[int] = None
+        self.refine_factor: Optional[int] = None
+
+        # Optional resident copy of the vectors, LanceDB stays the durable store.
+        # A compressed copy re-ranks its candidates with float32 vectors in a
+        # memory-mapped file of this process in the db directory, rewritten by
+        # every rebuild; without a local directory, with the vectors in Lance.
+        self.index = None
+        if in_memory:
+            exact_dir = str(db.uri) if os.path.isdir(str(db.uri)) else None
+            self.index = InMemoryVectorIndex(
+                dim=self.dim,
+                dtype=index_dtype,
+                fetch=self.fetch_vectors,
+                exact_dir=exact_dir,
+            )
+            self.index.rebuild(self.tbl)
+
+    def backfill(
+        self, lookup: Callable[[List[str]], Dict[str, Tuple[int, bool, bool]]]
+    ):
+        """
+        Migrates a legacy (id, vector) table to the current schema.
+
+        lookup maps face ids to (person_id, is_hidden, is_deleted); ids it
+        doesn't know keep NO_PERSON. The table is rewritten as a new version,
+        so older versions still hold the legacy layout until cleaned up.
+        """
+        if not self.needs_backfill:
+            return
+        with self.write_lock:
+            arrow = self.tbl.to_arrow()
+            ids = arrow.column("id").to_pylist()
+            identities = lookup(ids)
+            person_ids, hidden, deleted = [], [], []
+            for id in ids:
+                person_id, is_hidden, is_deleted = identities.get(
+                    id, (NO_PERSON, False, False)
+                )
+                person_ids.append(person_id)
+                hidden.append(bool(is_hidden))
+                deleted.append(bool(is_deleted))
+            migrated = pa.table(
+                {
+                    "id": arrow.column("id"),
+                    "vector": arrow.column("vector"),
+                    "person_id": pa.array(person_ids, type=pa.int64()),
+                    "is_hidden": pa.array(hidden, type=pa.bool_()),
+                    "is_deleted": pa.array(deleted, type=pa.bool_()),
+                    "embedder": pa.array([""] * len(ids), type=pa.string()),
+                },
+                schema=FaceRecognitionSchema.to_arrow_schema(),
+            )
+            self.tbl = self.db.create_table(
+                self.table_name, data=migrated, mode="overwrite"
+            )
+            self.needs_backfill = False
+        if self.index is not None:
+            self.index.rebuild(self.tbl)
+        logger.info(
+            f"Table {self.table_name} backfilled, "
+            f"{sum(1 for id in ids if id in identities)}/{len(ids)} vectors matched a face"
+        )
+
+    def add(
+        self,
+        id: str,
+        vector: Vector(512),  # type: ignore
+        person_id: int = NO_PERSON,
+        is_hidden: bool = False,
+        is_deleted: bool = False,
+        embedder: str = "",
+    ):
+        row = FaceRecognitionSchema(
+            id=id,
+            vector=vector,
+            person_id=person_id,
+            is_hidden=is_hidden,
+            is_deleted=is_deleted,
+            embedder=embedder,
+        )
+        with self.write_lock:
+            self.tbl.add(data=[row])
+        if self.index is not None:
+            self.index.add(id, vector, person_id, is_hidden, is_deleted)
+
+    def add_many(
+        self,
+        ids: List[str],
+        vectors: np.ndarray,
+        person_ids: Optional[Sequence[int]] = None,
+        hidden: Optional[Sequence[bool]] = None,
+        deleted: Optional[Sequence[bool]] = None,
+        embedder: str = "",
+    ):
+        """
+        Appends all vectors in one Lance write (one fragment, one version).
+        """
+        if len(ids) == 0:
+            return
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        person_ids = person_ids if person_ids is not None else [NO_PERSON] * len(ids)
+        hidden = hidden if hidden is not None else [False] * len(ids)
+        deleted = deleted if deleted is not None else [False] * len(ids)
+        data = [
+            FaceRecognitionSchema(
+                id=id,
+                vector=vector,
+                person_id=person_id,
+                is_hidden=is_hidden,
+                is_deleted=is_deleted,
+                embedder=embedder,
+            )
+            for id, vector, person_id, is_hidden, is_deleted in zip(
+                ids, vectors, person_ids, hidden, deleted
+            )
+        ]
+        with self.write_lock:
+            self.tbl.add(data=data)
+        if self.index is not None:
+            self.index.add_many(ids, vectors, person_ids, hidden, deleted)
+
+    def update_person(
+        self,
+        person_id: int,
+        is_hidden: Optional[bool] = None,
+        is_deleted: Optional[bool] = None,
+    ):
+        """
+        Propagates the person flags to all the vectors of that person.
+        """
+        values = {}
+        if is_hidden is not None:
+            values["is_hidden"] = bool(is_hidden)
+        if is_deleted is not None:
+            values["is_deleted"] = bool(is_deleted)
+        if not values:
+            return
+        with self.write_lock:
+            self.tbl.update(where=f"person_id = {int(person_id)}", values=values)
+        if self.index is not None:
+            self.index.update_person(person_id, is_hidden, is_deleted)
+
+    def reassign(
+        self,
+        ids: List[str],
+        person_id: int,
+        is_hidden: bool = False,
+        is_deleted: bool = False,
+    ):
+        """
+        Moves the given face vectors to another person.
+        """
+        if len(ids) == 0:
+            return
+        id_list = ", ".join(f"'{id}'" for id in ids)
+        with self.write_lock:
+            self.tbl.update(
+                where=f"id IN ({id_list})",
+                values={
+                    "person_id": int(person_id),
+                    "is_hidden": bool(is_hidden),
+                    "is_deleted": bool(is_deleted),
+                },
+            )
+        if self.index is not None:
+            self.index.reassign(ids, person_id, is_hidden, is_deleted)
+
+    def remove_person(self, person_id: int):
+        with self.write_lock:
+            self.tbl.delete(f"person_id = {int(person_id)}")
+        if self.index is not None:
+            for id in self.index.face_ids_of(person_id):
+                self.index.remove(id)
+        return True
 
-    def add(self, id: str, vector: Vector(512)):  # type: ignore
-        self.tbl.add(data=[FaceRecognitionSchema(id=id, vector=vector)])
+    def remove_many(self, ids: List[str]):
+        if len(ids) == 0:
+            return True
+        id_list = ", ".join(f"'{id}'" for id in ids)
+        with self.write_lock:
+            self.tbl.delete(f"id IN ({id_list})")
+        if self.index is not None:
+            for id in ids:
+                self.index.remove(id)
+        return True
 
     def remove(self, id: str):
-        self.tbl.delete(f"id = '{id}'")
+        with self.write_lock:
+            self.tbl.delete(f"id = '{id}'")
+        if self.index is not None:
+            self.index.remove(id)
         return True
 
+    def embedder_counts(self) -> Dict[str, int]:
+        """
+        Vectors per embedder. Vectors of different embedders only compare
+        if the models share their weights.
+        """
+        if self.needs_backfill:
+            return {}
+        counts = (
+            self.tbl.to_lance()
+            .to_table(columns=["embedder"])
+            .column("embedder")
+            .value_counts()
+        )
+        return {item["values"].as_py(): item["counts"].as_py() for item in counts}
+
+    def fetch_vectors(self, ids: List[str]) -> Dict[str, np.ndarray]:
+        """
+        Returns the stored float32 vector of each of the given ids that exist.
+        """
+        if len(ids) == 0:
+            return {}
+        id_list = ", ".join(f"'{id}'" for id in ids)
+        arrow = (
+            self.tbl.search()
+            .where(f"id IN ({id_list})")
+            .select(["id", "vector"])
+            .limit(len(ids))
+            .to_arrow()
+        )
+        if arrow.num_rows == 0:
+            return {}
+        column = arrow.column("vector").combine_chunks()
+        vectors = column.flatten().to_numpy().reshape(-1, self.dim)
+        return dict(zip(arrow.column("id").to_pylist(), vectors))
+
     def search(self, id: str):
         result = self.tbl.search().where(f"id = '{id}'").limit(1).to_list()
         if result:
@@ -57,29 +333,276 @@ class FaceVectorStore:
         threshold: float = 0.85,
         metric_type: str = "cosine",
         count: int = 1,
+        exact: Optional[bool] = None,
+        include_hidden: bool = True,
     ) -> list[FaceIdWithConfidence]:
+        """
+        exact=True forces an exhaustive search, exact=False uses the Lance
+        vector index when there is one. By default the in-memory index is
+        used when enabled, otherwise whatever Lance picks.
+
+        Faces of deleted persons are never returned, faces of hidden persons
+        only with include_hidden.
+        """
         result: List[FaceIdWithConfidence] = []
-        num_vectors = self.tbl.count_rows()
-        if num_vectors == 0:
-            return result
-
         threshold = 0.3
-        faces_found = (
+        if self._use_in_memory(metric_type, exact):
+            faces_found = self.index.search(
+                vector, count=count, include_hidden=include_hidden
+            )
+        else:
+            num_vectors = self.tbl.count_rows()
+            if num_vectors == 0:
+                return result
+
+            faces_found = [
+                self._lance_hit(face_found)
+                for face_found in self._lance_query(
+                    vector,
+                    metric_type=metric_type,
+                    count=count,
+                    exact=exact,
+                    include_hidden=include_hidden,
+                ).to_list()
+            ]
+
+        result = self._to_results(faces_found, threshold)
+        logger.info(result)
+        return result
+
+    def search_many(
+        self,
+        vectors: np.ndarray,
+        count: int = 1,
+        threshold: float = 0.3,
+        metric_type: str = "cosine",
+        exact: Optional[bool] = None,
+        include_hidden: bool = True,
+    ) -> List[List[FaceIdWithConfidence]]:
+        """
+        Batched vector_search: scores all N query vectors ([N, 512]) against
+        the store in one operation and returns the hits of each query.
+        """
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        if len(vectors) == 0:
+            return []
+        if self._use_in_memory(metric_type, exact):
+            faces_found = self.index.search_many(
+                vectors, count=count, include_hidden=include_hidden
+            )
+        else:
+            faces_found = [[] for _ in range(len(vectors))]
+            if self.tbl.count_rows() == 0:
+                return faces_found
+            rows = self._lance_query(
+                list(vectors),
+                metric_type=metric_type,
+                count=count,
+                exact=exact,
+                include_hidden=include_hidden,
+            ).to_list()
+            for row in rows:
+                faces_found[row.get("query_index", 0)].append(self._lance_hit(row))
+            for hits in faces_found:
+                hits.sort(key=lambda hit: hit[1], reverse=True)
+
+        results = [self._to_results(hits, threshold) for hits in faces_found]
+        logger.info(f"search_many: {[len(hits) for hits in results]} hits per query")
+        return results
+
+    def search_persons(
+        self,
+        vector: Vector(512),  # type: ignore
+        count: int = 1,
+        threshold: float = 0.3,
+        candidates: int = 8,
+        top_faces: int = 3,
+        include_hidden: bool = True,
+    ) -> List[PersonWithConfidence]:
+        """
+        Person-level search: one entry per person, see search_persons_many.
+        """
+        return self.search_persons_many(
+            np.reshape(vector, (1, self.dim)),
+            count=count,
+            threshold=threshold,
+            candidates=candidates,
+            top_faces=top_faces,
+            include_hidden=include_hidden,
+        )[0]
+
+    def search_persons_many(
+        self,
+        vectors: np.ndarray,
+        count: int = 1,
+        threshold: float = 0.3,
+        candidates: int = 8,
+        top_faces: int = 3,
+        include_hidden: bool = True,
+    ) -> List[List[PersonWithConfidence]]:
+        """
+        With the in-memory index, persons are first ranked by their centroid
+        and only the faces of the `candidates` best persons are rescored.
+        Without it, the persons of the nearest faces in Lance are the
+        candidates, and all their faces are read back and rescored. Either
+        way a person's confidence is the mean of its `top_faces` best face
+        scores, while the threshold applies to its best face score
+        (face_confidence), as it did when faces were matched one by one.
+        """
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        if len(vectors) == 0:
+            return []
+        if self.index is not None:
+            persons_found = self.index.search_persons_many(
+                vectors,
+                count=count,
+                candidates=candidates,
+                top_faces=top_faces,
+                include_hidden=include_hidden,
+            )
+        else:
+            faces_found = self.search_many(
+                vectors,
+                count=max(candidates, count) * top_faces,
+                threshold=-1.0,
+                include_hidden=include_hidden,
+            )
+            persons_found = self._rescore_persons(
+                vectors,
+                faces_found,
+                count=count,
+                candidates=candidates,
+                top_faces=top_faces,
+                include_hidden=include_hidden,
+            )
+
+        results = []
+        for hits in persons_found:
+            result = []
+            for person_id, score, face_id, face_score in hits:
+                face_confidence = round(face_score, 2)
+                if face_confidence >= threshold:
+                    result.append(
+                        PersonWithConfidence(
+                            person_id=person_id,
+                            confidence=round(score, 2),
+                            face_id=face_id,
+                            face_confidence=face_confidence,
+                        )
+                    )
+            results.append(result)
+        return results
+
+    def _rescore_persons(
+        self,
+        vectors: np.ndarray,
+        faces_found: List[List[FaceIdWithConfidence]],
+        count: int,
+        candidates: int,
+        top_faces: int,
+        include_hidden: bool = True,
+    ) -> List[List[Tuple[int, float, str, float]]]:
+        """
+        The `candidates` first persons of each query's face hits, scored on
+        all their faces, not only on those among the hits: one filtered read
+        of the faces of every candidate of the batch, then exact cosine
+        scores. Returns what InMemoryVectorIndex.search_persons_many does.
+        """
+        wanted = []
+        for hits in faces_found:
+            persons = []
+            # hits are sorted best first
+            for hit in hits:
+                if hit.person_id is not None and hit.person_id not in persons:
+                    persons.append(hit.person_id)
+            wanted.append(persons[: max(candidates, count)])
+        union = sorted({person_id for persons in wanted for person_id in persons})
+        if not union or count < 1:
+            return [[] for _ in wanted]
+
+        condition = f"person_id IN ({', '.join(str(id) for id in union)})"
+        condition += " AND is_deleted = false"
+        if not include_hidden:
+            condition += " AND is_hidden = false"
+        table = self.tbl.to_lance().to_table(
+            columns=["id", "vector", "person_id"], filter=condition
+        )
+        ids = table.column("id").to_pylist()
+        owners = table.column("person_id").to_numpy()
+        faces = (
+            table.column("vector")
+            .combine_chunks()
+            .flatten()
+            .to_numpy()
+            .reshape(-1, self.dim)
+        )
+        all_scores = normalize_rows(vectors) @ normalize_rows(faces).T
+
+        results = []
+        for scores, persons in zip(all_scores, wanted):
+            ranked = []
+            for person_id in persons:
+                rows = np.nonzero(owners == person_id)[0]
+                if len(rows) == 0:
+                    continue
+                person_scores = scores[rows]
+                order = np.argsort(-person_scores)[:top_faces]
+                ranked.append(
+                    (
+                        int(person_id),
+                        float(person_scores[order].mean()),
+                        ids[rows[order[0]]],
+                        float(person_scores[order[0]]),
+                    )
+                )
+            ranked.sort(key=lambda hit: hit[1], reverse=True)
+            results.append(ranked[:count])
+        return results
+
+    def _use_in_memory(self, metric_type: str, exact: Optional[bool]) -> bool:
+        return self.index is not None and metric_type == "cosine" and exact != False
+
+    def _lance_query(
+        self,
+        vector,
+        metric_type: str,
+        count: int,
+        exact: Optional[bool],
+        include_hidden: bool = True,
+    ):
+        query = (
             self.tbl.search(vector, vector_column_name="vector")
             .metric(metric_type)
             .limit(count)
-            .to_list()
         )
-
-        for face_found in faces_found:
-            similarity_score = round(1 - face_found["_distance"], 2)
+        if not self.needs_backfill:
+            condition = "is_deleted = false"
+            if not include_hidden:
+                condition += " AND is_hidden = false"
+            query = query.where(condition, prefilter=True)
+        if exact:
+            return query.bypass_vector_index()
+        if self.nprobes:
+            query = query.nprobes(self.nprobes)
+        if self.refine_factor:
+            query = query.refine_factor(self.refine_factor)
+        return query
+
+    def _lance_hit(self, row) -> Tuple[str, float, int]:
+        return (row["id"], 1 - row["_distance"], row.get("person_id", NO_PERSON))
+
+    def _to_results(self, faces_found, threshold: float) -> List[FaceIdWithConfidence]:
+        result: List[FaceIdWithConfidence] = []
+        for identity, score, person_id in faces_found:
+            similarity_score = round(score, 2)
             if similarity_score >= threshold:
-                identity = face_found["id"]
                 result.append(
-                    FaceIdWithConfidence(id=identity, confidence=similarity_score)
+                    FaceIdWithConfidence(
+                        id=identity,
+                        confidence=similarity_score,
+                        person_id=person_id if person_id != NO_PERSON else None,
+                    )
                 )
-
-        logger.info(result)
         return result
 
 
@@ -0,0 +1,193 @@
+import threading
+import time
+from datetime import timedelta
+from typing import Callable, Dict, List, Optional
+
+from loguru import logger
+from pydantic import BaseModel
+
+from .ann_index import AnnIndexManager
+from .face_vector_store import FaceVectorStore
+
+
+class TableHealth(BaseModel):
+    rows: int = 0
+    fragments: int = 0
+    deletedRows: int = 0
+    deletedRatio: float = 0.0
+    versions: int = 0
+    # vectors per embedding model, see FaceVectorStore.embedder_counts
+    embedders: Dict[str, int] = {}
+
+
+class MaintenanceStats(BaseModel):
+    startedAt: float
+    seconds: float = 0.0
+    actions: List[str] = []
+    before: TableHealth
+    after: Optional[TableHealth] = None
+    error: Optional[str] = None
+
+
+class VectorStoreMaintenance:
+    """
+    Background compaction and version cleanup for the face vector table.
+
+    Every FaceVectorStore.add/remove commits a new Lance version with a tiny
+    fragment. A daemon thread inspects the table every `interval_seconds`
+    and, when the fragment count or the ratio of deleted rows crosses its
+    threshold, compacts the fragments (materializing deletes) and removes
+    versions older than `keep_versions_for`.
+
+    When an AnnIndexManager is given, each tick also lets it create, retrain
+    or update the approximate vector index, and with compact_log (e.g.
+    TableVersion.compact_changes) each tick trims the store's change log.
+
+    Writes to the store are serialized with the store's write lock while a
+    run commits. Searches never take that lock: Lance readers work on their
+    own snapshot, so an in-flight vector_search is never blocked.
+    """
+
+    def __init__(
+        self,
+        store: FaceVectorStore,
+        interval_seconds: float = 600,
+        max_fragments: int = 32,
+        max_deleted_ratio: float = 0.1,
+        keep_versions_for: timedelta = timedelta(hours=1),
+        index_manager: Optional[AnnIndexManager] = None,
+        compact_log: Optional[Callable[[], int]] = None,
+    ):
+        self.store = store
+        self.interval_seconds = interval_seconds
+        self.max_fragments = max_fragments
+        self.max_deleted_ratio = max_deleted_ratio
+        self.keep_versions_for = keep_versions_for
+        self.index_manager = index_manager
+        self.compact_log = compact_log
+
+        self.last_run: Optional[MaintenanceStats] = None
+        self.last_index_update: Optional[str] = None
+        self._run_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._loop, name="vector-store-maintenance", daemon=True
+        )
+        self._thread.start()
+        logger.info(
+            f"vector store maintenance scheduled every {self.interval_seconds}s"
+        )
+
+    def stop(self, timeout: Optional[float] = None):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _loop(self):
+        while not self._stop.wait(self.interval_seconds):
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error(f"vector store maintenance failed: {e}")
+            if self.index_manager is not None:
+                try:
+                    action = self.index_manager.maybe_update()
+                    if action:
+                        self.last_index_update = action
+                except Exception as e:
+                    logger.error(f"vector index update failed: {e}")
+            if self.compact_log is not None:
+                try:
+                    removed = self.compact_log()
+                    if removed:
+                        logger.info(f"change log compacted, {removed} entries removed")
+                except Exception as e:
+                    logger.error(f"change log compaction failed: {e}")
+
+    def inspect(self) -> TableHealth:
+        tbl = self.store.tbl
+        dataset = tbl.to_lance()
+        fragments = dataset.get_fragments()
+        physical_rows = 0
+        deleted_rows = 0
+        for fragment in fragments:
+            metadata = fragment.metadata
+            physical_rows += metadata.physical_rows
+            if metadata.deletion_file is not None:
+                deleted_rows += metadata.deletion_file.num_deleted_rows
+        return TableHealth(
+            rows=physical_rows - deleted_rows,
+            fragments=len(fragments),
+            deletedRows=deleted_rows,
+            deletedRatio=(
+                round(deleted_rows / physical_rows, 4) if physical_rows else 0.0
+            ),
+            versions=len(tbl.list_versions()),
+            embedders=self.store.embedder_counts(),
+        )
+
+    def needs_compaction(self, health: TableHealth) -> bool:
+        return (
+            health.fragments > self.max_fragments
+            or health.deletedRatio > self.max_deleted_ratio
+        )
+
+    def run_once(self, force: bool = False) -> Optional[MaintenanceStats]:
+        """
+        Compacts and cleans up when a threshold is crossed (or when forced).
+        Returns the stats of the run, None if there was nothing to do.
+        """
+        if not self._run_lock.acquire(blocking=False):
+            logger.info("vector store maintenance already running, skipped")
+            return None
+        try:
+            before = self.inspect()
+            embedders = [name for name in before.embedders if name]
+            if len(embedders) > 1:
+                logger.warning(
+                    f"vector store mixes the vectors of {', '.join(embedders)}"
+                )
+            if not force and not self.needs_compaction(before):
+                logger.info(f"vector store maintenance not required: {before}")
+                return None
+
+            stats = MaintenanceStats(startedAt=time.time(), before=before)
+            start = time.perf_counter()
+            try:
+                with self.store.write_lock:
+                    metrics = (
+                        self.store.tbl.to_lance()
+                        .optimize.compact_files(
+                            materialize_deletions=True,
+                            materialize_deletions_threshold=self.max_deleted_ratio,
+                        )
+                    )
+                    self.store.tbl.checkout_latest()
+                stats.actions.append(
+                    f"compaction: {metrics.fragments_removed} fragments removed, "
+                    f"{metrics.fragments_added} added"
+                )
+                cleanup = self.store.tbl.cleanup_old_versions(
+                    older_than=self.keep_versions_for
+                )
+                stats.actions.append(
+                    f"cleanup: {cleanup.old_versions} old versions, "
+                    f"{cleanup.bytes_removed} bytes removed"
+                )
+                stats.after = self.inspect()
+            except Exception as e:
+                stats.error = str(e)
+                logger.error(f"vector store maintenance failed: {e}")
+            stats.seconds = round(time.perf_counter() - start, 3)
+            self.last_run = stats
+            logger.info(f"vector store maintenance: {stats.model_dump_json()}")
+            return stats
+        finally:
+            self._run_lock.release()
@@ -1,5 +1,5 @@
 import uuid
-from typing import Optional, Self
+from typing import List, Optional, Self
 
 from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.orm import relationship
@@ -40,14 +40,39 @@ def faces_db(db, dbModel):
             session = cls._session()
             return session.get(cls, id)
 
+        @classmethod
+        def find_many_with_person(cls, ids: List[str], chunk_size: int = 500):
+            """
+            The faces among ids as rows of (id, person id, person name), one
+            query joined to the person table per chunk_size ids.
+            """
+            session = cls._session()
+            Person = cls.person.property.mapper.class_
+            rows = []
+            for start in range(0, len(ids), chunk_size):
+                rows += (
+                    session.query(cls.id, Person.id, Person.name)
+                    .join(Person, Person.id == cls.person_id)
+                    .filter(cls.id.in_(ids[start : start + chunk_size]))
+                    .all()
+                )
+            return rows
+
         # --- Create ---
         @classmethod
-        def create(cls, person_id: int, path: str) -> Self:
+        def create(cls, person_id: int, path: str, commit: bool = True) -> Self:
+            """
+            With commit=False the face is only flushed, so that several
+            inserts can share one transaction; the caller commits.
+            """
             session = cls._session()
             face = cls(person_id=person_id, path=path, _allow_direct_init=True)
             try:
                 session.add(face)
-                session.commit()
+                if commit:
+                    session.commit()
+                else:
+                    session.flush()
             except SQLAlchemyError as e:
                 session.rollback()
                 raise ValueError(f"Failed to create face: {str(e)}")
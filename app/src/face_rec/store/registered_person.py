@@ -1,5 +1,6 @@
 from typing import List, Optional, Self
 
+from sqlalchemy import func
 from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.orm import Session, relationship
 
@@ -54,6 +55,63 @@ def person_db(db, dbModel):
                 query = query.filter_by(is_deleted=False)
             return query.all()
 
+        @classmethod
+        def find_page_with_faces(
+            cls, after_id: Optional[int] = None, limit: Optional[int] = None
+        ):
+            """
+            Persons that have at least one face, ordered by id, as rows of
+            (id, name, key_face_id, is_hidden, comma separated face ids) from a
+            single aggregated query. Keyset pagination: only ids > after_id.
+            """
+            session = cls._session()
+            Face = cls.faces.property.mapper.class_
+            query = (
+                session.query(
+                    cls.id,
+                    cls.name,
+                    cls.key_face_id,
+                    cls.is_hidden,
+                    func.group_concat(Face.id),
+                )
+                .join(Face, Face.person_id == cls.id)
+                .filter(cls.is_deleted == False)
+                .group_by(cls.id)
+                .order_by(cls.id)
+            )
+            if after_id is not None:
+                query = query.filter(cls.id > after_id)
+            if limit is not None:
+                query = query.limit(limit)
+            return query.all()
+
+        @classmethod
+        def find_many_with_faces(cls, ids: List[int], chunk_size: int = 500):
+            """
+            The persons among ids that aren't deleted, as rows of (id, name,
+            key_face_id, is_hidden, comma separated face ids or None), one
+            aggregated query per chunk_size ids.
+            """
+            session = cls._session()
+            Face = cls.faces.property.mapper.class_
+            rows = []
+            for start in range(0, len(ids), chunk_size):
+                rows += (
+                    session.query(
+                        cls.id,
+                        cls.name,
+                        cls.key_face_id,
+                        cls.is_hidden,
+                        func.group_concat(Face.id),
+                    )
+                    .outerjoin(Face, Face.person_id == cls.id)
+                    .filter(cls.id.in_(ids[start : start + chunk_size]))
+                    .filter(cls.is_deleted == False)
+                    .group_by(cls.id)
+                    .all()
+                )
+            return rows
+
         @classmethod
         def find_by_name(cls, name: str) -> Optional[Self]:
             session = cls._session()
@@ -72,7 +130,12 @@ def person_db(db, dbModel):
             name: Optional[str],
             is_hidden: bool = False,
             key_face_id: Optional[str] = None,
+            commit: bool = True,
         ) -> Self:
+            """
+            With commit=False the person is only flushed (to get its id), so
+            that several inserts can share one transaction; the caller commits.
+            """
             session = cls._session()
             person = cls(
                 _allow_direct_init=True,
@@ -82,7 +145,10 @@ def person_db(db, dbModel):
             )
             try:
                 session.add(person)
-                session.commit()
+                if commit:
+                    session.commit()
+                else:
+                    session.flush()
             except SQLAlchemyError as e:
                 session.rollback()
                 raise ValueError(f"Failed to create person: {str(e)}")
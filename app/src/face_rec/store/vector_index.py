@@ -0,0 +1,703 @@
+import os
+import tempfile
+import threading
+from itertools import chain
+from typing import Callable, Dict, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+import pyarrow as pa
+from loguru import logger
+
+# person_id of vectors that are not attached to a registered face
+NO_PERSON = -1
+
+# storage types of the resident matrix, see InMemoryVectorIndex
+VECTOR_DTYPES = {"float32": np.float32, "float16": np.float16, "int8": np.int8}
+# fewer vectors than this give a poor int8 calibration
+MIN_CALIBRATION_ROWS = 1000
+
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+class InMemoryVectorIndex:
+    """
+    Resident copy of the face vector table for exhaustive cosine search.
+
+    Embeddings are kept L2-normalized in one contiguous float32 matrix with
+    parallel id, person_id and hidden/deleted flag arrays, so a query is a
+    single matrix-vector product followed by argpartition. LanceDB remains
+    the durable store: the index is rebuilt from the table on startup and
+    kept in sync by FaceVectorStore.
+
+    A running sum of the face vectors of every person is maintained next to
+    the matrix, so person centroids are available for the two-stage person
+    search without another pass over the faces, and so are the rows of the
+    faces of every person, so that a person's faces are gathered without
+    scanning the person_id array.
+
+    With dtype "float16" or "int8" the matrix is stored compressed (1 KB or
+    512 B per face instead of 2 KB) and scanned in chunks converted to
+    float32. The best `rerank_factor * count` candidates are then rescored
+    exactly with their float32 vectors. With `exact_dir`, those are kept
+    in a memory-mapped file parallel to the matrix, so a re-rank reads the
+    pages of its candidates only and the OS may evict the rest; otherwise
+    they are returned by `fetch` (ids -> {id: vector}). The file is an
+    unnamed temporary file private to the index, so processes sharing the
+    directory never see each other's. int8 uses a per-dimension scale
+    calibrated from the stored vectors, on rebuild or once the index first
+    holds MIN_CALIBRATION_ROWS vectors.
+    """
+
+    def __init__(
+        self,
+        dim: int = 512,
+        initial_capacity: int = 1024,
+        dtype: str = "float32",
+        fetch: Optional[Callable[[List[str]], Dict[str, np.ndarray]]] = None,
+        rerank_factor: int = 4,
+        chunk_rows: int = 256,
+        exact_dir: Optional[str] = None,
+    ):
+        if dtype not in VECTOR_DTYPES:
+            raise ValueError(
+                f"unsupported dtype {dtype}, expected one of {list(VECTOR_DTYPES)}"
+            )
+        self.dim = dim
+        self.dtype = dtype
+        self.fetch = fetch
+        self.rerank_factor = rerank_factor
+        self.chunk_rows = chunk_rows
+        self._lock = threading.RLock()
+        # int8 only: value of one quantization step, per dimension
+        self._scale = np.full(dim, 4 / np.sqrt(dim) / 127, dtype=np.float32)
+        self._calibrated = False
+        self._vectors = np.empty((initial_capacity, dim), dtype=VECTOR_DTYPES[dtype])
+        # compressed only: normalized float32 rows, parallel to _vectors
+        self.exact_dir = exact_dir if self.compressed else None
+        self._exact = None
+        self._exact_file = None
+        if self.exact_dir:
+            self._exact_file = tempfile.TemporaryFile(
+                dir=self.exact_dir, suffix=".exact.f32"
+            )
+            self._exact = np.memmap(
+                self._exact_file,
+                dtype=np.float32,
+                mode="w+",
+                shape=(initial_capacity, dim),
+            )
+        self._ids = np.empty(initial_capacity, dtype=object)
+        self._person_ids = np.full(initial_capacity, NO_PERSON, dtype=np.int64)
+        self._hidden = np.zeros(initial_capacity, dtype=bool)
+        self._deleted = np.zeros(initial_capacity, dtype=bool)
+        self._rows = {}  # id -> row in self._vectors
+        self._size = 0
+        # person centroids: per person sum and count of its face vectors
+        self._person_rows = {}  # person_id -> row in self._person_sums
+        self._person_size = 0
+        self._person_keys = np.empty(0, dtype=np.int64)
+        self._person_sums = np.empty((0, dim), dtype=np.float32)
+        self._person_counts = np.empty(0, dtype=np.int64)
+        self._centroids = None  # normalized sums, cached until the next change
+        self._face_rows: Dict[int, Set[int]] = {}  # person_id -> its rows
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def compressed(self) -> bool:
+        return self.dtype != "float32"
+
+    def memory_bytes(self) -> int:
+        """Bytes held by the vector matrix, for the rows in use."""
+        return self._size * self.dim * self._vectors.itemsize
+
+    def calibrate(self, vectors: np.ndarray):
+        """
+        Sets the int8 scale from (normalized) sample vectors: the 99.9th
+        percentile of each dimension maps to 127, rarer outliers saturate.
+        Vectors already in the index are re-quantized with the new scale,
+        from their float32 copy when there is one.
+        """
+        if self.dtype != "int8" or len(vectors) < MIN_CALIBRATION_ROWS:
+            return
+        bound = np.percentile(np.abs(vectors), 99.9, axis=0)
+        with self._lock:
+            current = self._float_rows()
+            self._scale = (np.maximum(bound, 1e-6) / 127).astype(np.float32)
+            self._calibrated = True
+            if self._size:
+                self._vectors[: self._size] = self._encode(current)
+                self._retrack()
+
+    def _float_rows(self) -> np.ndarray:
+        """
+        The rows in use as normalized float32, read from the exact file if
+        any, decoded from the compressed matrix otherwise (int8 decoding
+        loses the values clipped by the scale and rounds once more).
+        """
+        if self._exact is not None:
+            return np.array(self._exact[: self._size])
+        return self._decode(self._vectors[: self._size])
+
+    def _encode(self, vectors: np.ndarray) -> np.ndarray:
+        if self.dtype == "int8":
+            return np.clip(np.rint(vectors / self._scale), -127, 127).astype(np.int8)
+        return vectors.astype(VECTOR_DTYPES[self.dtype])
+
+    def _decode(self, stored: np.ndarray) -> np.ndarray:
+        if self.dtype == "int8":
+            return stored.astype(np.float32) * self._scale
+        return stored.astype(np.float32, copy=False)
+
+    def _scan(self, queries: np.ndarray, size: int) -> np.ndarray:
+        """
+        Scores [Q, dim] normalized queries against the first `size` rows.
+        Compressed rows are converted to float32 one cache-sized chunk at a
+        time, so the scan never holds a float32 copy of the whole matrix.
+        """
+        if not self.compressed:
+            return queries @ self._vectors[:size].T
+        if self.dtype == "int8":
+            # fold the scale into the queries instead of every stored row
+            queries = queries * self._scale
+        scores = np.empty((len(queries), size), dtype=np.float32)
+        buffer = np.empty((self.chunk_rows, self.dim), dtype=np.float32)
+        for start in range(0, size, self.chunk_rows):
+            stop = min(start + self.chunk_rows, size)
+            chunk = buffer[: stop - start]
+            np.copyto(chunk, self._vectors[start:stop], casting="unsafe")
+            np.matmul(queries, chunk.T, out=scores[:, start:stop])
+        return scores
+
+    def _reserve(self, capacity: int):
+        if capacity <= len(self._ids):
+            return
+        new_capacity = max(capacity, 2 * len(self._ids))
+        size = self._size
+
+        def grow(array, fill):
+            grown = np.full((new_capacity,) + array.shape[1:], fill, dtype=array.dtype)
+            grown[:size] = array[:size]
+            return grown
+
+        self._vectors = grow(self._vectors, 0)
+        self._ids = grow(self._ids, None)
+        self._person_ids = grow(self._person_ids, NO_PERSON)
+        self._hidden = grow(self._hidden, False)
+        self._deleted = grow(self._deleted, False)
+        if self._exact is not None:
+            # the file grows in place, the rows written so far stay
+            self._exact.flush()
+            self._exact = None
+            os.ftruncate(self._exact_file.fileno(), new_capacity * self.dim * 4)
+            self._exact = np.memmap(
+                self._exact_file,
+                dtype=np.float32,
+                mode="r+",
+                shape=(new_capacity, self.dim),
+            )
+
+    def _reserve_persons(self, capacity: int):
+        if capacity <= len(self._person_keys):
+            return
+        new_capacity = max(capacity, 2 * len(self._person_keys), 64)
+        size = self._person_size
+
+        def grow(array):
+            grown = np.zeros((new_capacity,) + array.shape[1:], dtype=array.dtype)
+            grown[:size] = array[:size]
+            return grown
+
+        self._person_keys = grow(self._person_keys)
+        self._person_sums = grow(self._person_sums)
+        self._person_counts = grow(self._person_counts)
+
+    def rebuild(self, tbl):
+        """
+        Reload every row from the Lance table, replacing the current content.
+        """
+        arrow = tbl.to_arrow()
+        ids = arrow.column("id").to_pylist()
+        vectors = np.empty((0, self.dim), dtype=np.float32)
+        if ids:
+            column = arrow.column("vector")
+            if isinstance(column, pa.ChunkedArray):
+                column = column.combine_chunks()
+            vectors = column.flatten().to_numpy().reshape(-1, self.dim)
+
+        def optional_column(name):
+            if name in arrow.column_names:
+                return arrow.column(name).to_pylist()
+            return None
+
+        with self._lock:
+            self._size = 0
+            self._rows = {}
+            self._person_rows = {}
+            self._person_size = 0
+            self._person_keys = np.empty(0, dtype=np.int64)
+            self._person_sums = np.empty((0, self.dim), dtype=np.float32)
+            self._person_counts = np.empty(0, dtype=np.int64)
+            self._centroids = None
+            self._face_rows = {}
+            self.calibrate(normalize_rows(vectors))
+            self._reserve(len(ids))
+            self._add_rows(
+                ids,
+                vectors,
+                person_ids=optional_column("person_id"),
+                hidden=optional_column("is_hidden"),
+                deleted=optional_column("is_deleted"),
+            )
+        logger.info(f"in-memory vector index loaded with {self._size} vectors")
+
+    def _add_rows(
+        self,
+        ids: List[str],
+        vectors: np.ndarray,
+        person_ids: Optional[Sequence[int]] = None,
+        hidden: Optional[Sequence[bool]] = None,
+        deleted: Optional[Sequence[bool]] = None,
+    ):
+        normalized = normalize_rows(np.reshape(vectors, (-1, self.dim)))
+        vectors = self._encode(normalized)
+        for index, (id, vector) in enumerate(zip(ids, vectors)):
+            row = self._rows.get(id)
+            if row is None:
+                row = self._size
+                self._size += 1
+                self._rows[id] = row
+                self._ids[row] = id
+            else:
+                self._untrack(row)
+            self._vectors[row] = vector
+            if self._exact is not None:
+                self._exact[row] = normalized[index]
+            self._person_ids[row] = (
+                person_ids[index] if person_ids is not None else NO_PERSON
+            )
+            self._track(row)
+            self._hidden[row] = bool(hidden[index]) if hidden is not None else False
+            self._deleted[row] = bool(deleted[index]) if deleted is not None else False
+
+    def add(
+        self,
+        id: str,
+        vector: np.ndarray,
+        person_id: int = NO_PERSON,
+        is_hidden: bool = False,
+        is_deleted: bool = False,
+    ):
+        self.add_many(
+            [id],
+            np.reshape(vector, (1, self.dim)),
+            person_ids=[person_id],
+            hidden=[is_hidden],
+            deleted=[is_deleted],
+        )
+
+    def add_many(
+        self,
+        ids: List[str],
+        vectors: np.ndarray,
+        person_ids: Optional[Sequence[int]] = None,
+        hidden: Optional[Sequence[bool]] = None,
+        deleted: Optional[Sequence[bool]] = None,
+    ):
+        with self._lock:
+            self._reserve(self._size + len(ids))
+            self._add_rows(ids, vectors, person_ids, hidden, deleted)
+            if (
+                self.dtype == "int8"
+                and not self._calibrated
+                and self._size >= MIN_CALIBRATION_ROWS
+            ):
+                self.calibrate(self._float_rows())
+
+    def remove(self, id: str) -> bool:
+        with self._lock:
+            row = self._rows.pop(id, None)
+            if row is None:
+                return False
+            self._untrack(row)
+            last = self._size - 1
+            if row != last:
+                # keep the matrix dense by moving the last row into the hole
+                moved_id = self._ids[last]
+                moved_rows = self._face_rows.get(int(self._person_ids[last]))
+                if moved_rows is not None:
+                    moved_rows.discard(last)
+                    moved_rows.add(row)
+                self._vectors[row] = self._vectors[last]
+                if self._exact is not None:
+                    self._exact[row] = self._exact[last]
+                self._ids[row] = moved_id
+                self._person_ids[row] = self._person_ids[last]
+                self._hidden[row] = self._hidden[last]
+                self._deleted[row] = self._deleted[last]
+                self._rows[moved_id] = row
+            self._ids[last] = None
+            self._size = last
+            return True
+
+    def _rows_of(self, person_id: int) -> np.ndarray:
+        return np.sort(np.fromiter(self._face_rows.get(person_id, ()), dtype=np.int64))
+
+    def face_ids_of(self, person_id: int) -> List[str]:
+        with self._lock:
+            return list(self._ids[self._rows_of(person_id)])
+
+    def update_person(
+        self,
+        person_id: int,
+        is_hidden: Optional[bool] = None,
+        is_deleted: Optional[bool] = None,
+    ):
+        with self._lock:
+            rows = self._rows_of(person_id)
+            if is_hidden is not None:
+                self._hidden[rows] = is_hidden
+            if is_deleted is not None:
+                self._deleted[rows] = is_deleted
+
+    def reassign(
+        self, ids: List[str], person_id: int, is_hidden: bool, is_deleted: bool
+    ):
+        with self._lock:
+            rows = [self._rows[id] for id in ids if id in self._rows]
+            for row in rows:
+                self._untrack(row)
+            self._person_ids[rows] = person_id
+            self._hidden[rows] = is_hidden
+            self._deleted[rows] = is_deleted
+            for row in rows:
+                self._track(row)
+
+    def _retrack(self):
+        """Recomputes every person centroid from the stored vectors."""
+        self._person_sums[:] = 0
+        self._person_counts[:] = 0
+        self._face_rows = {}
+        for row in range(self._size):
+            self._track(row)
+
+    def _track(self, row: int):
+        """Adds the vector at row to the centroid and the rows of its person."""
+        person_id = int(self._person_ids[row])
+        if person_id == NO_PERSON:
+            return
+        person_row = self._person_rows.get(person_id)
+        if person_row is None:
+            person_row = self._person_size
+            self._reserve_persons(person_row + 1)
+            self._person_size += 1
+            self._person_rows[person_id] = person_row
+            self._person_keys[person_row] = person_id
+        self._face_rows.setdefault(person_id, set()).add(row)
+        self._person_sums[person_row] += self._decode(self._vectors[row])
+        self._person_counts[person_row] += 1
+        self._centroids = None
+
+    def _untrack(self, row: int):
+        """Removes the vector at row from the centroid and the rows of its person."""
+        person_id = int(self._person_ids[row])
+        person_row = self._person_rows.get(person_id)
+        if person_row is None:
+            return
+        self._face_rows[person_id].discard(row)
+        self._person_sums[person_row] -= self._decode(self._vectors[row])
+        self._person_counts[person_row] -= 1
+        if self._person_counts[person_row] == 0:
+            # drop accumulated float error with the last face
+            self._person_sums[person_row] = 0
+        self._centroids = None
+
+    def _valid_rows(self, size: int, include_hidden: bool) -> Optional[np.ndarray]:
+        excluded = self._deleted[:size]
+        if not include_hidden:
+            excluded = excluded | self._hidden[:size]
+        if not excluded.any():
+            return None
+        return ~excluded
+
+    def search(
+        self, vector: np.ndarray, count: int = 1, include_hidden: bool = True
+    ) -> List[Tuple[str, float, int]]:
+        """
+        Returns up to `count` (id, cosine similarity, person_id), best first.
+        Vectors of deleted persons are never returned.
+        """
+        query = np.reshape(vector, (1, self.dim))
+        return self.search_many(query, count=count, include_hidden=include_hidden)[0]
+
+    def search_many(
+        self, vectors: np.ndarray, count: int = 1, include_hidden: bool = True
+    ) -> List[List[Tuple[str, float, int]]]:
+        """
+        Scores all query vectors in one matrix product. Returns, per query,
+        up to `count` (id, cosine similarity, person_id), best first.
+        """
+        queries = normalize_rows(np.reshape(vectors, (-1, self.dim)))
+        if len(queries) == 0:
+            return []
+        rerank = self.compressed and (self._exact is not None or self.fetch is not None)
+        candidates = count * self.rerank_factor if rerank else count
+        hits = self._search_many(queries, candidates, include_hidden)
+        if rerank:
+            hits = self._rerank(queries, hits, count)
+        return hits
+
+    def _search_many(
+        self, queries: np.ndarray, count: int, include_hidden: bool
+    ) -> List[List[Tuple[str, float, int]]]:
+        with self._lock:
+            size = self._size
+            if size == 0 or count < 1:
+                return [[] for _ in range(len(queries))]
+            scores = self._scan(queries, size)
+            valid = self._valid_rows(size, include_hidden)
+            available = size
+            if valid is not None:
+                scores[:, ~valid] = -np.inf
+                available = int(valid.sum())
+            k = min(count, available)
+            if k == 0:
+                return [[] for _ in range(len(queries))]
+            if k < size:
+                top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            else:
+                top = np.broadcast_to(np.arange(size), scores.shape)
+            top_scores = np.take_along_axis(scores, top, axis=1)
+            order = np.argsort(-top_scores, axis=1, kind="stable")
+            top = np.take_along_axis(top, order, axis=1)
+            top_scores = np.take_along_axis(top_scores, order, axis=1)
+            ids = self._ids[top]
+            person_ids = self._person_ids[top]
+        return [
+            [
+                (id, float(score), int(person_id))
+                for id, score, person_id in zip(row_ids, row_scores, row_persons)
+            ]
+            for row_ids, row_scores, row_persons in zip(ids, top_scores, person_ids)
+        ]
+
+    def _rerank(
+        self,
+        queries: np.ndarray,
+        hits: List[List[Tuple[str, float, int]]],
+        count: int,
+    ) -> List[List[Tuple[str, float, int]]]:
+        """
+        Rescores the candidates of each query with their exact float32
+        vectors. Candidates removed meanwhile (or that `fetch` no longer
+        knows) keep their approximate score.
+        """
+        ids = list({id for query_hits in hits for id, _, _ in query_hits})
+        if not ids:
+            return hits
+        exact = {}
+        if self._exact is not None:
+            with self._lock:
+                rows = {id: self._rows[id] for id in ids if id in self._rows}
+                exact = dict(zip(rows, self._exact[list(rows.values())]))
+        else:
+            try:
+                fetched = self.fetch(ids)
+                if fetched:
+                    vectors = normalize_rows(np.stack(list(fetched.values())))
+                    exact = dict(zip(fetched.keys(), vectors))
+            except Exception as e:
+                logger.warning(f"exact re-ranking skipped: {e}")
+        reranked = []
+        for query, query_hits in zip(queries, hits):
+            rescored = [
+                (id, float(exact[id] @ query) if id in exact else score, person_id)
+                for id, score, person_id in query_hits
+            ]
+            rescored.sort(key=lambda hit: hit[1], reverse=True)
+            reranked.append(rescored[:count])
+        return reranked
+
+    def search_persons(
+        self,
+        vector: np.ndarray,
+        count: int = 1,
+        candidates: int = 8,
+        top_faces: int = 3,
+        include_hidden: bool = True,
+    ) -> List[Tuple[int, float, str, float]]:
+        """
+        Two-stage person search, see search_persons_many.
+        """
+        query = np.reshape(vector, (1, self.dim))
+        return self.search_persons_many(
+            query,
+            count=count,
+            candidates=candidates,
+            top_faces=top_faces,
+            include_hidden=include_hidden,
+        )[0]
+
+    def search_persons_many(
+        self,
+        vectors: np.ndarray,
+        count: int = 1,
+        candidates: int = 8,
+        top_faces: int = 3,
+        include_hidden: bool = True,
+    ) -> List[List[Tuple[int, float, str, float]]]:
+        """
+        Ranks persons by the cosine similarity of their centroid, then
+        rescores only the faces of the `candidates` best persons. A person's
+        confidence is the mean of its `top_faces` best face scores, which
+        doesn't swing with whichever single face happens to match best.
+
+        Returns, per query, up to `count`
+        (person_id, confidence, best face id, best face score), best first.
+        """
+        queries = normalize_rows(np.reshape(vectors, (-1, self.dim)))
+        if len(queries) == 0:
+            return []
+        with self._lock:
+            size = self._size
+            persons_size = self._person_size
+            if self._centroids is None:
+                self._centroids = normalize_rows(self._person_sums[:persons_size])
+            centroids = self._centroids
+            available = self._person_counts[:persons_size] > 0
+            valid = self._valid_rows(size, include_hidden)
+            if valid is not None:
+                # a person is searchable if any of its faces is
+                valid_persons = np.unique(self._person_ids[:size][valid])
+                available &= np.isin(self._person_keys[:persons_size], valid_persons)
+            k = min(max(candidates, count), int(available.sum()))
+            if k == 0 or count < 1:
+                return [[] for _ in range(len(queries))]
+
+            # stage 1: persons by centroid
+            centroid_scores = queries @ centroids.T
+            centroid_scores[:, ~available] = -np.inf
+            top = np.argpartition(-centroid_scores, k - 1, axis=1)[:, :k]
+
+            results = []
+            for query, person_rows in zip(queries, top):
+                # stage 2: the faces of the candidate persons only, gathered
+                # from their row lists
+                persons = self._person_keys[person_rows]
+                face_rows = [self._face_rows.get(int(p), ()) for p in persons]
+                lengths = [len(r) for r in face_rows]
+                rows = np.fromiter(
+                    chain.from_iterable(face_rows), dtype=np.int64, count=sum(lengths)
+                )
+                owners = np.repeat(persons, lengths)
+                if valid is not None:
+                    keep = valid[rows]
+                    rows, owners = rows[keep], owners[keep]
+                scores = self._decode(self._vectors[rows]) @ query
+
+                ranked = []
+                for person_id in persons:
+                    person_scores = scores[owners == person_id]
+                    if len(person_scores) == 0:
+                        continue
+                    m = min(top_faces, len(person_scores))
+                    best = np.argpartition(-person_scores, m - 1)[:m]
+                    best_face = best[np.argmax(person_scores[best])]
+                    ranked.append(
+                        (
+                            int(person_id),
+                            float(person_scores[best].mean()),
+                            self._ids[rows[owners == person_id][best_face]],
+                            float(person_scores[best_face]),
+                        )
+                    )
+                ranked.sort(key=lambda hit: hit[1], reverse=True)
+                results.append(ranked[:count])
+        return results
+
+
+if __name__ == "__main__":
+    # Benchmark of the compressed storage types against the float32 baseline
+    # on synthetic clustered embeddings in a Lance table. Re-ranking reads
+    # the exact vectors through the store's fetch_vectors (a filtered Lance
+    # scan) or from the memory-mapped file FaceVectorStore sets up:
+    #   python -m src.face_rec.store.vector_index [faces] [queries]
+    import sys
+    import tempfile
+    import time
+
+    import lancedb
+
+    from .face_vector_store import FaceVectorStore
+
+    num_faces = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    num_queries = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    count = 10
+    dim = 512
+
+    rng = np.random.default_rng(0)
+    persons = normalize_rows(rng.normal(size=(num_faces // 20, dim)))
+    owners = rng.integers(0, len(persons), size=num_faces)
+    vectors = normalize_rows(
+        persons[owners] + 0.7 * normalize_rows(rng.normal(size=(num_faces, dim)))
+    )
+    ids = [str(i) for i in range(num_faces)]
+    queries = normalize_rows(
+        persons[owners[:num_queries]]
+        + 0.7 * normalize_rows(rng.normal(size=(num_queries, dim)))
+    )
+
+    directory = tempfile.mkdtemp(prefix="vector_index_benchmark-")
+    store = FaceVectorStore(lancedb.connect(directory), "face")
+    for start in range(0, num_faces, 10_000):
+        store.add_many(
+            ids[start : start + 10_000],
+            vectors[start : start + 10_000],
+            person_ids=owners[start : start + 10_000].tolist(),
+        )
+
+    def run(index):
+        latencies, found = [], []
+        for query in queries:
+            start = time.perf_counter()
+            hits = index.search(query, count=count)
+            latencies.append((time.perf_counter() - start) * 1000)
+            found.append({id for id, _, _ in hits})
+        return found, latencies
+
+    baseline = None
+    print(f"{num_faces} faces, {num_queries} queries, recall@{count}")
+    for dtype, rerank in [
+        ("float32", None),
+        ("float16", None),
+        ("float16", "lance"),
+        ("float16", "file"),
+        ("int8", None),
+        ("int8", "lance"),
+        ("int8", "file"),
+    ]:
+        index = InMemoryVectorIndex(
+            dim=dim,
+            dtype=dtype,
+            fetch=store.fetch_vectors if rerank == "lance" else None,
+            exact_path=f"{directory}/exact.f32" if rerank == "file" else None,
+        )
+        index.rebuild(store.tbl)
+        found, latencies = run(index)
+        if baseline is None:
+            baseline = found
+        recall = np.mean(
+            [len(a & b) / len(b) for a, b in zip(found, baseline) if len(b)]
+        )
+        print(
+            f"{dtype:>8}{f' + rerank ({rerank})' if rerank else '':17}: "
+            f"{index.memory_bytes() / 2**20:8.1f} MB, "
+            f"mean {np.mean(latencies):7.2f} ms, "
+            f"p95 {np.percentile(latencies, 95):7.2f} ms, "
+            f"recall {recall:.4f}"
+        )
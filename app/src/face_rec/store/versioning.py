@@ -1,45 +1,166 @@
-from flask import Flask
-from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import event, insert, select, update
+from typing import ClassVar, Dict, List, Optional, Tuple
+
+from sqlalchemy import delete, event, insert, select, update
 
 """
 Raise alarm if the version goes beyond 2 * 10^9
 int holds upto 2,147,483,647
 """
 
+# store_version rows
+VERSION_ROW = 0
+# oldest version from which the change log is complete (see compact_changes)
+LOG_FLOOR_ROW = 1
+
 
 def store_version_db(db, dbModel, models):
+    class StoreChangeInDB(dbModel):
+        """
+        One row per record written at a version: the change log behind
+        TableVersion.changes_since. Only ids are kept, what happened to the
+        record (changed or deleted) is read from its table when queried.
+        """
+
+        __tablename__ = "store_changes"
+        id = db.Column(db.Integer, primary_key=True)
+        version = db.Column(db.Integer, nullable=False, index=True)
+        entity = db.Column(db.String(16), nullable=False)  # table name
+        record_id = db.Column(db.String(36), nullable=False)
+
     class TableVersion(dbModel):
         __tablename__ = "store_version"
         id = db.Column(db.Integer, primary_key=True, default=1)
         version = db.Column(db.Integer, nullable=False, default=0)
 
-        @classmethod
-        def get_version(cls) -> int:
-            row = cls.query.get(0)
-            return row.version if row else 0
+        Change: ClassVar = StoreChangeInDB
+        # Versions of log kept by compact_changes
+        KEEP_VERSIONS: ClassVar[int] = 10_000
+
+        # Last version get_version saw; when the store moved on, another
+        # process sharing it (web workers) may have written
+        _seen_version: ClassVar[Optional[int]] = None
 
         @classmethod
-        def _increment_version(cls, mapper, connection, target):
+        def _read(cls, row: int, connection=None) -> Optional[int]:
             table = cls.__table__
-            current = connection.execute(
-                select(table.c.version).where(table.c.id == 0)
-            ).scalar()
+            statement = select(table.c.version).where(table.c.id == row)
+            return (connection or db.session).execute(statement).scalar()
 
-            if current is not None:
-                connection.execute(
-                    update(table).where(table.c.id == 0).values(version=current + 1)
+        @classmethod
+        def _write(cls, row: int, version: int, connection=None):
+            table = cls.__table__
+            executor = connection or db.session
+            if cls._read(row, connection) is not None:
+                executor.execute(
+                    update(table).where(table.c.id == row).values(version=version)
                 )
             else:
-                connection.execute(insert(table).values(id=0, version=1))
+                executor.execute(insert(table).values(id=row, version=version))
+
+        @classmethod
+        def get_version(cls) -> int:
+            """
+            The last committed version, read from SQLite on every call (one
+            row) outside the shared session, so that the writes of every
+            process are seen. When it moved, the objects the session loaded
+            before are expired, they may predate another process's write.
+            """
+            with db.engine.connect() as connection:
+                version = cls._read(VERSION_ROW, connection) or 0
+            if cls._seen_version is not None and version != cls._seen_version:
+                session = db.session
+                # unflushed changes of a write in progress would be lost
+                if not (session.new or session.dirty or session.deleted):
+                    session.expire_all()
+            cls._seen_version = version
+            return version
+
+        @classmethod
+        def _increment_version(cls, mapper, connection, target):
+            version = (cls._read(VERSION_ROW, connection) or 0) + 1
+            cls._write(VERSION_ROW, version, connection)
+
+            changes = [(mapper.local_table.name, str(target.id))]
+            person_id = getattr(target, "person_id", None)
+            if person_id is not None:
+                # the face list of the owning person changed as well
+                changes.append(("person", str(person_id)))
+            connection.execute(
+                insert(StoreChangeInDB.__table__),
+                [
+                    {"version": version, "entity": entity, "record_id": record_id}
+                    for entity, record_id in changes
+                ],
+            )
+
+        @classmethod
+        def changes_since(
+            cls, since: int, max_changes: int = 5000
+        ) -> Tuple[int, Optional[Dict[str, List[str]]]]:
+            """
+            Returns the current version and the ids changed after `since`,
+            per table, or None when the log can't answer: `since` is older
+            than the compacted log, newer than the store, or more than
+            `max_changes` records changed.
+            """
+            version = cls.get_version()
+            floor = cls._read(LOG_FLOOR_ROW) or 0
+            if since < floor or since > version:
+                return version, None
+            rows = (
+                db.session.query(StoreChangeInDB.entity, StoreChangeInDB.record_id)
+                .filter(StoreChangeInDB.version > since)
+                .filter(StoreChangeInDB.version <= version)
+                .distinct()
+                .limit(max_changes + 1)
+                .all()
+            )
+            if len(rows) > max_changes:
+                return version, None
+            changes: Dict[str, List[str]] = {}
+            for entity, record_id in rows:
+                changes.setdefault(entity, []).append(record_id)
+            return version, changes
+
+        @classmethod
+        def compact_changes(cls, keep_versions: Optional[int] = None) -> int:
+            """
+            Drops log entries more than `keep_versions` behind the current
+            version; clients older than that have to resync fully.
+            Returns the number of entries removed. Runs in a transaction of
+            its own, never committing the shared session (and the write
+            another thread may have in progress there); called by the store
+            maintenance, not by requests.
+            """
+            keep_versions = keep_versions or cls.KEEP_VERSIONS
+            table = StoreChangeInDB.__table__
+            with db.engine.begin() as connection:
+                cutoff = (cls._read(VERSION_ROW, connection) or 0) - keep_versions
+                floor = cls._read(LOG_FLOOR_ROW, connection) or 0
+                # let a tenth of the window accumulate instead of running per
+                # write
+                if cutoff - floor < max(1, keep_versions // 10):
+                    return 0
+                removed = connection.execute(
+                    delete(table).where(table.c.version <= cutoff)
+                ).rowcount
+                cls._write(LOG_FLOOR_ROW, cutoff, connection)
+            return removed
 
         @classmethod
         def track_table(cls):
             """
-            Call this to automatically track a table's inserts and updates.
+            Call this to automatically track a table's inserts, updates and
+            deletes.
             """
+            if db.session.query(StoreChangeInDB.id).first() is None:
+                # the log starts now, older versions were never recorded
+                # (new log table, or the store was rebuilt)
+                cls._write(LOG_FLOOR_ROW, cls.get_version())
+                db.session.commit()
             for model in models:
                 event.listen(model, "after_insert", cls._increment_version)
                 event.listen(model, "after_update", cls._increment_version)
+                event.listen(model, "after_delete", cls._increment_version)
 
     return TableVersion
@@ -2,6 +2,30 @@ import json
 
 import numpy as np
 
+# uint8 -> float32 dequantization tables per (scale, zero point), one per
+# output tensor of the model
+_DEQUANTIZATION_TABLES = {}
+# Above this many values numpy's vectorized arithmetic beats the table
+# lookup (take converts the uint8 indices first)
+_TABLE_MAX_SIZE = 1024
+
+
+def dequantize(tensor, quantization):
+    """
+    (tensor - zero) * scale as float32. Small uint8 tensors (the 512 value
+    embedding) go through a 256 entry table, which skips the per-call
+    convert/subtract/multiply temporaries.
+    """
+    scale, zero = quantization[0], quantization[1]
+    if tensor.dtype != np.uint8 or tensor.size > _TABLE_MAX_SIZE:
+        return (tensor.astype(np.float32) - zero) * scale
+    key = (float(scale), float(zero))
+    table = _DEQUANTIZATION_TABLES.get(key)
+    if table is None:
+        table = (np.arange(256, dtype=np.float32) - zero) * scale
+        _DEQUANTIZATION_TABLES[key] = table
+    return np.take(table, tensor)
+
 
 # Post-processor class, must have fixed name 'PostProcessor'
 class PostProcessor:
@@ -12,6 +36,21 @@ class PostProcessor:
         Parameters:
             json_config (str): JSON string containing post-processing configuration.
         """
+        config = json.loads(json_config) if json_config else {}
+        post_process_config = config.get("POST_PROCESS", [{}])[0]
+        # "data" as the float32 ndarray itself instead of a list, for runtimes
+        # that hand the returned objects to the caller without serializing
+        # them; the consumer's np.asarray then doesn't copy
+        self.output_arrays = post_process_config.get("OutputArrays", False)
+
+    def forward_arrays(self, tensor_list, details_list):
+        """
+        Dequantized tensors, each flattened to a float32 array of shape (1, x).
+        """
+        return [
+            dequantize(data, tensor_info["quantization"]).reshape(1, -1)
+            for data, tensor_info in zip(tensor_list, details_list)
+        ]
 
     def forward(self, tensor_list, details_list):
         """
@@ -26,16 +65,9 @@ class PostProcessor:
         """
 
         ret = []
-        for data, tensor_info in zip(tensor_list, details_list):
-            # Dequantize the tensor
-            quantization = tensor_info["quantization"]
-            dequantized_data = (
-                data.astype(np.float32) - quantization[1]
-            ) * quantization[0]
-
-            # Reshape to (1, x)
-            reshaped_data = dequantized_data.flatten().reshape(1, -1)
-
+        for reshaped_data, tensor_info in zip(
+            self.forward_arrays(tensor_list, details_list), details_list
+        ):
             tensor = dict(
                 id=tensor_info["index"],
                 name=tensor_info["name"],
@@ -43,8 +75,67 @@ class PostProcessor:
                 quantization=dict(axis=-1, scale=[1], zero=[0]),
                 type="DG_FLT",
                 size=reshaped_data.size,
-                data=reshaped_data.tolist(),
+                data=reshaped_data if self.output_arrays else reshaped_data.tolist(),
             )
             ret.append(tensor)
 
         return ret
+
+
+if __name__ == "__main__":
+    # Per-face cost of the embedding output, from the uint8 tensor to the
+    # float32 vector the recognizer uses:
+    #   python HailoDequantize.py [--faces 10000]
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--faces", type=int, default=10000)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    tensor = rng.integers(0, 256, size=(1, 1, 1, 512), dtype=np.uint8)
+    details = [{"index": 0, "name": "fc1", "quantization": [0.0123, 131]}]
+
+    def original():
+        # the previous forward and EmbeddingModel.extract_face_embedding
+        quantization = details[0]["quantization"]
+        data = (tensor.astype(np.float32) - quantization[1]) * quantization[0]
+        data = data.flatten().reshape(1, -1).tolist()
+        return np.array(data[0], dtype=np.float32)
+
+    def without_table(fn):
+        # the same call with every tensor above the table size
+        def call():
+            global _TABLE_MAX_SIZE
+            table_max_size, _TABLE_MAX_SIZE = _TABLE_MAX_SIZE, 0
+            try:
+                return fn()
+            finally:
+                _TABLE_MAX_SIZE = table_max_size
+
+        return call
+
+    def extract(output_arrays):
+        processor = PostProcessor(
+            json.dumps({"POST_PROCESS": [{"OutputArrays": output_arrays}]})
+        )
+        return lambda: np.asarray(
+            processor.forward([tensor], details)[0]["data"][0], dtype=np.float32
+        )
+
+    reference = original()
+    for label, fn in [
+        ("arithmetic + lists", original),
+        ("table + lists", extract(False)),
+        ("arithmetic + ndarray", without_table(extract(True))),
+        ("table + ndarray", extract(True)),
+    ]:
+        start = time.perf_counter()
+        for _ in range(args.faces):
+            vector = fn()
+        elapsed = (time.perf_counter() - start) / args.faces * 1e6
+        print(
+            f"{label:>20}: {elapsed:7.2f} us/face, "
+            f"same vector: {np.array_equal(vector, reference)}"
+        )
@@ -1,7 +1,127 @@
+import hashlib
 import json
+import os
+import time
 
 import numpy as np
 
+# Priors per (input size, steps, min sizes), shared by every PostProcessor
+# instance of the process
+_PRIORS_MEMO = {}
+
+# When set, every frame's output tensors are saved there for the benchmark
+_RECORD_DIR = os.environ.get("RETINAFACE_RECORD_DIR")
+
+# uint8 -> float32 dequantization tables per (scale, zero point), one per
+# output tensor of the model
+_DEQUANTIZATION_TABLES = {}
+# Above this many values numpy's vectorized arithmetic beats the table
+# lookup (take converts the uint8 indices first)
+_TABLE_MAX_SIZE = 1024
+
+
+def dequantize(tensor, quantization):
+    """
+    (tensor - zero) * scale as float32. Small uint8 tensors (the survivors of
+    the score-first path) go through a 256 entry table, which skips the
+    per-call convert/subtract/multiply temporaries.
+    """
+    scale, zero = quantization
+    if tensor.dtype != np.uint8 or tensor.size > _TABLE_MAX_SIZE:
+        return (tensor.astype(np.float32) - zero) * scale
+    key = (float(scale), float(zero))
+    table = _DEQUANTIZATION_TABLES.get(key)
+    if table is None:
+        table = (np.arange(256, dtype=np.float32) - zero) * scale
+        _DEQUANTIZATION_TABLES[key] = table
+    return np.take(table, tensor)
+
+
+def record_tensors(directory, tensor_list, details_list):
+    """
+    Saves the output tensors of one frame and their quantization parameters
+    as an .npz file, see load_recorded_tensors.
+    """
+    os.makedirs(directory, exist_ok=True)
+    arrays = {f"tensor_{i}": tensor for i, tensor in enumerate(tensor_list)}
+    arrays["quantization"] = np.array(
+        [detail["quantization"] for detail in details_list], dtype=np.float64
+    )
+    path = os.path.join(directory, f"frame_{time.time_ns()}.npz")
+    np.savez(path, **arrays)
+
+
+def load_recorded_tensors(path):
+    """
+    Returns (tensor_list, details_list) of a frame saved by record_tensors.
+    """
+    with np.load(path) as data:
+        quantization = data["quantization"]
+        tensor_list = [data[f"tensor_{i}"] for i in range(len(quantization))]
+    details_list = [{"quantization": (scale, zero)} for scale, zero in quantization]
+    return tensor_list, details_list
+
+
+def generate_priors(input_size, steps, min_sizes_per_step):
+    """
+    Prior boxes (anchors) for all feature maps as [num_priors, 4] float32
+    (cx, cy, s_kx, s_ky), ordered by feature map, row, column and min size.
+    """
+    input_h, input_w = input_size
+    anchors = []
+    for step, min_sizes in zip(steps, min_sizes_per_step):
+        f_height, f_width = input_h // step, input_w // step
+        sizes = np.asarray(min_sizes, dtype=np.float64)
+        grid = np.empty((f_height, f_width, len(sizes), 4), dtype=np.float64)
+        grid[..., 0] = ((np.arange(f_width) + 0.5) * step / input_w)[None, :, None]
+        grid[..., 1] = ((np.arange(f_height) + 0.5) * step / input_h)[:, None, None]
+        grid[..., 2] = sizes / input_w
+        grid[..., 3] = sizes / input_h
+        anchors.append(grid.reshape(-1, 4))
+    return np.concatenate(anchors).astype(np.float32)
+
+
+def load_priors(input_size, steps, min_sizes_per_step, cache_dir=None):
+    """
+    Memoized generate_priors. With cache_dir, the priors are also kept in a
+    .npy file there, so that a new process loads them instead of computing.
+    """
+    key = (
+        tuple(input_size),
+        tuple(steps),
+        tuple(tuple(min_sizes) for min_sizes in min_sizes_per_step),
+    )
+    priors = _PRIORS_MEMO.get(key)
+    if priors is not None:
+        return priors
+
+    cache_file = None
+    if cache_dir is not None:
+        digest = hashlib.sha1(repr(key).encode()).hexdigest()[:12]
+        cache_file = os.path.join(
+            cache_dir, f"priors_{input_size[0]}x{input_size[1]}_{digest}.npy"
+        )
+        try:
+            priors = np.load(cache_file)
+        except (OSError, ValueError):
+            priors = None
+
+    if priors is None:
+        priors = generate_priors(input_size, steps, min_sizes_per_step)
+        if cache_file is not None:
+            try:
+                # write then rename, a concurrent reader never sees half a file
+                tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+                with open(tmp_file, "wb") as f:
+                    np.save(f, priors)
+                os.replace(tmp_file, cache_file)
+            except OSError:
+                pass  # read-only model directory, keep the in-memory copy
+
+    priors.setflags(write=False)
+    _PRIORS_MEMO[key] = priors
+    return priors
+
 
 class PostProcessor:
 
@@ -38,37 +158,19 @@ class PostProcessor:
             )
         return anchor_info
 
-    def _generate_priors(self):
+    def _generate_priors(self, cache_dir=None):
         """
         Generate prior boxes (anchors) for all feature maps.
 
         Returns:
             np.ndarray: Array of priors with shape (num_priors, 4).
         """
-        feature_maps = [
-            [self.input_size[0] // step, self.input_size[1] // step]
-            for step in self.cfg["steps"]
-        ]
-        anchors = []
-
-        for k in range(len(feature_maps)):
-            f_height, f_width = feature_maps[k]
-            step = self.cfg["steps"][k]
-            min_sizes = self.cfg["min_sizes"][k]
-
-            for i in range(f_height):  # Loop over feature map rows
-                for j in range(f_width):  # Loop over feature map columns
-                    for min_size in min_sizes:  # Loop over anchor sizes
-                        # Calculate center coordinates and box scales
-                        cx = (j + 0.5) * step / self.input_size[1]
-                        cy = (i + 0.5) * step / self.input_size[0]
-                        s_kx = min_size / self.input_size[1]
-                        s_ky = min_size / self.input_size[0]
-
-                        anchors.append([cx, cy, s_kx, s_ky])
-
-        priors = np.array(anchors, dtype=np.float32)
-        return priors
+        return load_priors(
+            self.input_size,
+            self.cfg["steps"],
+            self.cfg["min_sizes"],
+            cache_dir=cache_dir,
+        )
 
     def __init__(self, json_config):
         """
@@ -95,6 +197,21 @@ class PostProcessor:
         # Thresholds
         self.confidence_threshold = post_process_config.get("OutputConfThreshold", 0.5)
         self.nms_threshold = post_process_config.get("OutputNMSThreshold", 0.4)
+        # NMS only considers the best PreNMSTopK boxes and keeps at most
+        # MaxDetections of them
+        self.pre_nms_topk = post_process_config.get("PreNMSTopK", 1000)
+        self.max_detections = post_process_config.get("MaxDetections", 100)
+
+        # Two-class softmax: p(face) > t  <=>  logit(face) - logit(bg) > log(t / (1 - t)),
+        # so the threshold can be applied before anything is decoded
+        self.score_first = post_process_config.get("ScoreFirst", True) and (
+            0 < self.confidence_threshold < 1
+        )
+        self.logit_cutoff = (
+            float(np.log(self.confidence_threshold / (1 - self.confidence_threshold)))
+            if self.score_first
+            else None
+        )
 
         # Load label dictionary
         label_path = post_process_config.get("LabelsPath", None)
@@ -103,8 +220,12 @@ class PostProcessor:
         with open(label_path, "r") as json_file:
             self._label_dictionary = json.load(json_file)
 
-        # Generate priors and anchor info
-        self.priors = self._generate_priors()
+        # Generate priors and anchor info; cached next to the labels file,
+        # which sits next to the model JSON, unless "PriorsCache" is false
+        cache_dir = None
+        if post_process_config.get("PriorsCache", True):
+            cache_dir = os.path.dirname(os.path.abspath(label_path))
+        self.priors = self._generate_priors(cache_dir=cache_dir)
         self.anchor_info = self._generate_anchor_info()
 
     def _dequantize(self, tensor_list, details):
@@ -121,8 +242,7 @@ class PostProcessor:
         loc_list, conf_list, landms_list = [], [], []
 
         for tensor, detail, anchor_meta in zip(tensor_list, details, self.anchor_info):
-            scale, zero = detail["quantization"]
-            dequantized = (tensor.astype(np.float32) - zero) * scale
+            dequantized = dequantize(tensor, detail["quantization"])
             expected_last_dim = anchor_meta["last_dim"]
             output_type = anchor_meta["type"]
 
@@ -172,39 +292,41 @@ class PostProcessor:
         exp_logits = np.exp(logits - np.max(logits, axis=1, keepdims=True))
         return exp_logits / np.sum(exp_logits, axis=1, keepdims=True)
 
-    def nms(self, boxes, scores, threshold):
-        x1, y1, x2, y2 = boxes[:, 0], boxes[:, 1], boxes[:, 2], boxes[:, 3]
+    def nms(self, boxes, scores, threshold, max_detections=None):
+        """
+        Greedy NMS over the `pre_nms_topk` best boxes, stopping once
+        `max_detections` are kept, so the work is bounded by
+        max_detections x pre_nms_topk IoUs however crowded the frame is.
+        Returns the indices of the kept boxes, best first.
+        """
+        order = np.argsort(-scores, kind="stable")[: self.pre_nms_topk]
+        if max_detections is None:
+            max_detections = len(order)
+        x1, y1, x2, y2 = boxes[order].T
         areas = (x2 - x1) * (y2 - y1)
-        order = scores.argsort()[::-1]
 
         keep = []
-        while order.size > 0:
-            i = order[0]
-            keep.append(i)
-            xx1 = np.maximum(x1[i], x1[order[1:]])
-            yy1 = np.maximum(y1[i], y1[order[1:]])
-            xx2 = np.minimum(x2[i], x2[order[1:]])
-            yy2 = np.minimum(y2[i], y2[order[1:]])
-
-            w = np.maximum(0.0, xx2 - xx1)
-            h = np.maximum(0.0, yy2 - yy1)
+        alive = np.ones(len(order), dtype=bool)
+        i = 0
+        while i < len(order) and len(keep) < max_detections:
+            keep.append(order[i])
+            w = np.maximum(0.0, np.minimum(x2[i], x2) - np.maximum(x1[i], x1))
+            h = np.maximum(0.0, np.minimum(y2[i], y2) - np.maximum(y1[i], y1))
             inter = w * h
-            iou = inter / (areas[i] + areas[order[1:]] - inter)
-
-            inds = np.where(iou <= threshold)[0]
-            order = order[inds + 1]
-        return keep
-
-    def forward(self, tensor_list, details_list):
+            with np.errstate(divide="ignore", invalid="ignore"):
+                # NaN (degenerate boxes) counts as overlapping, as before
+                alive &= inter / (areas[i] + areas - inter) <= threshold
+            alive[: i + 1] = False
+            remaining = np.flatnonzero(alive)
+            if not len(remaining):
+                break
+            i = remaining[0]
+        return np.asarray(keep, dtype=np.int64)
+
+    def _decode_all(self, tensor_list, details_list):
         """
-        Process RetinaFace model outputs and return detections.
-        Args:
-            tensor_list (list): List of 9 uint8 output tensors.
-            details (list): List of dictionaries containing quantization info.
-        Returns:
-            boxes (np.ndarray): Final bounding boxes of shape (N, 4).
-            scores (np.ndarray): Final confidence scores of shape (N,).
-            landmarks (np.ndarray): Final landmarks of shape (N, 10).
+        Dequantizes and decodes every anchor, then thresholds the scores.
+        Returns boxes (N, 4), scores (N,) and landmarks (N, 10) in pixels.
         """
         # Dequantize and split outputs
         loc, conf, landms = self._dequantize(tensor_list, details_list)
@@ -225,45 +347,323 @@ class PostProcessor:
 
         # Filter low-confidence detections
         inds = np.where(scores > self.confidence_threshold)[0]
-        boxes = boxes[inds]
-        landmarks = landmarks[inds]
-        scores = scores[inds]
+        return boxes[inds], scores[inds], landmarks[inds]
+
+    def _decode_survivors(self, tensor_list, details_list):
+        """
+        Score-first variant of _decode_all: the confidence threshold is
+        applied to the quantized logit difference of each anchor, and only
+        the anchors above it are dequantized and decoded.
+        """
+        variances = self.cfg["variance"]
+        outputs = {}
+        for index, (tensor, detail, anchor_meta) in enumerate(
+            zip(tensor_list, details_list, self.anchor_info)
+        ):
+            if tensor.shape[-1] != anchor_meta["last_dim"]:
+                raise ValueError(
+                    f"Unexpected last dimension: {tensor.shape[-1]}. Expected {anchor_meta['last_dim']}."
+                )
+            outputs[(index // 3, anchor_meta["type"])] = (
+                tensor,
+                detail["quantization"],
+            )
+
+        loc_list, landms_list, scores_list, prior_list = [], [], [], []
+        offset = 0
+        for level in range(len(self.anchor_info) // 3):
+            conf, (scale, zero) = outputs[(level, "conf")]
+            conf = conf.reshape(-1, 2)
+            # same scale and zero point for both logits, they cancel out:
+            # margin * scale > cutoff  <=>  margin > floor(cutoff / scale)
+            margin = conf[:, 1].astype(np.int32) - conf[:, 0].astype(np.int32)
+            inds = np.nonzero(margin > np.floor(self.logit_cutoff / scale))[0]
+            if len(inds):
+                loc, loc_quantization = outputs[(level, "bbox")]
+                landms, landms_quantization = outputs[(level, "landmark")]
+                loc_list.append(dequantize(loc.reshape(-1, 4)[inds], loc_quantization))
+                landms_list.append(
+                    dequantize(landms.reshape(-1, 10)[inds], landms_quantization)
+                )
+                scores_list.append(1 / (1 + np.exp(-(margin[inds] * scale))))
+                prior_list.append(offset + inds)
+            offset += len(conf)
+
+        if not loc_list:
+            return (
+                np.empty((0, 4), dtype=np.float32),
+                np.empty(0, dtype=np.float32),
+                np.empty((0, 10), dtype=np.float32),
+            )
+        priors = self.priors[np.concatenate(prior_list)]
+        boxes = self.decode(np.concatenate(loc_list), priors, variances)
+        boxes[:, ::2] *= self.input_size[1]  # Scale to image width
+        boxes[:, 1::2] *= self.input_size[0]  # Scale to image height
+
+        landmarks = self.decode_landmarks(
+            np.concatenate(landms_list), priors, variances
+        )
+        landmarks[:, ::2] *= self.input_size[1]  # Scale to image width
+        landmarks[:, 1::2] *= self.input_size[0]  # Scale to image height
+
+        scores = np.concatenate(scores_list).astype(np.float32)
+        return boxes, scores, landmarks
+
+    def forward_arrays(self, tensor_list, details_list):
+        """
+        Process RetinaFace model outputs into arrays, for in-process callers.
+        Args:
+            tensor_list (list): List of 9 uint8 output tensors.
+            details (list): List of dictionaries containing quantization info.
+        Returns:
+            boxes (np.ndarray): Final bounding boxes of shape (N, 4).
+            scores (np.ndarray): Final confidence scores of shape (N,).
+            landmarks (np.ndarray): Final landmarks of shape (N, 5, 2).
+        """
+        if _RECORD_DIR:
+            record_tensors(_RECORD_DIR, tensor_list, details_list)
+        if self.score_first:
+            boxes, scores, landmarks = self._decode_survivors(tensor_list, details_list)
+        else:
+            boxes, scores, landmarks = self._decode_all(tensor_list, details_list)
 
         # Apply NMS
-        keep = self.nms(boxes, scores, self.nms_threshold)
-        boxes = boxes[keep]
-        scores = scores[keep]
-        landmarks = landmarks[keep]
+        keep = self.nms(boxes, scores, self.nms_threshold, self.max_detections)
+        return boxes[keep], scores[keep], landmarks[keep].reshape(-1, 5, 2)
+
+    def forward(self, tensor_list, details_list):
+        """
+        Process RetinaFace model outputs and return detections.
+        Args:
+            tensor_list (list): List of 9 uint8 output tensors.
+            details (list): List of dictionaries containing quantization info.
+        Returns:
+            list: One dict per detection with "bbox", "score" and five
+            "landmarks", the format DeGirum maps back to the original image.
+        """
+        boxes, scores, landmarks = self.forward_arrays(tensor_list, details_list)
 
+        category_id = 1  # Assuming single class for SCRFD
+        label = self._label_dictionary.get(str(category_id), f"class_{category_id}")
         new_inference_results = []
         # Prepare results for this batch
-        for i in range(len(boxes)):
-            category_id = 1  # Assuming single class for SCRFD
-            label = self._label_dictionary.get(str(category_id), f"class_{category_id}")
-            result = {
-                "bbox": boxes[i].tolist(),  # Keep bbox as a list, not flattened
-                "category_id": category_id,
-                "label": label,
-                "score": float(scores[i]),
-                "landmarks": [],
-            }
-
-            # Add landmarks in the desired format
-            if landmarks is not None:
-                for landmark_idx in range(0, len(landmarks[i]), 2):
-                    landmark_entry = {
-                        "category_id": landmark_idx // 2,
-                        "connect": [],
-                        "landmark": [
-                            float(landmarks[i][landmark_idx]),
-                            float(landmarks[i][landmark_idx + 1]),
-                        ],
-                        "score": float(
-                            scores[i]
-                        ),  # Optionally assign the detection score
-                    }
-                    result["landmarks"].append(landmark_entry)
-
-            new_inference_results.append(result)
+        for bbox, score, points in zip(
+            boxes.tolist(), scores.tolist(), landmarks.tolist()
+        ):
+            new_inference_results.append(
+                {
+                    "bbox": bbox,
+                    "category_id": category_id,
+                    "label": label,
+                    "score": score,
+                    "landmarks": [
+                        {
+                            "category_id": landmark_idx,
+                            "connect": [],
+                            "landmark": point,
+                            "score": score,  # Optionally assign the detection score
+                        }
+                        for landmark_idx, point in enumerate(points)
+                    ],
+                }
+            )
 
         return new_inference_results
+
+
+if __name__ == "__main__":
+    # Startup benchmark of the prior generation and per-frame benchmark of
+    # forward, on frames saved with RETINAFACE_RECORD_DIR or synthetic ones:
+    #   python HailoDetectionRetinafaceMobilenet.py [--model model.json] [frame.npz ...]
+    import argparse
+    import tempfile
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--model",
+        default=os.path.join(
+            os.path.dirname(os.path.abspath(__file__)),
+            "retinaface_mobilenet--736x1280_quant_hailort_hailo8_1.json",
+        ),
+    )
+    parser.add_argument("frames", nargs="*", help="frames saved by record_tensors")
+    args = parser.parse_args()
+    model_json = args.model
+    with open(model_json) as f:
+        config = json.load(f)
+    anchor_config = config["POST_PROCESS"][0]["AnchorConfig"]
+    input_size = (
+        config["PRE_PROCESS"][0]["InputH"],
+        config["PRE_PROCESS"][0]["InputW"],
+    )
+    steps, min_sizes_per_step = anchor_config["Steps"], anchor_config["MinSizes"]
+
+    def loop_priors():
+        # the original nested loop, as the reference
+        anchors = []
+        for step, min_sizes in zip(steps, min_sizes_per_step):
+            for i in range(input_size[0] // step):
+                for j in range(input_size[1] // step):
+                    for min_size in min_sizes:
+                        anchors.append(
+                            [
+                                (j + 0.5) * step / input_size[1],
+                                (i + 0.5) * step / input_size[0],
+                                min_size / input_size[1],
+                                min_size / input_size[0],
+                            ]
+                        )
+        return np.array(anchors, dtype=np.float32)
+
+    def timed(label, fn):
+        start = time.perf_counter()
+        result = fn()
+        print(f"{label:>22}: {(time.perf_counter() - start) * 1000:8.2f} ms")
+        return result
+
+    reference = timed("python loop", loop_priors)
+    vectorized = timed(
+        "vectorized", lambda: generate_priors(input_size, steps, min_sizes_per_step)
+    )
+    with tempfile.TemporaryDirectory() as cache_dir:
+        timed(
+            "cold, writes cache",
+            lambda: load_priors(input_size, steps, min_sizes_per_step, cache_dir),
+        )
+        timed(
+            "memoized",
+            lambda: load_priors(input_size, steps, min_sizes_per_step, cache_dir),
+        )
+        _PRIORS_MEMO.clear()
+        cached = timed(
+            "new process, file",
+            lambda: load_priors(input_size, steps, min_sizes_per_step, cache_dir),
+        )
+    print(
+        f"{len(reference)} priors, identical: {np.array_equal(reference, vectorized) and np.array_equal(reference, cached)}"
+    )
+
+    # forward on recorded (or synthetic) frames, full decode vs score-first
+    config["POST_PROCESS"][0]["LabelsPath"] = os.path.join(
+        os.path.dirname(os.path.abspath(model_json)),
+        config["POST_PROCESS"][0]["LabelsPath"],
+    )
+    config["POST_PROCESS"][0]["PriorsCache"] = False
+    processor = PostProcessor(json.dumps(config))
+
+    def synthetic_frame(rng, faces=5):
+        tensor_list, details_list = [], []
+        for meta, step in zip(
+            processor.anchor_info, np.repeat(processor.cfg["steps"], 3)
+        ):
+            shape = (
+                1,
+                input_size[0] // step,
+                input_size[1] // step,
+                meta["last_dim"],
+            )
+            tensor = rng.integers(100, 156, size=shape, dtype=np.uint8)
+            if meta["type"] == "conf":
+                # background: bg logit well above face logit
+                tensor[..., 0::2] = rng.integers(180, 230, size=tensor[..., 0::2].shape)
+                tensor[..., 1::2] = rng.integers(20, 70, size=tensor[..., 1::2].shape)
+                flat = tensor.reshape(-1, 2)
+                hits = rng.choice(len(flat), size=faces, replace=False)
+                flat[hits] = [60, 200]
+            tensor_list.append(tensor)
+            details_list.append({"quantization": (0.05, 128)})
+        return tensor_list, details_list
+
+    if args.frames:
+        frames = [load_recorded_tensors(path) for path in args.frames]
+    else:
+        rng = np.random.default_rng(0)
+        frames = [synthetic_frame(rng) for _ in range(20)]
+
+    def per_frame(decode):
+        latencies = []
+        for tensor_list, details_list in frames:
+            start = time.perf_counter()
+            decode(tensor_list, details_list)
+            latencies.append((time.perf_counter() - start) * 1000)
+        return latencies
+
+    for label, decode in [
+        ("full decode", processor._decode_all),
+        ("score-first", processor._decode_survivors),
+        ("forward", processor.forward),
+    ]:
+        latencies = per_frame(decode)
+        print(
+            f"{label:>22}: mean {np.mean(latencies):7.2f} ms, "
+            f"p95 {np.percentile(latencies, 95):7.2f} ms ({len(frames)} frames)"
+        )
+
+    # dequantization, arithmetic vs table, at survivor and full-tensor sizes
+    for size in [40, 512, _TABLE_MAX_SIZE, 4 * _TABLE_MAX_SIZE, 160 * _TABLE_MAX_SIZE]:
+        tensor = np.random.default_rng(2).integers(0, 256, size, dtype=np.uint8)
+        table = (np.arange(256, dtype=np.float32) - 128) * 0.05
+        for label, dequant in [
+            ("arithmetic", lambda: (tensor.astype(np.float32) - 128) * 0.05),
+            ("table", lambda: np.take(table, tensor)),
+        ]:
+            repeat = max(1, 100_000 // size)
+            start = time.perf_counter()
+            for _ in range(repeat):
+                dequant()
+            elapsed = (time.perf_counter() - start) / repeat * 1e6
+            print(f"{f'{label}, {size}':>22}: {elapsed:8.2f} us")
+
+    same = True
+    for tensor_list, details_list in frames:
+        full = processor._decode_all(tensor_list, details_list)
+        fast = processor._decode_survivors(tensor_list, details_list)
+        # same detections, compared in box order (scores can tie)
+        order_full = np.lexsort(full[0].T[::-1])
+        order_fast = np.lexsort(fast[0].T[::-1])
+        same &= len(full[1]) == len(fast[1]) and all(
+            np.allclose(a[order_full], b[order_fast], atol=1e-3)
+            for a, b in zip(full, fast)
+        )
+    print(f"score-first matches full decode: {same}")
+
+    # NMS on crowded frames: the original loop vs the bounded one
+    def loop_nms(boxes, scores, threshold):
+        x1, y1, x2, y2 = boxes[:, 0], boxes[:, 1], boxes[:, 2], boxes[:, 3]
+        areas = (x2 - x1) * (y2 - y1)
+        order = scores.argsort()[::-1]
+        keep = []
+        while order.size > 0:
+            i = order[0]
+            keep.append(i)
+            xx1 = np.maximum(x1[i], x1[order[1:]])
+            yy1 = np.maximum(y1[i], y1[order[1:]])
+            xx2 = np.minimum(x2[i], x2[order[1:]])
+            yy2 = np.minimum(y2[i], y2[order[1:]])
+            inter = np.maximum(0.0, xx2 - xx1) * np.maximum(0.0, yy2 - yy1)
+            iou = inter / (areas[i] + areas[order[1:]] - inter)
+            order = order[np.where(iou <= threshold)[0] + 1]
+        return keep
+
+    rng = np.random.default_rng(1)
+    for count in [100, 1000, 20000]:
+        corners = rng.uniform(0, [input_size[1], input_size[0]], size=(count, 2))
+        sizes = rng.uniform(10, 200, size=(count, 2))
+        boxes = np.hstack([corners, corners + sizes]).astype(np.float32)
+        scores = rng.permutation(count).astype(np.float32) / count
+        reference = timed(
+            f"loop nms, {count}",
+            lambda: loop_nms(boxes, scores, processor.nms_threshold),
+        )
+        bounded = timed(
+            f"bounded nms, {count}",
+            lambda: processor.nms(
+                boxes, scores, processor.nms_threshold, processor.max_detections
+            ),
+        )
+        if count <= processor.pre_nms_topk:
+            # same boxes up to the cap
+            print(
+                f"{'matches loop':>22}: "
+                f"{list(bounded) == reference[: processor.max_detections]}"
+            )
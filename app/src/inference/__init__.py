@@ -0,0 +1,15 @@
+from .client import (
+    InferenceClient,
+    InferenceUnavailable,
+    RemoteDetectionModel,
+    RemoteEmbeddingModel,
+    connect,
+)
+from .service import DEFAULT_ADDRESS, InferenceService, create_maintenance_from_config
+from .router import (
+    BackendRouter,
+    BackendStats,
+    RouterStats,
+    create_router,
+    create_router_from_config,
+)
@@ -0,0 +1,44 @@
+import argparse
+
+from ..common import ConfigClass
+from ..face_rec import load
+from .router import create_router_from_config
+from .service import DEFAULT_ADDRESS, InferenceService, create_maintenance_from_config
+
+# Owns the accelerator for the web workers, which connect to it with
+# INFERENCE_SERVICE_ADDRESS set to the same address, and maintains the face
+# store they share. The backends are set by INFERENCE_BACKEND and
+# INFERENCE_FALLBACK_BACKEND:
+#   python -m src.inference [--address ipc:///tmp/ai_sessions-inference.sock]
+parser = argparse.ArgumentParser(description="Inference service")
+parser.add_argument("--address", default=DEFAULT_ADDRESS)
+parser.add_argument(
+    "--workers",
+    type=int,
+    default=None,
+    help="Requests run at the same time (default: 2 with a fallback backend, else 1)",
+)
+parser.add_argument(
+    "--max-pending",
+    type=int,
+    default=ConfigClass.INFERENCE_MAX_PENDING,
+    help="Requests held before the next ones are answered busy",
+)
+args = parser.parse_args()
+router = create_router_from_config()
+workers = args.workers or (2 if router.fallback else 1)
+store = load(
+    ConfigClass.UPLOAD_STORAGE_LOCATION,
+    preserve_past=True,
+    detector=router.detector,
+    embedding_model=router.embedding_model,
+    shared=True,
+)
+create_maintenance_from_config(store).start()
+InferenceService(
+    args.address,
+    router=router,
+    workers=workers,
+    max_pending=args.max_pending,
+    timeout=ConfigClass.INFERENCE_TIMEOUT,
+).serve()
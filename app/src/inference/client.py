@@ -0,0 +1,173 @@
+import threading
+import time
+from typing import Iterable, Iterator, List, Tuple
+
+import numpy as np
+import zmq
+from loguru import logger
+
+from ..face_rec.proc.face_detection import FaceDetections
+from . import transport
+
+
+class InferenceUnavailable(Exception):
+    """The inference service didn't answer in time or failed the request."""
+
+
+class InferenceClient:
+    """
+    Connection of a web worker to the InferenceService. Thread safe: the
+    calls of a process share one socket, one request at a time (the service
+    runs one at a time anyway). A request without a reply within timeout
+    seconds, waiting for the socket included, raises InferenceUnavailable,
+    and the socket is replaced so that the next call starts clean. Requests
+    carry that deadline, the service doesn't run them past it.
+    """
+
+    def __init__(self, address: str, timeout: float = 30.0):
+        self.address = address
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._socket = None
+
+    def _connect(self):
+        socket = zmq.Context.instance().socket(zmq.REQ)
+        socket.setsockopt(zmq.LINGER, 0)
+        socket.connect(self.address)
+        return socket
+
+    def call(self, header: dict, arrays: List[np.ndarray]) -> Tuple[dict, List]:
+        deadline = time.time() + self.timeout
+        request = transport.pack({**header, "deadline": deadline}, arrays)
+        with self._lock:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                transport.discard(request)
+                raise InferenceUnavailable(
+                    f"inference request waited {self.timeout}s for the connection"
+                )
+            if self._socket is None:
+                self._socket = self._connect()
+            try:
+                self._socket.send_multipart(request, copy=False)
+                if not self._socket.poll(timeout=int(remaining * 1000)):
+                    self._socket.close()
+                    self._socket = None
+                    # the service may still read it, the file goes with the
+                    # last mapping
+                    transport.discard(request)
+                    raise InferenceUnavailable(
+                        f"no reply from the inference service at {self.address} "
+                        f"within {self.timeout}s"
+                    )
+                reply = self._socket.recv_multipart(copy=False)
+            except zmq.ZMQError as e:
+                self._socket.close()
+                self._socket = None
+                transport.discard(request)
+                raise InferenceUnavailable(str(e)) from e
+        header, arrays = transport.unpack(reply)
+        if not header.get("ok"):
+            raise InferenceUnavailable(header.get("error", "inference failed"))
+        return header, arrays
+
+    def stats(self) -> dict:
+        header, _ = self.call({"op": "stats"}, [])
+        header.pop("ok", None)
+        return header
+
+    def close(self):
+        with self._lock:
+            if self._socket is not None:
+                self._socket.close()
+                self._socket = None
+
+
+class RemoteDetectionModel:
+    """DetectionModel's interface, run by the inference service."""
+
+    def __init__(self, client: InferenceClient):
+        self.client = client
+
+    def detect(self, path) -> FaceDetections:
+        return self.detect_batch([path])[0]
+
+    def detect_batch(self, path: List) -> List[FaceDetections]:
+        frames = list(path)
+        if not frames:
+            return []
+        _, arrays = self.client.call(
+            {
+                "op": "detect",
+                "paths": [
+                    str(frame) if not isinstance(frame, np.ndarray) else None
+                    for frame in frames
+                ],
+            },
+            [frame for frame in frames if isinstance(frame, np.ndarray)],
+        )
+        arrays = iter(arrays)
+        return [
+            FaceDetections(
+                boxes=next(arrays),
+                scores=next(arrays),
+                landmarks=next(arrays),
+                # arrays aren't sent back
+                image=frame if isinstance(frame, np.ndarray) else next(arrays),
+            )
+            for frame in frames
+        ]
+
+    def detect_stream(
+        self, frames: Iterable, batch_size: int = 8
+    ) -> Iterator[FaceDetections]:
+        """
+        Like DetectionModel.detect_stream, in requests of batch_size frames.
+        """
+        batch = []
+        for frame in frames:
+            batch.append(frame)
+            if len(batch) >= batch_size:
+                yield from self.detect_batch(batch)
+                batch = []
+        if batch:
+            yield from self.detect_batch(batch)
+
+
+class RemoteEmbeddingModel:
+    """EmbeddingModel's interface, run by the inference service."""
+
+    def __init__(self, client: InferenceClient):
+        self.client = client
+        # the service's embedding model, known from its first reply
+        self.name = ""
+
+    def extract_face_embedding(self, image) -> np.ndarray:
+        return self.extract_face_embeddings([image])[0]
+
+    def extract_face_embeddings(self, images: List[np.ndarray]) -> List[np.ndarray]:
+        if not len(images):
+            return []
+        header, arrays = self.client.call({"op": "embed"}, [np.stack(images)])
+        self.name = header.get("embedder", "")
+        return list(arrays[0])
+
+    def embed_stream(
+        self, images: Iterable[np.ndarray], batch_size: int = 32
+    ) -> Iterator[np.ndarray]:
+        """Lazy variant of extract_face_embeddings, batch_size crops a request."""
+        batch = []
+        for image in images:
+            batch.append(image)
+            if len(batch) >= batch_size:
+                yield from self.extract_face_embeddings(batch)
+                batch = []
+        if batch:
+            yield from self.extract_face_embeddings(batch)
+
+
+def connect(address: str, timeout: float = 30.0):
+    """The (detector, embedding_model) pair of the service at address."""
+    client = InferenceClient(address, timeout=timeout)
+    logger.info(f"models are served by the inference service at {address}")
+    return RemoteDetectionModel(client), RemoteEmbeddingModel(client)
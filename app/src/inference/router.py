@@ -0,0 +1,456 @@
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+
+import numpy as np
+from loguru import logger
+from pydantic import BaseModel
+
+from ..common import ConfigClass
+from ..face_rec.proc.backends import ModelBackend, create_backend
+from ..face_rec.proc.face_detection import FaceDetections
+
+
+class BackendStats(BaseModel):
+    name: str
+    inFlight: int = 0
+    calls: int = 0
+    images: int = 0
+    failed: int = 0
+    # over the last `history` calls of each model, in seconds
+    meanDetectLatency: float = 0.0
+    p95DetectLatency: float = 0.0
+    meanEmbedLatency: float = 0.0
+    p95EmbedLatency: float = 0.0
+    detectSecondsPerImage: float = 0.0
+    embedSecondsPerImage: float = 0.0
+
+
+class RouterStats(BaseModel):
+    primary: str
+    fallback: Optional[str] = None
+    spillQueue: int = 0
+    routed: Dict[str, int] = {}
+    # calls sent to the fallback because the primary's queue was long, and
+    # calls kept on the primary although it was, as the fallback was slower
+    spilled: int = 0
+    kept: int = 0
+    backends: List[BackendStats] = []
+
+
+class _Lane:
+    """Accounting of one backend, and the lock its calls hold."""
+
+    def __init__(self, backend: ModelBackend, history: int):
+        self.backend = backend
+        # the models of a backend take one call at a time
+        self.device = threading.Lock()
+        # calls routed to the backend, running or waiting for device
+        self.in_flight = 0
+        self.calls = 0
+        self.images = 0
+        self.failed = 0
+        # (seconds, images) per call, per model
+        self.durations = {
+            "detect": deque(maxlen=history),
+            "embed": deque(maxlen=history),
+        }
+        # the same while holding device: the service time, without waiting
+        # for the other calls
+        self.service = {
+            "detect": deque(maxlen=history),
+            "embed": deque(maxlen=history),
+        }
+
+    def seconds_per_image(self, kind: str) -> Optional[float]:
+        durations = self.service[kind] or self.durations[kind]
+        images = sum(count for _, count in durations)
+        if not images:
+            return None
+        return sum(seconds for seconds, _ in durations) / images
+
+    def stats(self) -> BackendStats:
+        def latency(kind, fraction=None):
+            seconds = sorted(seconds for seconds, _ in self.durations[kind])
+            if not seconds:
+                return 0.0
+            if fraction is None:
+                return round(sum(seconds) / len(seconds), 4)
+            return round(seconds[int(fraction * (len(seconds) - 1))], 4)
+
+        return BackendStats(
+            name=self.backend.name,
+            inFlight=self.in_flight,
+            calls=self.calls,
+            images=self.images,
+            failed=self.failed,
+            meanDetectLatency=latency("detect"),
+            p95DetectLatency=latency("detect", 0.95),
+            meanEmbedLatency=latency("embed"),
+            p95EmbedLatency=latency("embed", 0.95),
+            detectSecondsPerImage=round(self.seconds_per_image("detect") or 0.0, 4),
+            embedSecondsPerImage=round(self.seconds_per_image("embed") or 0.0, 4),
+        )
+
+
+class BackendRouter:
+    """
+    Sends every model call to the primary backend (the accelerator). A
+    detection call goes elsewhere only if the primary is busy (a call holds
+    or waits for its lock) and its queue is spill_queue calls or longer: the
+    calls in flight on it plus backlog(), the requests waiting upstream
+    (queued in the scheduler or the service). The call then goes to the
+    fallback (the CPU) if that is idle and gets it done before the primary
+    would get through the queue and the call: seconds per image on the
+    fallback vs (queue + 1) x seconds per image on the primary, from the
+    service times measured so far. An untried fallback is tried. So the fallback adds capacity under
+    load, one call at a time, and is left alone otherwise. Each backend runs
+    one call at a time: calls routed to a busy backend wait for its lock, as
+    its models mustn't be called from two threads at once.
+
+    detector and embedding_model have the interfaces of the models, so the
+    recognizer uses the router like a single backend. Embedding calls never
+    spill: the fallback's embedding model has other weights than the
+    accelerator's, and its vectors, in the same store, wouldn't match them.
+    Detections only give boxes and landmarks, whichever model found them.
+    The router only sees concurrent calls; the scheduler and the inference
+    service need more than one worker for it to spill.
+    """
+
+    # the calls that may go to the fallback
+    SPILLED = ("detect",)
+
+    def __init__(
+        self,
+        primary: ModelBackend,
+        fallback: Optional[ModelBackend] = None,
+        spill_queue: int = 2,
+        history: int = 200,
+        backlog: Optional[Callable[[], int]] = None,
+    ):
+        self.primary = primary
+        self.fallback = fallback
+        self.spill_queue = spill_queue
+        self.backlog = backlog
+        self._primary = _Lane(primary, history)
+        self._fallback = _Lane(fallback, history) if fallback else None
+        self._lock = threading.Lock()
+        self._spilled = 0
+        self._kept = 0
+        self.detector = RoutedDetectionModel(self)
+        self.embedding_model = RoutedEmbeddingModel(self)
+
+    def _acquire(self, kind: str, images: int) -> _Lane:
+        with self._lock:
+            lane = self._primary
+            fallback = self._fallback
+            queue = lane.in_flight + (self.backlog() if self.backlog else 0)
+            # the primary's lock is taken: a call holds it or waits for it
+            # (a waiter may not have woken up to take it yet)
+            if (
+                fallback
+                and kind in self.SPILLED
+                and lane.in_flight
+                and queue >= self.spill_queue
+                and not fallback.in_flight
+            ):
+                primary_rate = lane.seconds_per_image(kind)
+                fallback_rate = fallback.seconds_per_image(kind)
+                if fallback_rate is None or (
+                    primary_rate is not None
+                    and fallback_rate < (queue + 1) * primary_rate
+                ):
+                    self._spilled += 1
+                    lane = fallback
+                    logger.info(
+                        f"router: {kind} of {images} images spilled to "
+                        f"{fallback.backend.name}, {queue} calls queued for "
+                        f"{self._primary.backend.name}"
+                    )
+                else:
+                    self._kept += 1
+            lane.in_flight += 1
+            return lane
+
+    def _release(
+        self,
+        lane: _Lane,
+        kind: str,
+        images: int,
+        seconds: float,
+        service_seconds: Optional[float],
+        ok: bool,
+    ):
+        with self._lock:
+            lane.in_flight -= 1
+            lane.calls += 1
+            lane.images += images
+            if not ok:
+                lane.failed += 1
+                return
+            lane.durations[kind].append((seconds, images))
+            lane.service[kind].append((service_seconds, images))
+
+    def run(self, kind: str, images: int, call):
+        """call(backend) on the backend chosen for images images."""
+        lane = self._acquire(kind, images)
+        start = time.perf_counter()
+        service_start = None
+        ok = False
+        try:
+            with lane.device:
+                service_start = time.perf_counter()
+                result = call(lane.backend)
+                ok = True
+            return result
+        finally:
+            end = time.perf_counter()
+            self._release(
+                lane,
+                kind,
+                images,
+                end - start,
+                end - service_start if service_start else None,
+                ok,
+            )
+
+    def stream(self, kind: str, items: Iterable, call) -> Iterator:
+        """
+        call(backend, items) of a lazy model stream; the whole stream runs on
+        one backend, holding its lock, and counts as one call in flight.
+        """
+        lane = self._acquire(kind, 1)
+        start = time.perf_counter()
+        service_start = None
+        count = 0
+        ok = False
+        try:
+            with lane.device:
+                service_start = time.perf_counter()
+                for output in call(lane.backend, items):
+                    count += 1
+                    yield output
+                ok = True
+        finally:
+            end = time.perf_counter()
+            self._release(
+                lane,
+                kind,
+                count,
+                end - start,
+                end - service_start if service_start else None,
+                ok,
+            )
+
+    def warm_up(self) -> float:
+        """
+        Warms up every backend, the fallback too so that the first spilled
+        call doesn't load its models. The calls go to the backends directly
+        and stay out of the latency statistics.
+        """
+        start = time.perf_counter()
+        for lane in [self._primary] + ([self._fallback] if self._fallback else []):
+            with lane.device:
+                seconds = lane.backend.warm_up()
+            logger.info(f"warmed up the {lane.backend.name} backend in {seconds:.2f}s")
+        return time.perf_counter() - start
+
+    def stats(self) -> RouterStats:
+        lanes = [self._primary] + ([self._fallback] if self._fallback else [])
+        with self._lock:
+            return RouterStats(
+                primary=self._primary.backend.name,
+                fallback=self._fallback.backend.name if self._fallback else None,
+                spillQueue=self.spill_queue,
+                routed={lane.backend.name: lane.calls for lane in lanes},
+                spilled=self._spilled,
+                kept=self._kept,
+                backends=[lane.stats() for lane in lanes],
+            )
+
+
+class RoutedDetectionModel:
+    """DetectionModel's interface, on the backend the router picks."""
+
+    def __init__(self, router: BackendRouter):
+        self.router = router
+
+    def detect(self, path) -> FaceDetections:
+        return self.router.run(
+            "detect", 1, lambda backend: backend.detector.detect(path)
+        )
+
+    def detect_batch(self, path: List) -> List[FaceDetections]:
+        return self.router.run(
+            "detect", len(path), lambda backend: backend.detector.detect_batch(path)
+        )
+
+    def detect_stream(self, frames: Iterable) -> Iterator[FaceDetections]:
+        return self.router.stream(
+            "detect",
+            frames,
+            lambda backend, items: backend.detector.detect_stream(items),
+        )
+
+
+class RoutedEmbeddingModel:
+    """EmbeddingModel's interface, always on the primary backend."""
+
+    def __init__(self, router: BackendRouter):
+        self.router = router
+
+    @property
+    def name(self) -> str:
+        return self.router.primary.embedding_model.name
+
+    def extract_face_embedding(self, image) -> np.ndarray:
+        return self.router.run(
+            "embed",
+            1,
+            lambda backend: backend.embedding_model.extract_face_embedding(image),
+        )
+
+    def extract_face_embeddings(self, images: List[np.ndarray]) -> List[np.ndarray]:
+        if not len(images):
+            return []
+        return self.router.run(
+            "embed",
+            len(images),
+            lambda backend: backend.embedding_model.extract_face_embeddings(images),
+        )
+
+    def embed_stream(self, images: Iterable[np.ndarray]) -> Iterator[np.ndarray]:
+        return self.router.stream(
+            "embed",
+            images,
+            lambda backend, items: backend.embedding_model.embed_stream(items),
+        )
+
+
+def create_router(
+    backend: str = "hailo",
+    fallback: str = "",
+    spill_queue: int = 2,
+    backend_options: Optional[dict] = None,
+) -> BackendRouter:
+    """
+    The router over the named backends (see create_backend);
+    backend_options holds the options of each backend by name.
+    """
+    backend_options = backend_options or {}
+    return BackendRouter(
+        create_backend(backend, **backend_options.get(backend, {})),
+        (
+            create_backend(fallback, **backend_options.get(fallback, {}))
+            if fallback
+            else None
+        ),
+        spill_queue=spill_queue,
+    )
+
+
+def create_router_from_config(backend: Optional[str] = None) -> BackendRouter:
+    """
+    create_router with the INFERENCE_* settings of ConfigClass; backend, if
+    given, replaces both INFERENCE_BACKEND and the fallback.
+    """
+    return create_router(
+        backend or ConfigClass.INFERENCE_BACKEND,
+        "" if backend else ConfigClass.INFERENCE_FALLBACK_BACKEND,
+        spill_queue=ConfigClass.INFERENCE_SPILL_QUEUE,
+        backend_options={
+            "cpu": dict(
+                detection_model=ConfigClass.CPU_DETECTION_MODEL,
+                embedding_model=ConfigClass.CPU_EMBEDDING_MODEL,
+            ),
+            "synthetic": dict(
+                call_ms=ConfigClass.SYNTHETIC_CALL_MS,
+                image_ms=ConfigClass.SYNTHETIC_IMAGE_MS,
+            ),
+        },
+    )
+
+
+if __name__ == "__main__":
+    # Recognition requests (a detection and the embeddings of its faces)
+    # through the scheduler, on a simulated accelerator alone vs with a
+    # slower simulated CPU taking the overflow:
+    #   python -m src.inference.router [--rate 40] [--cpu-slowdown 3]
+    import argparse
+    import random
+
+    from ..ai_session.scheduler import FairScheduler, InferenceJob
+    from ..face_rec.proc.backends import SyntheticBackend
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rate", type=float, default=40, help="requests/s")
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--call-ms", type=float, default=8, help="accelerator")
+    parser.add_argument("--image-ms", type=float, default=8, help="accelerator")
+    parser.add_argument("--cpu-slowdown", type=float, default=3)
+    args = parser.parse_args()
+    logger.remove()
+
+    rng = np.random.default_rng(0)
+    images = [
+        rng.integers(0, 256, size=(368, 640, 3), dtype=np.uint8) for _ in range(32)
+    ]
+
+    def simulate(with_fallback: bool):
+        accelerator = SyntheticBackend(args.call_ms, args.image_ms, name="accelerator")
+        cpu = SyntheticBackend(
+            args.call_ms * args.cpu_slowdown,
+            args.image_ms * args.cpu_slowdown,
+            name="cpu",
+        )
+        router = BackendRouter(accelerator, cpu if with_fallback else None)
+        done = {}
+
+        def recognize(job):
+            detected_faces = router.detector.detect(images[int(job.identifier) % 32])
+            crops = [
+                detected_faces.image[int(y1) : int(y1) + 112, int(x1) : int(x1) + 112]
+                for x1, y1, _, _ in detected_faces.boxes
+            ]
+            router.embedding_model.extract_face_embeddings(crops)
+            done[job.identifier] = time.perf_counter() - job.enqueued_at
+
+        scheduler = FairScheduler(
+            max_queue_per_session=args.requests,
+            max_queued=args.requests,
+            workers=2 if with_fallback else 1,
+        )
+        router.backlog = lambda: scheduler.queued
+        arrivals = random.Random(0)
+        start = time.perf_counter()
+        for index in range(args.requests):
+            time.sleep(arrivals.expovariate(args.rate))
+            scheduler.submit(
+                InferenceJob(
+                    sid=f"session{index % 8}", identifier=str(index), run=recognize
+                )
+            )
+        while len(done) < args.requests:
+            time.sleep(0.01)
+        elapsed = time.perf_counter() - start
+        scheduler.stop()
+        latencies = sorted(done.values())
+        return (
+            args.requests / elapsed,
+            latencies[len(latencies) // 2] * 1000,
+            latencies[int(0.99 * (len(latencies) - 1))] * 1000,
+            router.stats(),
+        )
+
+    print(
+        f"{args.rate} requests/s offered, accelerator {args.call_ms} ms per call "
+        f"+ {args.image_ms} ms per image, cpu {args.cpu_slowdown}x slower"
+    )
+    for label, with_fallback in [("accelerator", False), ("+ cpu spill", True)]:
+        throughput, p50, p99, stats = simulate(with_fallback)
+        print(
+            f"{label:>12}: {throughput:6.1f} requests/s, p50 {p50:7.1f} ms, "
+            f"p99 {p99:7.1f} ms, calls {stats.routed}, spilled {stats.spilled}, "
+            f"kept {stats.kept}"
+        )
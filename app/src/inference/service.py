@@ -0,0 +1,297 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from typing import List
+
+import numpy as np
+import zmq
+from loguru import logger
+
+from ..common import ConfigClass
+from ..face_rec.proc.backends import warm_up
+from ..face_rec.store import AnnIndexManager, VectorStoreMaintenance
+from . import transport
+
+DEFAULT_ADDRESS = "ipc:///tmp/ai_sessions-inference.sock"
+
+
+class InferenceService:
+    """
+    The one process that owns the models (and so the accelerator). Web
+    workers send it requests over a zmq ROUTER socket and get the model
+    outputs back. Requests run in arrival order on `workers` threads, one at
+    a time by default; more are useful with a router that spills to a
+    second backend. Once max_pending requests are running or waiting, the
+    next ones are answered "busy" right away instead of queueing without
+    bound. Requests whose client gave up (past the "deadline" of their
+    header) are dropped unanswered instead of run, and the payload files
+    older than timeout, replies to clients that gave up, are removed.
+
+    Requests name images by path (the uploads are on disk already) or carry
+    decoded frames; the arrays of requests and replies travel through
+    transport.pack / unpack, so images go by shared memory, not through the
+    socket. The models are created on the first request that needs them.
+
+    Operations, the "op" of the request header:
+        detect: frames (paths in "paths", None where the frame is an array)
+            -> per frame boxes, scores, landmarks and, for paths, the
+            decoded image
+        embed: crops -> one [N, D] float32 array, and the name of the model
+            in "embedder"
+        stats: counters of the service (and of the router's backends) and
+            whether the models are warmed up
+    """
+
+    def __init__(
+        self,
+        address: str = DEFAULT_ADDRESS,
+        detector=None,
+        embedding_model=None,
+        router=None,
+        workers: int = 1,
+        max_pending: int = 64,
+        timeout: float = 30.0,
+    ):
+        self.address = address
+        self.router = router
+        self._detector = detector or (router.detector if router else None)
+        self._embedding_model = embedding_model or (
+            router.embedding_model if router else None
+        )
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        # received, waiting for a worker
+        self.pending = 0
+        # received, not answered yet
+        self.in_flight = 0
+        if router and router.backlog is None:
+            router.backlog = lambda: self.pending
+        self.requests = 0
+        self.failed = 0
+        self.rejected = 0
+        self.expired = 0
+        self.images = 0
+        self.busy = 0.0
+        self.started = time.time()
+        self.warm_up_seconds = None
+        self._stop = False
+
+    @property
+    def detector(self):
+        if self._detector is None:
+            from ..face_rec.proc import face_detection
+
+            self._detector = face_detection.detector
+        return self._detector
+
+    @property
+    def embedding_model(self):
+        if self._embedding_model is None:
+            from ..face_rec.proc import face_detection
+
+            self._embedding_model = face_detection.embedding_model
+        return self._embedding_model
+
+    def warm_up(self):
+        """Loads and warms up the models (every backend of the router)."""
+        try:
+            if self.router:
+                seconds = self.router.warm_up()
+            else:
+                seconds = warm_up(self.detector, self.embedding_model)
+        except Exception as e:
+            logger.exception(f"inference service warm-up failed: {e}")
+            return
+        self.warm_up_seconds = seconds
+        logger.info(f"inference service warmed up in {seconds:.2f}s")
+
+    def serve(self, warm: bool = True):
+        """
+        Serves until stop(). With warm, the models are warmed up in the
+        background meanwhile; requests arriving before that is done wait
+        for the models like they would on a cold start.
+        """
+        transport.remove_stale()
+        if warm:
+            threading.Thread(
+                target=self.warm_up, name="inference-warm-up", daemon=True
+            ).start()
+        context = zmq.Context.instance()
+        socket = context.socket(zmq.ROUTER)
+        socket.bind(self.address)
+        # the workers hand their replies back to this thread, which alone
+        # uses the ROUTER socket
+        replies_address = f"inproc://inference-replies-{id(self)}"
+        replies = context.socket(zmq.PULL)
+        replies.bind(replies_address)
+        local = threading.local()
+
+        def work(envelope, frames):
+            with self._lock:
+                self.pending -= 1
+            if transport.expired(frames):
+                # the client is gone, nobody would read the reply
+                transport.discard(frames)
+                with self._lock:
+                    self.in_flight -= 1
+                    self.expired += 1
+                return
+            if not hasattr(local, "socket"):
+                local.socket = context.socket(zmq.PUSH)
+                local.socket.setsockopt(zmq.LINGER, 0)
+                local.socket.connect(replies_address)
+            reply = self.handle(frames)
+            with self._lock:
+                self.in_flight -= 1
+            local.socket.send_multipart(envelope + reply)
+
+        logger.info(
+            f"inference service listening on {self.address}, " f"{self.workers} workers"
+        )
+        poller = zmq.Poller()
+        poller.register(socket, zmq.POLLIN)
+        poller.register(replies, zmq.POLLIN)
+        pool = ThreadPoolExecutor(self.workers, thread_name_prefix="inference")
+        reaped = time.monotonic()
+        try:
+            while not self._stop:
+                # wake up now and then to notice stop()
+                events = dict(poller.poll(timeout=500))
+                if time.monotonic() - reaped >= self.timeout:
+                    transport.remove_stale(older_than=self.timeout)
+                    reaped = time.monotonic()
+                if socket in events:
+                    identity, empty, *frames = socket.recv_multipart(copy=False)
+                    with self._lock:
+                        full = self.in_flight >= self.max_pending
+                        if full:
+                            self.rejected += 1
+                        else:
+                            self.in_flight += 1
+                            self.pending += 1
+                    if full:
+                        transport.discard(frames)
+                        socket.send_multipart([identity, empty] + self._busy())
+                    else:
+                        pool.submit(work, [identity, empty], frames)
+                if replies in events:
+                    socket.send_multipart(replies.recv_multipart(copy=False))
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+            replies.close(linger=0)
+            socket.close(linger=0)
+
+    def stop(self):
+        self._stop = True
+
+    def _busy(self) -> List[bytes]:
+        return transport.pack(
+            {
+                "ok": False,
+                "error": f"inference service busy, {self.max_pending} requests "
+                "pending",
+            },
+            [],
+        )
+
+    def handle(self, frames: List) -> List[bytes]:
+        start = time.perf_counter()
+        with self._lock:
+            self.requests += 1
+        try:
+            header, arrays = transport.unpack(frames)
+            op = header.get("op")
+            if op == "detect":
+                reply = self._detect(header, arrays)
+            elif op == "embed":
+                reply = self._embed(arrays)
+            elif op == "stats":
+                reply = transport.pack({"ok": True, **self.stats()}, [])
+            else:
+                raise ValueError(f"unknown operation {op}")
+        except Exception as e:
+            with self._lock:
+                self.failed += 1
+            logger.exception(f"inference request failed: {e}")
+            reply = transport.pack({"ok": False, "error": str(e)}, [])
+        with self._lock:
+            self.busy += time.perf_counter() - start
+        return reply
+
+    def stats(self) -> dict:
+        uptime = time.time() - self.started
+        with self._lock:
+            stats = {
+                "requests": self.requests,
+                "failed": self.failed,
+                "rejected": self.rejected,
+                "expired": self.expired,
+                "pending": self.pending,
+                "images": self.images,
+                "workers": self.workers,
+                "busySeconds": round(self.busy, 3),
+                "warmedUp": self.warm_up_seconds is not None,
+                # summed over the workers
+                "utilization": round(self.busy / uptime, 3) if uptime > 0 else 0.0,
+            }
+        if self.router:
+            stats["backends"] = self.router.stats().model_dump()
+        return stats
+
+    def _detect(self, header: dict, arrays: List[np.ndarray]) -> List[bytes]:
+        arrays = iter(arrays)
+        frames = [
+            path if path is not None else next(arrays) for path in header["paths"]
+        ]
+        with self._lock:
+            self.images += len(frames)
+        if len(frames) == 1:
+            detections = [self.detector.detect(path=frames[0])]
+        else:
+            detections = self.detector.detect_batch(path=frames)
+        outputs = []
+        for path, detected_faces in zip(header["paths"], detections):
+            outputs += [
+                detected_faces.boxes,
+                detected_faces.scores,
+                detected_faces.landmarks,
+            ]
+            # the client has the frames it sent, only decoded files go back
+            if path is not None:
+                outputs.append(np.asarray(detected_faces.image))
+        return transport.pack({"ok": True}, outputs)
+
+    def _embed(self, arrays: List[np.ndarray]) -> List[bytes]:
+        crops = list(arrays[0]) if arrays else []
+        with self._lock:
+            self.images += len(crops)
+        vectors = self.embedding_model.extract_face_embeddings(crops)
+        return transport.pack(
+            {"ok": True, "embedder": getattr(self.embedding_model, "name", "")},
+            [np.stack(vectors) if vectors else np.zeros((0, 0), dtype=np.float32)],
+        )
+
+
+def create_maintenance_from_config(recogniser) -> VectorStoreMaintenance:
+    """
+    VectorStoreMaintenance (with approximate index updates and change log
+    compaction) of the store of recogniser, a FaceRecognizer, with the
+    VECTOR_STORE_* settings of ConfigClass. One process maintains a store:
+    the inference service when there is one, otherwise the single web
+    worker.
+    """
+    store = recogniser.faceVectorStore
+    return VectorStoreMaintenance(
+        store,
+        interval_seconds=ConfigClass.VECTOR_STORE_MAINTENANCE_INTERVAL,
+        max_fragments=ConfigClass.VECTOR_STORE_MAX_FRAGMENTS,
+        max_deleted_ratio=ConfigClass.VECTOR_STORE_MAX_DELETED_RATIO,
+        keep_versions_for=timedelta(hours=ConfigClass.VECTOR_STORE_KEEP_VERSIONS_HOURS),
+        index_manager=AnnIndexManager(
+            store, min_rows=ConfigClass.VECTOR_INDEX_MIN_ROWS
+        ),
+        compact_log=recogniser.StoreVersion.compact_changes,
+    )
@@ -0,0 +1,117 @@
+import json
+import os
+import tempfile
+import time
+import uuid
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+# Arrays of a message are sent inline as zmq frames up to this many bytes
+# in total, larger payloads (decoded images, batches of crops) go through
+# one memory-mapped file in a tmpfs directory instead
+INLINE_MAX_BYTES = 64 * 1024
+_ALIGNMENT = 64
+_PREFIX = "ai_sessions-inference-"
+
+
+def shared_directory() -> str:
+    """tmpfs directory for the payload files: /dev/shm when there is one."""
+    if os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK):
+        return "/dev/shm"
+    return tempfile.gettempdir()
+
+
+def pack(
+    header: dict, arrays: List[np.ndarray], directory: Optional[str] = None
+) -> List[bytes]:
+    """
+    The frames of a message: the JSON header followed by the arrays. The
+    header gets an "arrays" list describing them and, when they went to a
+    shared file, its "shared" path. The receiver of a shared file owns it
+    (unpack removes it).
+    """
+    arrays = [np.ascontiguousarray(array) for array in arrays]
+    descriptors = []
+    offset = 0
+    for array in arrays:
+        descriptors.append(
+            {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset}
+        )
+        offset += -(-array.nbytes // _ALIGNMENT) * _ALIGNMENT
+    header = {**header, "arrays": descriptors}
+    if offset <= INLINE_MAX_BYTES:
+        return [json.dumps(header).encode()] + [array.data for array in arrays]
+
+    path = os.path.join(directory or shared_directory(), _PREFIX + uuid.uuid4().hex)
+    shared = np.memmap(path, dtype=np.uint8, mode="w+", shape=(offset,))
+    for array, descriptor in zip(arrays, descriptors):
+        start = descriptor["offset"]
+        shared[start : start + array.nbytes] = array.reshape(-1).view(np.uint8)
+    del shared
+    header["shared"] = path
+    return [json.dumps(header).encode()]
+
+
+def unpack(frames: List) -> Tuple[dict, List[np.ndarray]]:
+    """
+    The header and the arrays of a message. Arrays of a shared file are
+    copy-on-write views of its mapping, nothing is copied; the file is
+    removed right away and the memory goes with the last view.
+    """
+    header = json.loads(bytes(frames[0]))
+    descriptors = header.pop("arrays", [])
+    path = header.pop("shared", None)
+    if path is None:
+        return header, [
+            np.frombuffer(frame, dtype=descriptor["dtype"]).reshape(descriptor["shape"])
+            for frame, descriptor in zip(frames[1:], descriptors)
+        ]
+
+    try:
+        shared = np.memmap(path, dtype=np.uint8, mode="c")
+    finally:
+        os.unlink(path)
+    arrays = []
+    for descriptor in descriptors:
+        dtype = np.dtype(descriptor["dtype"])
+        count = int(np.prod(descriptor["shape"]))
+        start = descriptor["offset"]
+        arrays.append(
+            shared[start : start + count * dtype.itemsize]
+            .view(dtype)
+            .reshape(descriptor["shape"])
+        )
+    return header, arrays
+
+
+def discard(frames: List):
+    """Removes the shared file of a message that won't be unpacked."""
+    header = json.loads(bytes(frames[0]))
+    path = header.get("shared")
+    if path and os.path.exists(path):
+        os.unlink(path)
+
+
+def expired(frames: List) -> bool:
+    """Whether the "deadline" (a time.time()) of a message has passed."""
+    deadline = json.loads(bytes(frames[0])).get("deadline")
+    return deadline is not None and time.time() > deadline
+
+
+def remove_stale(directory: Optional[str] = None, older_than: Optional[float] = None):
+    """
+    Removes the payload files left behind by processes that died or, with
+    older_than, only those written more than older_than seconds ago: the
+    replies nobody waited for anymore.
+    """
+    directory = directory or shared_directory()
+    before = time.time() - older_than if older_than is not None else None
+    for name in os.listdir(directory):
+        if name.startswith(_PREFIX):
+            path = os.path.join(directory, name)
+            try:
+                if before is None or os.stat(path).st_mtime < before:
+                    os.unlink(path)
+            except OSError:
+                pass
@@ -1,4 +1,5 @@
 from ..common import ConfigClass
+from ..common.readiness import readiness
 
 _info = """
 This API service offers microservices through a RESTful interface and supports socket for ai_session. \
@@ -11,3 +12,24 @@ class LandingPageModel:
     def __init__(self):
         self.name = ConfigClass.APP_NAME
         self.info = _info
+
+
+class HealthModel:
+    """The process is up and serving requests."""
+
+    def __init__(self):
+        self.status = "alive"
+        self.uptimeSeconds = readiness.uptime()
+
+
+class ReadinessModel:
+    """
+    The models are warmed up and the stores open; waiting has the reason of
+    every part that isn't ready yet. Along with the startup timings.
+    """
+
+    def __init__(self):
+        self.waiting = readiness.check()
+        self.ready = not self.waiting
+        for name, value in readiness.metrics().items():
+            setattr(self, name, value)
@@ -3,7 +3,7 @@ from flask_smorest import Blueprint
 from marshmallow import Schema, fields
 
 from ..common.error_handler import custom_error_handler
-from .model import LandingPageModel
+from .model import HealthModel, LandingPageModel, ReadinessModel
 
 
 class LandingPageResultSchema(Schema):
@@ -11,6 +11,21 @@ class LandingPageResultSchema(Schema):
     info = fields.Str(required=True)
 
 
+class HealthResultSchema(Schema):
+    status = fields.Str(required=True)
+    uptimeSeconds = fields.Float(required=True)
+
+
+class ReadinessResultSchema(Schema):
+    ready = fields.Bool(required=True)
+    waiting = fields.Dict(keys=fields.Str(), values=fields.Str(), required=True)
+    uptimeSeconds = fields.Float(required=True)
+    importSeconds = fields.Float(allow_none=True)
+    appSeconds = fields.Float(allow_none=True)
+    warmUpSeconds = fields.Float(allow_none=True)
+    timeToReadySeconds = fields.Float(allow_none=True)
+
+
 def register_main_resources(*, bp: Blueprint):
     @bp.route("/")
     class LandingPage(MethodView):
@@ -19,3 +34,22 @@ def register_main_resources(*, bp: Blueprint):
         def get(self):
             page = LandingPageModel()
             return page
+
+    # Cheap probes for the monitor and the orchestrator: /healthz answers as
+    # long as the process serves requests, /readyz only once the models are
+    # warm and the stores open (503 until then)
+    @bp.route("/healthz")
+    class Health(MethodView):
+        @custom_error_handler
+        @bp.response(200, HealthResultSchema)
+        def get(self):
+            return HealthModel()
+
+    @bp.route("/readyz")
+    class Readiness(MethodView):
+        @custom_error_handler
+        @bp.response(200, ReadinessResultSchema)
+        @bp.alt_response(503, schema=ReadinessResultSchema)
+        def get(self):
+            readiness = ReadinessModel()
+            return readiness, 200 if readiness.ready else 503
@@ -1,27 +1,30 @@
 #!/bin/bash
 
 # A script to monitor local services and manage their Avahi broadcasting.
-# It checks a list of services (format: prefix@port) every second.
-# If a service is healthy (HTTP 200), it uses 'cl_avahi_manager.sh' to start its
+# It checks a list of services (format: prefix@port[/path]) every few seconds.
+# If a service is healthy (HTTP 200 on path, default /), it uses 'cl_avahi_manager.sh' to start its
 # Avahi broadcast. If the service is down, it stops the broadcast.
 
 
 
 # --- Help function to display usage information ---
 show_help() {
-  echo "Usage: $0 [service_prefix@port] ..."
+  echo "Usage: $0 [service_prefix@port[/path]] ..."
   echo
   echo "This script monitors HTTP services and manages Avahi mDNS broadcasting."
   echo "It requires '/usr/local/bin/cl_avahi_manager.sh'."
   echo
   echo "Arguments:"
-  echo "  service_prefix@port   One or more services to monitor, in the format 'name@port'."
+  echo "  service_prefix@port[/path]"
+  echo "                        One or more services to monitor, in the format 'name@port'."
+  echo "                        The service is up while GET path (default /) answers 200,"
+  echo "                        e.g. a readiness probe like 'ai@5002/readyz'."
   echo
   echo "Options:"
   echo "  -h, --help            Show this help message and exit."
   echo
   echo "Example:"
-  echo "  sudo $0 server1@8080 server2@9000"
+  echo "  sudo $0 server1@8080 server2@9000/readyz"
 }
 
 # --- Check for root privileges ---
@@ -153,7 +156,12 @@ while true; do
     for service_arg in "$@"; do
         # Extract the service prefix and port
         service_prefix=$(echo "$service_arg" | cut -d'@' -f1 | sed 's/^-//')
-        port=$(echo "$service_arg" | cut -d'@' -f2)
+        endpoint=$(echo "$service_arg" | cut -d'@' -f2)
+        port=${endpoint%%/*}
+        path="/"
+        if [[ "$endpoint" == */* ]]; then
+            path="/${endpoint#*/}"
+        fi
 
         if [ -z "$service_prefix" ] || [ -z "$port" ]; then
             echo "Invalid argument format: $service_arg. Skipping."
@@ -161,7 +169,7 @@ while true; do
         fi
 
         # Check service health with curl
-        http_code=$(curl -s -o /dev/null -w "%{http_code}" --connect-timeout 2 "http://$IP:$port")
+        http_code=$(curl -s -o /dev/null -w "%{http_code}" --connect-timeout 2 --max-time 5 "http://$IP:$port$path")
 
         current_state="down"
         if [ "$http_code" -eq 200 ]; then
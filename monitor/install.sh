@@ -41,7 +41,7 @@ Description=Cloud on Lap Service Monitor
 After=network-online.target
 
 [Service]
-ExecStart=$SYSTEM_SCRIPT_DIR/cl_monitor.sh -repo@5001 -ai@5002
+ExecStart=$SYSTEM_SCRIPT_DIR/cl_monitor.sh -repo@5001 -ai@5002/readyz
 Restart=always
 User=root
 